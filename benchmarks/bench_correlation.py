@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+'''Benchmark of the streaming multi-tau correlator against a dense numpy
+reference (binning at full resolution, explicit products per lag).
+
+usage: python benchmarks/bench_correlation.py [n_photons] [duration]
+'''
+
+import sys
+import time
+
+import numpy as np
+
+from pysimfs.analysis import correlate
+
+###############################################################################
+def reference(t, resolution, levels, channels, duration):
+    ticks = int(np.ceil(duration/resolution))
+    n = np.bincount((t/resolution).astype('i8'), minlength=ticks).astype('f8')
+    N = n.sum()
+    G = []
+    for level in range(levels):
+        w = 2**level
+        Tl = -(-ticks//w)
+        x = np.pad(n, (0, Tl*w-ticks)).reshape(Tl, w).sum(1)
+        lags = range(1, channels) if level == 0 else range(channels//2, channels)
+        for j in lags:
+            G.append(np.dot(x[:-j], x[j:])/(Tl-j)*Tl**2/N**2-1)
+    return np.array(G)
+
+###############################################################################
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    res = f(*args, **kwargs)
+    return res, time.perf_counter()-start
+
+###############################################################################
+if __name__ == '__main__':
+
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    resolution, levels, channels = 1e-7, 20, 16
+
+    rng = np.random.default_rng(0)
+    t = np.sort(rng.uniform(0, duration, n))
+
+    (_, G), t_stream = timed(
+        correlate, t, resolution=resolution, levels=levels,
+        channels=channels, duration=duration
+    )
+    G_ref, t_ref = timed(reference, t, resolution, levels, channels, duration)
+
+    print(f'{n} photons, {duration} s at {resolution} s resolution')
+    print(f'streaming multi-tau : {t_stream:8.3f} s')
+    print(f'dense reference     : {t_ref:8.3f} s')
+    print(f'max abs deviation   : {np.abs(G-G_ref).max():.2e}')
@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+
+'''Benchmark of building large simulation graphs with Simulation.add.
+
+usage: python benchmarks/bench_graph.py [n_chains]
+'''
+
+import os
+import sys
+import time
+
+from pysimfs import Simulation, Diffusion, Excitation
+
+###############################################################################
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    comps = []
+    for i in range(n):
+        comps.append(Diffusion(
+            coordinate_output=f'coords{i}', collision_output=os.devnull, seed=i
+        ))
+        comps.append(Excitation(input=f'coords{i}', output=f'flux{i}'))
+
+    S = Simulation(tmpdir='./bench_tmp', datadir='./bench_data')
+    start = time.perf_counter()
+    for c in comps:
+        S.add(c)
+    t_add = time.perf_counter()-start
+
+    start = time.perf_counter()
+    S.remap()
+    t_remap = time.perf_counter()-start
+
+    print(f'{len(comps)} components, {len(S.matched)} pipes')
+    print(f'add   : {t_add:8.3f} s ({1e6*t_add/len(comps):.1f} us per component)')
+    print(f'remap : {t_remap:8.3f} s')
+    S.clear()
+    os.rmdir('./bench_data')
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+'''Benchmark of image reconstruction of a raster scan: simfs_img against
+the NumPy ImageBuilder, from the same coordinate and photon files.
+
+usage: python benchmarks/bench_image.py [pixels_per_line] [photons_per_pixel]
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from pysimfs import Imager, RasterScan, Simulation
+from pysimfs.analysis import image
+
+###############################################################################
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    per_pixel = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    scan = RasterScan((-1e-5, 1e-5, n), (-1e-5, 1e-5, n), dwell=1e-5)
+    coords = scan.write('./bench_scan.coords')
+    rng = np.random.default_rng(0)
+    photons = np.sort(rng.uniform(0, scan.duration, int(per_pixel*n*n)))
+    photons.tofile('./bench_scan.photons')
+    grid = ((-1e-5, 1e-5, n), (-1e-5, 1e-5, n), (0.0, 0.0, 1))
+    print(f'{n}x{n} pixels, {len(photons)} photons')
+
+    with Simulation(tmpdir='./bench_tmp', datadir='./bench_data') as S:
+        S.add(Imager(
+            coordinate_inputs=[coords], time_inputs=['./bench_scan.photons'],
+            output_file='./bench_scan.img',
+            grid={a: dict(min=lo, max=hi, n=k) for a, (lo, hi, k) in zip('xyz', grid)}
+        ))
+        start = time.perf_counter()
+        S.run()
+        t_img = time.perf_counter()-start
+    print(f'simfs_img    {t_img:6.2f} s')
+
+    start = time.perf_counter()
+    counts = image(coords, './bench_scan.photons', grid)
+    t_np = time.perf_counter()-start
+    print(f'ImageBuilder {t_np:6.2f} s ({len(photons)/t_np/1e6:.1f} M photons/s)')
+
+    for f in ('./bench_scan.coords', './bench_scan.photons', './bench_scan.img'):
+        os.remove(f)
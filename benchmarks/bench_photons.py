@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+
+'''Benchmark of the photon statistics analyzers on a stream of routed
+photons (two channels, background and bursts), generated block by block.
+
+usage: python benchmarks/bench_photons.py [n_photons]
+'''
+
+import sys
+import time
+
+import numpy as np
+
+from pysimfs import routed_t
+from pysimfs.analysis import (
+    BurstSearch, CountTrace, InterPhotonHistogram, TCSPCHistogram, analyze
+)
+
+###############################################################################
+def photons(n, chunk_size=1<<22, seed=0):
+    '''Background at 1e5 counts/s with bursts of 100 photons within 1 ms'''
+    rng = np.random.default_rng(seed)
+    start = 0.0
+    for i in range(0, n, chunk_size):
+        k = min(chunk_size, n-i)
+        background = start + np.cumsum(rng.exponential(1e-5, k - k//1000*100))
+        bursts = np.repeat(rng.uniform(start, background[-1], k//1000), 100)
+        bursts += rng.uniform(0, 1e-3, len(bursts))
+        chunk = np.empty(k, routed_t)
+        chunk['t'] = np.sort(np.concatenate((background, bursts)))
+        chunk['channel'] = rng.integers(0, 2, k)
+        start = chunk['t'][-1]
+        yield chunk
+
+###############################################################################
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000_000
+
+    start = time.perf_counter()
+    for _ in photons(n):
+        pass
+    t_gen = time.perf_counter()-start
+    print(f'{n} photons, generated in {t_gen:.2f} s')
+
+    for analyzer in [
+        CountTrace(1e-3, channels=2),
+        InterPhotonHistogram(np.logspace(-9, -2, 71)),
+        TCSPCHistogram(2.5e-8, 256, channels=2),
+        BurstSearch(10, 2e-4, 30, channels=2),
+    ]:
+        start = time.perf_counter()
+        analyze(photons(n), analyzer)
+        t = time.perf_counter()-start - t_gen
+        print(
+            f'{analyzer.__class__.__name__:20} {t:6.2f} s '
+            f'({n/t/1e6:6.1f} M photons/s)'
+        )
@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+
+'''Benchmark of the pipe buffer size (Simulation pipe_capacity) on the
+throughput of a diffusion -> excitation -> fluorophore chain.
+
+usage: python benchmarks/bench_pipes.py [experiment_time] [repeats]
+'''
+
+import os
+import sys
+import time
+
+from pysimfs import Simulation, Diffusion, Excitation, Fluorophore
+from pysimfs.pipe.unix_pipe import max_capacity
+
+###############################################################################
+def chain(experiment_time):
+    return [
+        Diffusion(
+            experiment_time=experiment_time, increment=1e-6, seed=1,
+            coordinate_output='coords', collision_output=os.devnull
+        ),
+        Excitation(input='coords', output='flux'),
+        Fluorophore(jablonsky={
+            'exi': {'from': 'S0', 'to': 'S1', 'rate': {'input': 'flux', 'epsilon': 1e5}},
+            'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': os.devnull},
+        }),
+    ]
+
+###############################################################################
+def run(experiment_time, capacity):
+    S = Simulation(
+        tmpdir='./bench_tmp', datadir='./bench_data', pipe_capacity=capacity
+    )
+    for c in chain(experiment_time):
+        S.add(c)
+    start = time.perf_counter()
+    S.run()
+    wall = time.perf_counter()-start
+    S.clear()
+    return wall
+
+###############################################################################
+if __name__ == '__main__':
+
+    experiment_time = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    records = int(experiment_time/1e-6)
+
+    limit = max_capacity() or 1<<16
+    capacities = [None] + [c for c in (1<<18, 1<<20, 4<<20) if c <= limit]
+
+    results = []
+    for capacity in capacities:
+        wall = min(run(experiment_time, capacity) for _ in range(repeats))
+        results.append((capacity, wall))
+    os.rmdir('./bench_data')
+
+    base = results[0][1]
+    print(f'{records} coordinate records, best of {repeats}')
+    for capacity, wall in results:
+        label = 'default' if capacity is None else f'{capacity >> 10} KiB'
+        print(f'{label:>10} : {wall:7.3f} s  {records/wall/1e6:6.2f} M records/s  x{base/wall:.2f}')
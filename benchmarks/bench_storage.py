@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+
+'''Benchmark of compact record files against raw timetag files: size,
+conversion and load time, and reading a short time range.
+
+usage: python benchmarks/bench_storage.py [n_photons]
+'''
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from pysimfs import timetag_t
+from pysimfs.storage import TickReader, codecs, compact_file
+from pysimfs.utils import map_file
+
+###############################################################################
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+
+    # Poisson photons at 1e5 counts/s
+    rng = np.random.default_rng(0)
+    photons = np.cumsum(rng.exponential(1e-5, n))
+    duration = photons[-1]
+    raw = './bench_photons.raw'
+    photons.tofile(raw)
+
+    start = time.perf_counter()
+    np.array(map_file(raw, timetag_t))
+    t_raw = time.perf_counter()-start
+    size_raw = os.path.getsize(raw)
+    print(f'{n} photons, raw {size_raw/1e6:.1f} MB, load {t_raw:.3f} s')
+
+    for resolution in (1e-12, 1e-9):
+        for codec in sorted(codecs()):
+            fn = './bench_photons.tick'
+            start = time.perf_counter()
+            compact_file(raw, fn, timetag_t, resolution=resolution, codec=codec)
+            t_write = time.perf_counter()-start
+
+            r = TickReader(fn)
+            start = time.perf_counter()
+            r.read()
+            t_read = time.perf_counter()-start
+            start = time.perf_counter()
+            r.read(duration/2, duration/2 + 1.0)
+            t_range = time.perf_counter()-start
+
+            size = os.path.getsize(fn)
+            print(
+                f'{resolution:6.0e} s {codec:5}: {size/1e6:8.1f} MB '
+                f'(x{size_raw/size:4.2f})  write {t_write:6.3f} s  '
+                f'load {t_read:6.3f} s  1 s range {1e3*t_range:6.1f} ms'
+            )
+            os.remove(fn)
+    os.remove(raw)
@@ -22,7 +22,7 @@ for comp in ['simfs_exi', 'simfs_det', 'simfs_pre', 'simfs_pls']:
 for comp in ['simfs_ph2']:
     assert find_component(comp, 'ph2'), f'ph2/{comp} not found in {cmp_dir}'
 
-for comp in ['simfs_buf', 'simfs_spl', 'simfs_mix', 'simfs_img']:
+for comp in ['simfs_buf', 'simfs_spl', 'simfs_mix', 'simfs_img', 'simfs_t3r']:
     assert find_component(comp, 'utl'), f'utl/{comp} not found in {cmp_dir}'
 
 print(f'All simfs components found in {cmp_dir}.')
@@ -33,13 +33,31 @@ ComponentLog = namedtuple('ComponentLog', ['params', 'error'])
 coordinate_t = np.dtype([('x', 'f8'), ('y', 'f8'),('z', 'f8'), ('t', 'f8')])
 timed_value_t = np.dtype([('v', 'f8'), ('t', 'f8')])
 timetag_t = np.dtype('f8')
+routed_t = np.dtype([('t', 'f8'), ('channel', 'i8')])
 
 from . component import *
+from . import cache
+from . sweep import Sweep, SweepResult, grid
+from . shard import Shards
+from . ensemble import Ensemble
+from . batch import Batch
+from . sink import Sink, CallbackSink, ArraySink, HistogramSink, FileSink, CompactSink
+from . storage import TickWriter, TickReader, compact_file, read_compact
+from . report import RunReport, ProcessStats, PipeStats
+from . check import GraphError, DeadlockError
+from . stop import StopCondition, PhotonCount, SimulatedTime
+from . t3r import T3RFile, read_t3r
+from . inprocess import (
+    InProcessShift, InProcessMixer, InProcessSplitter,
+    InProcessCoordinateBuffer, InProcessTimedValueBuffer, InProcessTimetagBuffer
+)
+from . scan import Scan, GridScan, RasterScan, LineScan, PointScan, ScanSource
 from . import pipe
 
 from . presets import *
 from . import mocks
 from . import utils
+from . import analysis
 
 try:
     ip = get_ipython()
@@ -0,0 +1,6 @@
+from . correlation import Correlator, CorrelationSink, correlate
+from . image import ImageBuilder, ImageSink, image
+from . photons import (
+    CountTrace, InterPhotonHistogram, TCSPCHistogram, BurstSearch, PhotonSink,
+    analyze, fret_efficiency
+)
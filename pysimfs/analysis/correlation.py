@@ -0,0 +1,318 @@
+import threading
+
+import numpy as np
+
+from .. import timetag_t
+from .. sink import Sink
+from .. utils import iter_chunks
+
+# bins per source up to which pair_sums uses dense dot products
+DENSE_FACTOR = 32
+DENSE_MAX = 1<<25
+
+###############################################################################
+def coarsen(ticks: np.ndarray, weights: np.ndarray, shift: int=1):
+    ''' Merge sorted integer timetags into bins of 2**shift ticks
+
+    Arguments
+    ticks : sorted integer timetags
+    weights : photon count of each timetag
+    shift : number of halvings of the time resolution
+
+    Returns
+    (ticks, weights) of the occupied coarse bins
+    '''
+
+    ticks = ticks >> shift
+    if len(ticks) == 0:
+        return ticks, weights
+    first = np.empty(len(ticks), dtype=bool)
+    first[0] = True
+    np.not_equal(ticks[1:], ticks[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    return ticks[starts], np.add.reduceat(weights, starts)
+
+###############################################################################
+def pair_sums(src_t, src_w, dst_t, dst_w, lags, block=1<<15) -> np.ndarray:
+    ''' Sum of src_w[i]*dst_w[k] over all pairs with dst_t[k] == src_t[i]+lag
+
+    Densely occupied ranges are binned and correlated with dot products,
+    sparse ones with searchsorted lookups of the occupied bins only.
+
+    Arguments
+    src_t, src_w : sorted source ticks and weights
+    dst_t, dst_w : sorted target ticks and weights
+    lags : integer lags
+    block : number of sources processed at once (bounds memory)
+
+    Returns
+    array of sums, one per lag
+    '''
+
+    sums = np.zeros(len(lags))
+    if len(src_t) == 0 or len(dst_t) == 0:
+        return sums
+
+    start = src_t[0]
+    keep = (dst_t > start) & (dst_t <= src_t[-1]+lags[-1])
+    dst_t, dst_w = dst_t[keep], dst_w[keep]
+    if len(dst_t) == 0:
+        return sums
+
+    length = int(max(src_t[-1], dst_t[-1]) - start + 1)
+    if length <= min(DENSE_FACTOR*len(src_t), DENSE_MAX):
+        xs = np.bincount(src_t-start, src_w, minlength=length)
+        xd = np.bincount(dst_t-start, dst_w, minlength=length)
+        for k, lag in enumerate(lags):
+            if lag < length:
+                sums[k] = np.dot(xs[:length-lag], xd[lag:])
+        return sums
+
+    for i in range(0, len(src_t), block):
+        targets = src_t[i:i+block, None] + lags[None, :]
+        idx = np.searchsorted(dst_t, targets)
+        np.minimum(idx, len(dst_t)-1, out=idx)
+        hit = dst_t[idx] == targets
+        sums += (src_w[i:i+block, None] * np.where(hit, dst_w[idx], 0)).sum(axis=0)
+    return sums
+
+###############################################################################
+class _Stream:
+
+    '''Per level buffer of a photon stream: occupied bins with their weights,
+    and the last bin, which may still receive photons.'''
+
+    def __init__(self):
+        self.t = np.empty(0, dtype='i8')
+        self.w = np.empty(0, dtype='i8')
+        self.open_bin = 0
+
+    def append(self, t, w):
+        if len(t) == 0:
+            return
+        if len(self.t) and self.t[-1] == t[0]:
+            self.w[-1] += w[0]
+            t, w = t[1:], w[1:]
+        self.t = np.concatenate((self.t, t))
+        self.w = np.concatenate((self.w, w))
+        self.open_bin = self.t[-1]
+
+    def drop_until(self, tick):
+        '''Remove bins before tick'''
+        i = np.searchsorted(self.t, tick)
+        self.t, self.w = self.t[i:], self.w[i:]
+
+###############################################################################
+class Correlator:
+
+    '''Streaming multi-tau auto- and cross-correlation of photon timetags.
+
+    Timetags (in seconds, timetag_t) are fed block by block with update, in
+    time order. They are discretized to resolution and correlated on
+    levels of log-spaced lags: level 0 covers lags 1..channels-1 ticks,
+    every further level doubles the bin width and covers lags
+    channels/2..channels-1 in its bin width. Lag sums are evaluated with
+    vectorized searchsorted lookups on the occupied bins only, so the cost
+    scales with the number of photons, not with the measurement time.
+
+    Only bins within the longest lag of each level are buffered, so memory
+    is bounded for arbitrarily long streams. Correlators of replicas of the
+    same experiment can be combined with merge before normalization.
+
+    Example
+    c = Correlator(resolution=1e-8)
+    for chunk in S.iter_results(photons):
+        c.update(chunk)
+    tau, G = c.finalize(duration=experiment_time)
+    '''
+
+    def __init__(self, resolution=1e-8, levels=24, channels=16, cross=False):
+        assert channels % 2 == 0, 'channels must be even'
+        self.resolution = resolution
+        self.levels = levels
+        self.channels = channels
+        self.cross = cross
+
+        self.lags = [np.arange(1, channels)] + [
+            np.arange(channels//2, channels) for _ in range(1, levels)
+        ]
+        self.C = [np.zeros(len(l)) for l in self.lags]
+        self.M = [np.zeros(len(l)) for l in self.lags]
+        self.T = np.zeros(levels)
+        self.n_a = 0
+        self.n_b = 0
+        self.last_tick = -1
+
+        self._a = [_Stream() for _ in range(levels)]
+        self._b = [_Stream() for _ in range(levels)] if cross else self._a
+        self._lock = threading.Lock()
+        self.finalized = False
+
+    ###########################################################################
+    @property
+    def tau(self) -> np.ndarray:
+        '''Lag times in seconds'''
+        return np.concatenate([
+            l*2**i*self.resolution for i, l in enumerate(self.lags)
+        ])
+
+    ###########################################################################
+    def _ticks(self, timetags):
+        ticks = np.asarray(timetags, dtype=timetag_t)/self.resolution
+        return ticks.astype('i8')
+
+    ###########################################################################
+    def update(self, a=None, b=None):
+        ''' Add new timetags
+
+        Arguments
+        a : timetags of the (first) channel
+        b : timetags of the second channel (cross-correlation only)
+        '''
+
+        assert not self.finalized, 'Correlator is finalized.'
+        assert b is None or self.cross, 'b is only used for cross-correlation'
+        with self._lock:
+            for timetags, streams in ((a, self._a), (b, self._b)):
+                if timetags is None or len(timetags) == 0:
+                    continue
+                t, w = coarsen(
+                    self._ticks(timetags), np.ones(len(timetags), dtype='i8'), 0
+                )
+                if streams is self._a:
+                    self.n_a += len(timetags)
+                if streams is self._b:
+                    self.n_b += len(timetags)
+                self.last_tick = max(self.last_tick, t[-1])
+                for level, s in enumerate(streams):
+                    if level:
+                        t, w = coarsen(t, w)
+                    s.append(t, w)
+            self._correlate(final=False)
+
+    ###########################################################################
+    def _correlate(self, final):
+        for level in range(self.levels):
+            a, b, lags = self._a[level], self._b[level], self.lags[level]
+            if final:
+                n = len(a.t)
+            else:
+                # sources need complete bins and complete targets
+                limit = min(a.open_bin, b.open_bin - lags[-1])
+                n = np.searchsorted(a.t, limit)
+            if n == 0:
+                continue
+            self.C[level] += pair_sums(a.t[:n], a.w[:n], b.t, b.w, lags)
+            done = a.t[n-1]+1
+            a.drop_until(done)
+            if b is not a:
+                b.drop_until(done)
+
+    ###########################################################################
+    def finalize(self, duration=None):
+        ''' Correlate the remaining buffered photons and normalize
+
+        Arguments
+        duration : measurement time in seconds (default: last timetag)
+
+        Returns
+        (tau, G) with G(tau) = <n_a(t) n_b(t+tau)>/(<n_a><n_b>) - 1
+        '''
+
+        with self._lock:
+            if not self.finalized:
+                self._correlate(final=True)
+                ticks = self.last_tick+1
+                if duration is not None:
+                    ticks = max(ticks, int(np.ceil(duration/self.resolution)))
+                for level, lags in enumerate(self.lags):
+                    T = -(-ticks // 2**level)
+                    self.T[level] += T
+                    self.M[level] += np.maximum(T - lags, 0)
+                self.finalized = True
+        return self.tau, self.G
+
+    ###########################################################################
+    @property
+    def G(self) -> np.ndarray:
+        n_b = self.n_b if self.cross else self.n_a
+        G = []
+        for C, M, T in zip(self.C, self.M, self.T):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                G.append(C/M * T**2/(self.n_a*n_b) - 1)
+        return np.concatenate(G)
+
+    ###########################################################################
+    def merge(self, other):
+        ''' Pool the lag sums of another finalized correlator (a replica with
+        identical settings) into this one
+
+        Returns
+        self
+        '''
+
+        assert self.finalized and other.finalized, 'Finalize before merging.'
+        assert (self.resolution, self.levels, self.channels, self.cross) == \
+            (other.resolution, other.levels, other.channels, other.cross)
+        for level in range(self.levels):
+            self.C[level] += other.C[level]
+            self.M[level] += other.M[level]
+        self.T += other.T
+        self.n_a += other.n_a
+        self.n_b += other.n_b
+        return self
+
+###############################################################################
+def correlate(a, b=None, resolution=1e-8, levels=24, channels=16,
+        duration=None, chunk_size=1<<20):
+    ''' Multi-tau correlation of timetag arrays or files
+
+    Arguments
+    a : timetags (array, memmap or filename) of the first channel
+    b : timetags of the second channel for cross-correlation (optional)
+    resolution, levels, channels : see Correlator
+    duration : measurement time in seconds (default: last timetag)
+    chunk_size : number of timetags processed at once
+
+    Returns
+    (tau, G)
+    '''
+
+    def chunks(x):
+        if isinstance(x, str):
+            return iter_chunks(x, timetag_t, chunk_size)
+        return (x[i:i+chunk_size] for i in range(0, len(x), chunk_size))
+
+    c = Correlator(resolution, levels, channels, cross=b is not None)
+    if b is None:
+        for chunk in chunks(a):
+            c.update(chunk)
+    else:
+        # feed both channels in order of time so buffers stay small
+        ia, ib = chunks(a), chunks(b)
+        ca, cb = next(ia, None), next(ib, None)
+        while ca is not None or cb is not None:
+            if cb is None or (ca is not None and ca[-1] <= cb[-1]):
+                c.update(a=ca)
+                ca = next(ia, None)
+            else:
+                c.update(b=cb)
+                cb = next(ib, None)
+    return c.finalize(duration)
+
+###############################################################################
+class CorrelationSink(Sink):
+
+    '''Sink that feeds a live timetag stream into a Correlator.
+
+    For cross-correlation, attach two sinks with channel 'a' and 'b' to the
+    same Correlator.
+    '''
+
+    def __init__(self, input, correlator, channel='a', chunk_size=1<<16):
+        super().__init__(input, timetag_t, chunk_size)
+        self.correlator = correlator
+        self.channel = channel
+
+    def consume(self, chunk):
+        self.correlator.update(**{self.channel: chunk})
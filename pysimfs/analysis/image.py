@@ -0,0 +1,230 @@
+import threading
+
+import numpy as np
+
+from .. import coordinate_t, timetag_t
+from .. sink import Sink
+from .. utils import GridData, iter_chunks
+
+###############################################################################
+def grid_spec(grid):
+    ''' Grid as three (min, max, n)
+
+    Arguments
+    grid : grid of Imager params ({'x': {'min', 'max', 'n'}, ...}) or three
+           (min, max, n) for x, y and z
+    '''
+
+    if isinstance(grid, dict):
+        grid = [(grid[a]['min'], grid[a]['max'], grid[a]['n']) for a in 'xyz']
+    return tuple(GridData.LinSpace(float(lo), float(hi), int(n)) for lo, hi, n in grid)
+
+###############################################################################
+class ImageBuilder:
+
+    '''Photon counts per grid point of scanned coordinates, as simfs_img.
+
+    Every channel (e.g. a detector) pairs a coordinate_t stream with a
+    timetag stream. A photon is counted at the grid point of the latest
+    coordinate at or before its time. Both streams are fed block by
+    block in time order with update. As soon as a later coordinate (or the
+    end of the coordinate stream) fixes the position of photons, the photons
+    per coordinate are found with searchsorted and summed per grid point
+    with bincount, so only the pending tail of the streams is buffered.
+
+    Grid point i of an axis covers [min + i*delta, min + (i+1)*delta) with
+    binning='floor' (as simfs_img), or the positions nearest to it with
+    binning='nearest', which suits scans of the grid points themselves (see
+    pysimfs.scan). Positions outside of the grid are counted at its border.
+    Unlike simfs_img, photons before the first coordinate are not counted.
+
+    Example
+    b = ImageBuilder(((-1e-6, 1e-6, 1024), (-1e-6, 1e-6, 1024), (0, 0, 1)))
+    b.update(0, coordinates=coords, photons=photons)
+    counts = b.finalize()[0]   # (1024, 1024, 1) counts of channel 0
+    '''
+
+    def __init__(self, grid, channels=1, binning='floor'):
+        if binning not in ('floor', 'nearest'):
+            raise ValueError(f'Unknown binning {binning}.')
+        self.grid = grid_spec(grid)
+        self.binning = binning
+        self.shape = tuple(d.n for d in self.grid)
+        self.channels = channels
+        self.counts = np.zeros((channels,) + self.shape, 'u8')
+        self.photons = np.zeros(channels, 'i8')
+        self.dropped = np.zeros(channels, 'i8')
+        # pending coordinates as start times and flat grid indices
+        self._times = [np.empty(0, 'f8') for _ in range(channels)]
+        self._index = [np.empty(0, 'i8') for _ in range(channels)]
+        self._photons = [np.empty(0, timetag_t) for _ in range(channels)]
+        self._closed = [set() for _ in range(channels)]
+        self._lock = threading.Lock()
+
+    ###########################################################################
+    def grid_index(self, coords) -> np.ndarray:
+        '''Flat index of the grid points of coords'''
+        bin = np.floor if self.binning == 'floor' else np.rint
+        index = np.zeros(len(coords), 'i8')
+        for axis, d in zip('xyz', self.grid):
+            index *= d.n
+            if d.n > 1:
+                i = bin((coords[axis] - d.min) * ((d.n-1)/(d.max-d.min)))
+                index += np.clip(i, 0, d.n-1).astype('i8')
+        return index
+
+    ###########################################################################
+    def update(self, channel=0, coordinates=None, photons=None):
+        ''' Add blocks of the streams of a channel
+
+        Arguments
+        channel : index of the channel
+        coordinates : next coordinate_t records of the channel
+        photons : next time tags of the channel
+        '''
+
+        def append(pending, new):
+            return np.concatenate((pending, new)) if len(pending) else new
+
+        with self._lock:
+            if coordinates is not None and len(coordinates):
+                self._times[channel] = append(self._times[channel], coordinates['t'])
+                self._index[channel] = append(
+                    self._index[channel], self.grid_index(coordinates)
+                )
+            if photons is not None and len(photons):
+                self._photons[channel] = append(self._photons[channel], photons)
+            self._count(channel)
+
+    ###########################################################################
+    def close(self, channel, stream):
+        '''Mark the 'coordinates' or 'photons' stream of channel as complete'''
+        with self._lock:
+            self._closed[channel].add(stream)
+            self._count(channel)
+
+    ###########################################################################
+    def _count(self, channel):
+        times, photons = self._times[channel], self._photons[channel]
+        if len(times) == 0 or len(photons) == 0:
+            return
+        # photons before the last coordinate have their final position
+        if 'coordinates' in self._closed[channel]:
+            n = len(photons)
+        else:
+            n = np.searchsorted(photons, times[-1], 'left')
+        if n == 0:
+            return
+
+        # the coordinates in effect during the ready photons, the photons of
+        # each of them follow from the first photon at or after its time
+        ready = photons[:n]
+        lo = max(0, np.searchsorted(times, ready[0], 'right') - 1)
+        hi = np.searchsorted(times, ready[-1], 'right')
+        first = np.searchsorted(ready, times[lo:hi], 'left')
+        per_coordinate = np.diff(first, append=n)
+        counted = int(per_coordinate.sum())
+        self.counts[channel] += np.bincount(
+            self._index[channel][lo:hi], per_coordinate, self.counts[channel].size
+        ).reshape(self.shape).astype('u8')
+        self.photons[channel] += counted
+        self.dropped[channel] += n - counted
+
+        # keep the coordinate in effect at the next photon and the later ones
+        keep = max(0, hi-1)
+        self._photons[channel] = photons[n:]
+        self._times[channel] = times[keep:]
+        self._index[channel] = self._index[channel][keep:]
+
+    ###########################################################################
+    def finalize(self):
+        ''' Count the photons still pending
+
+        Returns
+        counts of shape (channels, nx, ny, nz)
+        '''
+
+        for channel in range(self.channels):
+            self.close(channel, 'coordinates')
+        return self.counts
+
+    ###########################################################################
+    def write(self, filename, channel=None):
+        ''' Write the counts as GridData file of uint32, as simfs_img does
+
+        Arguments
+        filename : file to write
+        channel : channel to write (default: sum of all channels)
+        '''
+
+        counts = self.counts.sum(axis=0) if channel is None else self.counts[channel]
+        header = np.array([tuple(d) for d in self.grid], GridData.LinSpace_t)
+        with open(filename, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(counts.astype('<u4').tobytes())
+        return filename
+
+    ###########################################################################
+    def sinks(self, coordinates, photons, channel=0):
+        '''Sinks feeding the named coordinate and photon outputs of a
+        simulation into channel (see Simulation.add_sink)'''
+        return [
+            ImageSink(coordinates, self, channel, 'coordinates'),
+            ImageSink(photons, self, channel, 'photons'),
+        ]
+
+###############################################################################
+class ImageSink(Sink):
+
+    '''Sink that feeds the coordinate or photon stream of a channel into an
+    ImageBuilder'''
+
+    def __init__(self, input, builder, channel=0, stream='photons', chunk_size=1<<16):
+        dtype = coordinate_t if stream == 'coordinates' else timetag_t
+        super().__init__(input, dtype, chunk_size)
+        self.builder = builder
+        self.channel = channel
+        self.stream = stream
+
+    def consume(self, chunk):
+        self.builder.update(self.channel, **{self.stream: chunk})
+
+    def close(self):
+        self.builder.close(self.channel, self.stream)
+
+###############################################################################
+def image(coordinates, photons, grid, binning='floor', chunk_size=1<<20):
+    ''' Photon counts per grid point of coordinate and timetag files or arrays
+
+    Arguments
+    coordinates : coordinate_t records (array, memmap or filename) or a
+                  list of them, one per channel
+    photons : time tags (array, memmap or filename) or a list of them
+    grid : see grid_spec
+    binning : 'floor' (as simfs_img) or 'nearest', see ImageBuilder
+    chunk_size : number of records processed at once
+
+    Returns
+    counts of shape (channels, nx, ny, nz)
+    '''
+
+    def chunks(x, dtype):
+        if isinstance(x, str):
+            return iter_chunks(x, dtype, chunk_size)
+        return (x[i:i+chunk_size] for i in range(0, len(x), chunk_size))
+
+    if isinstance(coordinates, (str, np.ndarray)):
+        coordinates, photons = [coordinates], [photons]
+    b = ImageBuilder(grid, len(coordinates), binning)
+    for channel, (c, p) in enumerate(zip(coordinates, photons)):
+        # feed both streams in order of time so buffers stay small
+        ic, ip = chunks(c, coordinate_t), chunks(p, timetag_t)
+        cc, cp = next(ic, None), next(ip, None)
+        while cc is not None or cp is not None:
+            if cp is None or (cc is not None and cc['t'][-1] <= cp[-1]):
+                b.update(channel, coordinates=cc)
+                cc = next(ic, None)
+            else:
+                b.update(channel, photons=cp)
+                cp = next(ip, None)
+    return b.finalize()
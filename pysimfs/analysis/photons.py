@@ -0,0 +1,305 @@
+import numpy as np
+
+from .. import timetag_t
+from .. sink import Sink
+from .. utils import iter_chunks
+
+###############################################################################
+# Photon statistics
+#
+# Analyzers take time tags (timetag_t) or routed time tags (routed_t, the
+# channel is e.g. the detector) block by block in time order with update
+# and return their result from finalize. Analyzers of a single channel
+# take the photons of all channels together. They keep only what the next
+# block needs, so streams of any length are analyzed in bounded memory.
+# Feed them from files or arrays with analyze, or from a running
+# simulation with a PhotonSink.
+###############################################################################
+
+def times_of(chunk):
+    return chunk if chunk.dtype.names is None else chunk['t']
+
+def channels_of(chunk, channels):
+    '''Channels of the records, all in channel 0 if only one is analyzed'''
+    if chunk.dtype.names is None or channels == 1:
+        return np.zeros(len(chunk), 'i8')
+    return chunk['channel']
+
+###############################################################################
+def binned_counts(index, channels, n_channels):
+    ''' Counts of sorted bin indices per channel
+
+    Returns
+    (first bin, counts of shape (n_channels, bins from the first one))
+    '''
+
+    lo = int(index[0])
+    width = int(index[-1]) - lo + 1
+    counts = np.bincount(
+        channels*width + (index - lo), minlength=n_channels*width
+    )
+    return lo, counts.reshape(n_channels, width)
+
+###############################################################################
+class CountTrace:
+
+    '''Photon counts in bins of bin_width from start, per channel
+
+    finalize returns (bin start times, counts), counts of shape (bins,) for
+    one channel and (channels, bins) for several.
+    '''
+
+    def __init__(self, bin_width, start=0.0, channels=1):
+        self.bin_width = bin_width
+        self.start = start
+        self.channels = channels
+        self.bins = 0
+        self._counts = np.zeros((channels, 1<<10), 'i8')
+
+    def update(self, chunk):
+        index = np.floor((times_of(chunk) - self.start) / self.bin_width).astype('i8')
+        keep = index >= 0
+        if not keep.any():
+            return
+        channels = channels_of(chunk, self.channels)[keep]
+        lo, counts = binned_counts(index[keep], channels, self.channels)
+        hi = lo + counts.shape[1]
+        if hi > self._counts.shape[1]:
+            # grow geometrically, traces are appended to bin by bin
+            grown = np.zeros((self.channels, max(hi, 2*self._counts.shape[1])), 'i8')
+            grown[:, :self.bins] = self._counts[:, :self.bins]
+            self._counts = grown
+        self._counts[:, lo:hi] += counts
+        self.bins = max(self.bins, hi)
+
+    def finalize(self, duration=None):
+        ''' Arguments
+        duration : measurement time, the trace is padded with empty bins
+                   up to it (default: up to the last photon)
+        '''
+        n = self.bins
+        if duration is not None:
+            n = max(n, int(np.ceil(duration / self.bin_width)))
+        counts = np.zeros((self.channels, n), 'i8')
+        counts[:, :self.bins] = self._counts[:, :self.bins]
+        times = self.start + np.arange(n)*self.bin_width
+        return times, counts[0] if self.channels == 1 else counts
+
+###############################################################################
+class InterPhotonHistogram:
+
+    '''Histogram of the times between consecutive photons (of all channels)
+
+    Arguments
+    bins : bin edges, e.g. np.logspace(-9, -2, 71)
+    '''
+
+    def __init__(self, bins):
+        self.bins = np.asarray(bins, 'f8')
+        self.counts = np.zeros(len(self.bins)-1, 'i8')
+        self._last = None
+
+    def update(self, chunk):
+        t = times_of(chunk)
+        if len(t) == 0:
+            return
+        if self._last is not None:
+            t = np.concatenate((self._last, t))
+        self.counts += np.histogram(np.diff(t), self.bins)[0]
+        self._last = t[-1:]
+
+    def finalize(self):
+        return self.bins, self.counts
+
+###############################################################################
+class TCSPCHistogram:
+
+    '''Histogram of photon delays after the latest excitation pulse
+    (micro times), per channel
+
+    Arguments
+    period : pulse period (e.g. of Pulse)
+    bins : number of bins per period or bin edges within [0, period)
+    offset : time of the first pulse
+    '''
+
+    def __init__(self, period, bins=256, offset=0.0, channels=1):
+        self.period = period
+        self.offset = offset
+        self.channels = channels
+        self._width = None
+        if np.ndim(bins) == 0:
+            # equal bins are indexed directly instead of searched
+            self._width = period / bins
+            bins = np.linspace(0, period, bins+1)
+        self.bins = np.asarray(bins, 'f8')
+        self.counts = np.zeros((channels, len(self.bins)-1), 'i8')
+
+    def update(self, chunk):
+        delay = np.mod(times_of(chunk) - self.offset, self.period)
+        n = len(self.bins)-1
+        channels = channels_of(chunk, self.channels)
+        if self._width is not None:
+            index = (delay / self._width).astype('i8')
+            # delays just below the period may round into bin n
+            np.minimum(index, n-1, out=index)
+        else:
+            index = np.searchsorted(self.bins, delay, 'right') - 1
+            keep = (index >= 0) & (index < n)
+            index, channels = index[keep], channels[keep]
+        self.counts += np.bincount(
+            channels*n + index, minlength=self.channels*n
+        ).reshape(self.channels, n)
+
+    def finalize(self):
+        return self.bins, self.counts[0] if self.channels == 1 else self.counts
+
+###############################################################################
+def burst_dtype(channels):
+    '''Records of BurstSearch: first and last photon time, photon count and
+    photons per channel'''
+    return np.dtype([
+        ('start', 'f8'), ('stop', 'f8'), ('n', 'i8'), ('counts', 'i8', (channels,))
+    ])
+
+###############################################################################
+class BurstSearch:
+
+    '''Sliding window burst search
+
+    A window of m consecutive photons belongs to a burst if it spans at
+    most max_duration (its rate is at least m/max_duration). A burst runs
+    from the first photon of a run of such windows to the last photon of
+    its last window, bursts with fewer than min_photons are discarded.
+    The windows are evaluated for whole blocks at once, a burst that is
+    still open at the end of a block is completed with the next one.
+
+    Arguments
+    m : photons per window
+    max_duration : longest window that counts as burst
+    min_photons : smallest burst
+    channels : number of channels counted per burst (routed_t input)
+
+    finalize returns an array of burst_dtype(channels).
+    '''
+
+    def __init__(self, m=10, max_duration=1e-4, min_photons=30, channels=1):
+        self.m = m
+        self.max_duration = max_duration
+        self.min_photons = min_photons
+        self.channels = channels
+        self.dtype = burst_dtype(channels)
+        self._bursts = []
+        self._t = np.empty(0, 'f8')
+        self._ch = np.empty(0, 'i8')
+
+    def update(self, chunk, final=False):
+        t = np.concatenate((self._t, times_of(chunk)))
+        ch = np.concatenate((self._ch, channels_of(chunk, self.channels)))
+        m = self.m
+        if len(t) < m:
+            self._t, self._ch = t, ch
+            return
+
+        inside = t[m-1:] - t[:len(t)-m+1] <= self.max_duration
+        edges = np.diff(inside.astype('i1'), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1  # last window of each run
+
+        # windows from carry on have to be evaluated again with the next block
+        carry = len(inside)
+        if not final and len(ends) and ends[-1] == len(inside)-1:
+            carry = starts[-1]
+            starts, ends = starts[:-1], ends[:-1]
+        self._add(t, ch, starts, ends + m)
+        self._t, self._ch = t[carry:], ch[carry:]
+
+    def _add(self, t, ch, first, stop):
+        n = stop - first
+        keep = n >= self.min_photons
+        first, stop, n = first[keep], stop[keep], n[keep]
+        if len(n) == 0:
+            return
+        bursts = np.empty(len(n), self.dtype)
+        bursts['start'] = t[first]
+        bursts['stop'] = t[stop-1]
+        bursts['n'] = n
+        for c in range(self.channels):
+            cum = np.concatenate(([0], np.cumsum(ch == c)))
+            bursts['counts'][:, c] = cum[stop] - cum[first]
+        self._bursts.append(bursts)
+
+    def finalize(self):
+        self.update(np.empty(0, timetag_t), final=True)
+        self._t, self._ch = np.empty(0, 'f8'), np.empty(0, 'i8')
+        return np.concatenate([np.empty(0, self.dtype)] + self._bursts)
+
+###############################################################################
+def fret_efficiency(bursts, donor=0, acceptor=1, gamma=1.0, background=(0.0, 0.0)):
+    ''' Proximity ratio / FRET efficiency of bursts
+
+    E = nA / (nA + gamma nD) with the background counts (rates times burst
+    duration) subtracted from the donor and acceptor counts
+
+    Arguments
+    bursts : records of BurstSearch with at least two channels
+    donor, acceptor : channels of donor and acceptor photons
+    gamma : detection correction factor
+    background : (donor, acceptor) background rates
+
+    Returns
+    efficiency per burst (nan for bursts without corrected photons)
+    '''
+
+    duration = bursts['stop'] - bursts['start']
+    nd = bursts['counts'][:, donor] - background[0]*duration
+    na = bursts['counts'][:, acceptor] - background[1]*duration
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return na / (na + gamma*nd)
+
+###############################################################################
+class PhotonSink(Sink):
+
+    '''Sink that feeds a live photon stream into analyzers (CountTrace,
+    BurstSearch, ...). The results are in results once the stream ended.'''
+
+    def __init__(self, input, *analyzers, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.analyzers = analyzers
+        self.results = None
+
+    def consume(self, chunk):
+        for a in self.analyzers:
+            a.update(chunk)
+
+    def close(self):
+        self.results = [a.finalize() for a in self.analyzers]
+
+###############################################################################
+def analyze(photons, *analyzers, dtype=timetag_t, chunk_size=1<<20):
+    ''' Run analyzers over photons
+
+    Arguments
+    photons : array, memmap or filename of records of dtype, or an
+              iterable of blocks (e.g. Simulation.iter_results)
+    analyzers : CountTrace, InterPhotonHistogram, TCSPCHistogram,
+                BurstSearch instances
+    chunk_size : number of records processed at once
+
+    Returns
+    list of the results of the analyzers (see their finalize)
+
+    Example
+    (t, trace), bursts = analyze('photons', CountTrace(1e-3), BurstSearch())
+    '''
+
+    if isinstance(photons, str):
+        chunks = iter_chunks(photons, dtype, chunk_size)
+    elif isinstance(photons, np.ndarray):
+        chunks = (photons[i:i+chunk_size] for i in range(0, len(photons), chunk_size))
+    else:
+        chunks = photons
+    for chunk in chunks:
+        for a in analyzers:
+            a.update(chunk)
+    return [a.finalize() for a in analyzers]
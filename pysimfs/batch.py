@@ -0,0 +1,229 @@
+import copy
+import hashlib
+import os
+
+from . import cache
+from . pysimfs import Simulation
+from . check import GraphError
+
+###############################################################################
+def string_paths(x, path=()):
+    '''(path, value) of all strings in nested params'''
+    if isinstance(x, dict):
+        for k, v in x.items():
+            yield from string_paths(v, path + (k,))
+    elif isinstance(x, list):
+        for i, v in enumerate(x):
+            yield from string_paths(v, path + (str(i),))
+    elif isinstance(x, str):
+        yield path, x
+
+###############################################################################
+def replace_strings(x, mapping):
+    if isinstance(x, dict):
+        return {k: replace_strings(v, mapping) for k, v in x.items()}
+    if isinstance(x, list):
+        return [replace_strings(v, mapping) for v in x]
+    if isinstance(x, str):
+        return mapping.get(x, x)
+    return x
+
+###############################################################################
+class Batch:
+
+    '''Run several graphs as one simulation, identical stages only once.
+
+    Graphs are given like for a Sweep. Stages are identical if they run
+    the same code with the same validated params (including seeds) on
+    identical inputs: the same files or the outputs of identical stages.
+    Every such stage runs once, its outputs are fanned out to the stages
+    of all graphs that read them through buffers (see Simulation.fan_out).
+    Stages that write the same output files must be identical.
+
+    Example
+    def graph(epsilon):
+        return [
+            Diffusion(seed=1, ...), Excitation(input='coords', output='flux'),
+            Fluorophore(..., output=f'photons_{epsilon}')
+        ]
+
+    batch = Batch(graph, grid(epsilon=[1e4, 1e5, 1e6]))
+    batch.run()  # one diffusion and excitation, three fluorophores
+    '''
+
+    def __init__(self, factories, points=None, tmpdir='./pysimfs_tmp',
+            datadir='./pysimfs_data', **options):
+        '''
+        Arguments
+        factories, points : graphs as for Sweep
+        tmpdir, datadir, options : arguments of the Simulation
+        '''
+
+        if points is None:
+            self.graphs = [list(f()) for f in factories]
+        else:
+            self.graphs = [list(factories(**p)) for p in points]
+        self.tmpdir = tmpdir
+        self.datadir = datadir
+        self.options = options
+        self.simulation = None
+        self.logs = None
+        self.plan()
+
+    ###########################################################################
+    def __len__(self):
+        return len(self.graphs)
+
+    ###########################################################################
+    @property
+    def shared(self):
+        '''Keys of the stages used more than once'''
+        uses = {}
+        for keys in self.keys:
+            for k in keys:
+                uses[k] = uses.get(k, 0) + 1
+        return [k for k, n in uses.items() if n > 1]
+
+    ###########################################################################
+    def plan(self):
+        '''Find the identical stages of all graphs. Fills stages (key -> the
+        component that runs, with the pipe names of the batch) and keys
+        (per graph, the key of each of its components).'''
+
+        self.stages = {}
+        self.keys = []
+        self._ports = {}
+        written = {}
+        for i, graph in enumerate(self.graphs):
+            comps = []
+            for c in graph:
+                c = c.copy()
+                c.validate_params()
+                comps.append(c)
+            producers = {elem: c for c in comps for elem in c.outputs}
+            internal = {
+                elem.name: producers[elem]
+                for c in comps for elem in c.inputs if elem in producers
+            }
+            ports = {
+                name: Batch.ports(w)[name] for name, w in internal.items()
+            }
+            keys, renames = {}, {}
+            for c in comps:
+                self.add_stage(c, internal, ports, keys, renames, i)
+            for c in comps:
+                for elem in c.outputs:
+                    if elem.name in internal or elem.name == os.devnull:
+                        continue
+                    if written.setdefault(elem.name, keys[id(c)]) != keys[id(c)]:
+                        raise GraphError(
+                            f'Output {elem.name} is written by different stages.'
+                        )
+            self.keys.append([keys[id(c)] for c in comps])
+
+        print(
+            f'Batch of {len(self.graphs)} graphs: {len(self.stages)} of '
+            f'{sum(map(len, self.keys))} stages run, {len(self.shared)} shared.'
+        )
+
+    ###########################################################################
+    def add_stage(self, comp, internal, ports, keys, renames, graph,
+            visiting=()):
+        ''' Key of comp, after the keys of the stages it reads from. A new
+        stage is added with its internal pipes renamed to names unique in
+        the batch.
+
+        Arguments
+        internal : internal pipe name of the graph -> writing component
+        ports : internal pipe name -> its position in the writer's params
+        keys : id(component) -> key, of the components seen so far
+        renames : internal pipe name of the graph -> name in the batch
+        '''
+
+        if id(comp) in keys:
+            return keys[id(comp)]
+        if id(comp) in visiting:
+            raise GraphError(f'Graph {graph} has a cycle through {comp.name}.')
+
+        # inputs are replaced by their writing stage and its port, outputs
+        # read in the graph by a placeholder
+        placeholders = {}
+        for elem in comp.inputs:
+            writer = internal.get(elem.name)
+            if writer is not None:
+                key = self.add_stage(
+                    writer, internal, ports, keys, renames, graph,
+                    visiting + (id(comp),)
+                )
+                placeholders[elem.name] = f'<stage:{key}:{ports[elem.name]}>'
+        for elem in comp.outputs:
+            if elem.name in internal:
+                placeholders[elem.name] = '<pipe>'
+        content = [
+            comp.fingerprint(), list(comp.opts),
+            replace_strings(comp._params, placeholders)
+        ]
+        key = hashlib.sha256(cache.canonical_json(content).encode()).hexdigest()
+        keys[id(comp)] = key
+
+        outputs = {
+            ports[elem.name]: elem.name
+            for elem in comp.outputs if elem.name in internal
+        }
+        if key not in self.stages:
+            self._ports[key] = {
+                port: f'{name}.{key[:12]}' for port, name in outputs.items()
+            }
+            comp.remap_inputs({
+                elem.name: renames[elem.name]
+                for elem in comp.inputs if elem.name in renames
+            })
+            comp.remap_outputs({
+                name: self._ports[key][port] for port, name in outputs.items()
+            })
+            # the batch names replace the configured ones on validation
+            comp.params = copy.deepcopy(comp._params)
+            self.stages[key] = comp
+        for port, name in outputs.items():
+            renames[name] = self._ports[key][port]
+        return key
+
+    ###########################################################################
+    @staticmethod
+    def ports(comp):
+        '''Position in the params of each input and output name of comp'''
+        names = {elem.name for elem in comp.inputs | comp.outputs}
+        ports = {}
+        for path, value in string_paths(comp._params):
+            if value in names:
+                ports.setdefault(value, '/'.join(path))
+        return ports
+
+    ###########################################################################
+    def run(self, **kwargs):
+        ''' Run all stages as one Simulation
+
+        Arguments
+        kwargs : arguments of Simulation.run
+
+        Returns
+        per graph, the ComponentLogs of its components (shared ones repeat)
+        '''
+
+        with Simulation(
+                tmpdir=self.tmpdir, datadir=self.datadir, **self.options
+        ) as sim:
+            index = {}
+            for key, stage in self.stages.items():
+                index[key] = len(sim.components)
+                sim.add(stage)
+            logs = sim.run(**kwargs)
+        self.simulation = sim
+        self.logs = [[logs[index[k]] for k in keys] for keys in self.keys]
+        return self.logs
+
+    ###########################################################################
+    def get_results(self, mmap=True):
+        '''Results of all unmatched outputs by filename (see
+        Simulation.get_results)'''
+        return self.simulation.get_results(mmap)
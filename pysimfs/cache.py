@@ -0,0 +1,611 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # no inter-process locking (windows)
+
+###############################################################################
+def default_cachedir() -> str:
+    ''' Location of the persistent pysimfs cache
+
+    The directory is taken from $PYSIMFS_CACHE_DIR if set, otherwise
+    $XDG_CACHE_HOME/pysimfs (~/.cache/pysimfs). It is only used by
+    default if $PYSIMFS_CACHE_DIR is set (see the global caches below),
+    otherwise pass it to configure, configure_grids or configure_results.
+    '''
+
+    cachedir = os.environ.get('PYSIMFS_CACHE_DIR')
+    if cachedir:
+        return cachedir
+    base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'pysimfs')
+
+###############################################################################
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+def file_digest(path: str) -> str:
+    ''' Content hash of a file (simfs binary or simulation input)
+
+    The hash is memoized on (path, mtime, size), so the file is only read
+    again if it changes on disk.
+
+    Arguments
+    path : path to the file
+
+    Returns
+    sha256 hex digest of the file content
+    '''
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (path, st.st_mtime_ns, st.st_size)
+    with _fingerprints_lock:
+        digest = _fingerprints.get(stamp)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with _fingerprints_lock:
+            _fingerprints[stamp] = digest
+    return digest
+
+###############################################################################
+def canonical_json(obj) -> str:
+    ''' Deterministic JSON representation (sorted keys, no whitespace) '''
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+###############################################################################
+def place(path, filename):
+    ''' Atomically replace filename by a copy of path '''
+    if os.path.abspath(path) == os.path.abspath(filename):
+        return
+    tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    shutil.copyfile(path, tmp)
+    os.replace(tmp, filename)
+
+###############################################################################
+class DiskStore:
+
+    '''Directory of cache entries with least-recently-used eviction.
+
+    Entries are files (or directories of files) named by their key. Writes
+    go to a temporary path that is renamed into place, so concurrent readers
+    never see partial entries. Every hit touches the entry's mtime, which is
+    used as LRU order when the store grows beyond max_entries or max_bytes.
+    Entries unused for more than max_age seconds are dropped. Limits are
+    checked every evict_every commits, as this requires a scan of the
+    directory.
+    '''
+
+    def __init__(self, path, max_entries=None, max_bytes=None, suffix='',
+            evict_every=1, max_age=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self.evict_every = evict_every
+        self._commits = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    ###########################################################################
+    def filename(self, key: str) -> str:
+        return os.path.join(self.path, key+self.suffix)
+
+    ###########################################################################
+    def get(self, key: str):
+        '''Return the path of an entry (and mark it as used) or None'''
+        fn = self.filename(key)
+        try:
+            os.utime(fn)
+        except FileNotFoundError:
+            return None
+        return fn
+
+    ###########################################################################
+    def read(self, key: str):
+        fn = self.get(key)
+        if fn is None:
+            return None
+        try:
+            with open(fn, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    ###########################################################################
+    def write(self, key: str, data: bytes) -> str:
+        tmp = self.tempname(key)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        return self.commit(key, tmp)
+
+    ###########################################################################
+    def tempname(self, key: str) -> str:
+        '''A private path that can later be moved into the store by commit'''
+        return os.path.join(
+            self.path,
+            f'.{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+        )
+
+    ###########################################################################
+    def commit(self, key: str, tmp: str) -> str:
+        fn = self.filename(key)
+        os.replace(tmp, fn)
+        self._commits += 1
+        if self._commits % self.evict_every == 0:
+            # the new entry is used right after the commit, even if it is
+            # larger than the store
+            self.evict(keep=key)
+        return fn
+
+    ###########################################################################
+    @contextmanager
+    def lock(self, key: str):
+        '''Exclusive lock on key, across threads and processes'''
+        if fcntl is None:
+            yield
+            return
+        path = self.lockname(key)
+        while True:
+            f = open(path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # the lock file may have been removed by an eviction meanwhile
+            try:
+                if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    ###########################################################################
+    def lockname(self, key: str) -> str:
+        return os.path.join(self.path, f'.{key}.lock')
+
+    ###########################################################################
+    def remove_locks(self):
+        '''Remove the lock files of keys without entry that nobody holds'''
+        if fcntl is None:
+            return
+        for de in os.scandir(self.path):
+            if not (de.name.startswith('.') and de.name.endswith('.lock')):
+                continue
+            key = de.name[1:-len('.lock')]
+            if os.path.exists(self.filename(key)):
+                continue
+            try:
+                f = open(de.path, 'a')
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    os.remove(de.path)
+                except FileNotFoundError:
+                    pass
+
+    ###########################################################################
+    def remove(self, key: str):
+        DiskStore.delete(self.filename(key))
+
+    ###########################################################################
+    @staticmethod
+    def delete(path):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    ###########################################################################
+    @staticmethod
+    def size(de) -> int:
+        if not de.is_dir(follow_symlinks=False):
+            return de.stat().st_size
+        return sum(DiskStore.size(d) for d in os.scandir(de.path))
+
+    ###########################################################################
+    def entries(self):
+        '''List of (mtime, size, path) of all committed entries, oldest
+        first'''
+        entries = []
+        for de in os.scandir(self.path):
+            if de.name.startswith('.') or not de.name.endswith(self.suffix):
+                continue
+            try:
+                mtime = de.stat().st_mtime_ns
+                size = DiskStore.size(de)
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, size, de.path))
+        return sorted(entries)
+
+    ###########################################################################
+    def evict(self, keep=None):
+        '''Remove the oldest entries beyond the limits, except keep, and
+        the lock files of removed entries'''
+        if (self.max_entries, self.max_bytes, self.max_age) == (None,)*3:
+            return
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        n = len(entries)
+        if keep is not None:
+            # counts towards the limits, but is not removed
+            entries = [e for e in entries if e[2] != self.filename(keep)]
+        expired = 0
+        if self.max_age is not None:
+            expired = time.time_ns() - int(self.max_age*1e9)
+        while entries:
+            too_many = self.max_entries is not None and n > self.max_entries
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            too_old = entries[0][0] < expired
+            if not (too_many or too_big or too_old):
+                break
+            _, size, fn = entries.pop(0)
+            DiskStore.delete(fn)
+            total -= size
+            n -= 1
+        self.remove_locks()
+
+    ###########################################################################
+    def clear(self):
+        for _, _, fn in self.entries():
+            DiskStore.delete(fn)
+        self.remove_locks()
+
+###############################################################################
+class ParamCache:
+
+    '''Cache for the results of simfs components in list mode.
+
+    Results are keyed by the binary's content hash, the command line options
+    and the canonicalized input parameters. An in-memory LRU holds up to
+    maxsize entries, a DiskStore in cachedir persists them across sessions.
+
+    Seeds that the component drew itself (present in the output but not in
+    the input parameters) are redrawn on every hit, so cached components are
+    as independent as freshly validated ones.
+    '''
+
+    random_keys = ('seed',)
+
+    def __init__(self, maxsize=4096, cachedir=None, max_disk_entries=65536):
+        self.maxsize = maxsize
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.store = None
+        if cachedir:
+            try:
+                self.store = DiskStore(
+                    os.path.join(cachedir, 'params'),
+                    max_entries=max_disk_entries,
+                    suffix='.json',
+                    evict_every=256
+                )
+            except OSError as e:
+                print(f'Parameter cache in {cachedir} not available.', e)
+        self.hits = 0
+        self.misses = 0
+
+    ###########################################################################
+    def key(self, call, opts, params) -> str:
+        h = hashlib.sha256()
+        h.update(file_digest(call).encode())
+        h.update(canonical_json([list(opts), params]).encode())
+        return h.hexdigest()
+
+    ###########################################################################
+    def get(self, call, opts, params):
+        '''Cached (params, stderr) for a list call or None'''
+
+        try:
+            key = self.key(call, opts, params)
+        except (OSError, TypeError):
+            return None
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None and self.store is not None:
+            raw = self.store.read(key)
+            if raw is not None:
+                entry = raw.decode('utf8')
+                self._remember(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        out, err = json.loads(entry)
+        return self._reseed(params, out), err
+
+    ###########################################################################
+    def put(self, call, opts, params, out, err):
+        try:
+            key = self.key(call, opts, params)
+        except (OSError, TypeError):
+            return
+        entry = json.dumps([out, err])
+        self._remember(key, entry)
+        if self.store is not None:
+            try:
+                self.store.write(key, entry.encode('utf8'))
+            except OSError as e:
+                print('Failed to write parameter cache.', e)
+
+    ###########################################################################
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    ###########################################################################
+    def _reseed(self, params, out):
+        for k in self.random_keys:
+            if k in out and k not in params:
+                out[k] = random.getrandbits(32)
+        return out
+
+    ###########################################################################
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+###############################################################################
+class GridCache:
+
+    '''Content-addressed store of precalculated grid files.
+
+    Grids are keyed by the binary's content hash and all parameters except
+    the output filename. On a hit the stored grid is copied to the
+    requested filename (a copy, so later writes to that file cannot alter
+    the store), on a miss it is calculated into the store first.
+    Calculations of the same key are serialized with a file lock, so
+    parallel runs calculate every grid only once. The store is bounded to
+    max_bytes, least recently used grids are evicted first.
+    '''
+
+    def __init__(self, cachedir, max_bytes=4<<30):
+        self.store = DiskStore(
+            os.path.join(cachedir, 'grids'),
+            max_bytes=max_bytes,
+            suffix='.dat'
+        )
+        self.hits = 0
+        self.misses = 0
+
+    ###########################################################################
+    def key(self, call, params, ignore=('filename',)) -> str:
+        h = hashlib.sha256()
+        h.update(file_digest(call).encode())
+        params = {k: v for k, v in params.items() if k not in ignore}
+        h.update(canonical_json(params).encode())
+        return h.hexdigest()
+
+    ###########################################################################
+    def fetch(self, key, filename, calculate) -> bool:
+        ''' Place the grid for key at filename
+
+        Arguments
+        key : cache key, see key
+        filename : destination of the grid
+        calculate : callable that writes the grid to the filename it is passed
+
+        Returns
+        True on a cache hit, False if the grid was calculated
+        '''
+
+        with self.store.lock(key):
+            path = self.store.get(key)
+            hit = path is not None
+            if not hit:
+                tmp = self.store.tempname(key)
+                try:
+                    calculate(tmp)
+                    path = self.store.commit(key, tmp)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+            place(path, filename)
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    ###########################################################################
+    def clear(self):
+        self.store.clear()
+
+###############################################################################
+class ResultCache:
+
+    '''Store of complete simulation outputs.
+
+    Entries are keyed by Simulation.graph_key, a hash of the validated graph
+    including seeds, binaries and input files, and hold a copy of every
+    unmatched output along with the component logs. On a hit the outputs
+    are copied back to their filenames instead of running the simulation.
+    The store is bounded to max_bytes, least recently used entries are
+    evicted first and entries unused for max_age seconds are dropped.
+    '''
+
+    manifest = 'manifest.json'
+
+    def __init__(self, cachedir, max_bytes=16<<30, max_age=30*24*3600):
+        self.store = DiskStore(
+            os.path.join(cachedir, 'results'),
+            max_bytes=max_bytes,
+            max_age=max_age
+        )
+        self.hits = 0
+        self.misses = 0
+
+    ###########################################################################
+    def restore(self, key, outputs):
+        ''' Copy the stored outputs of key to their filenames
+
+        Arguments
+        key : cache key, see Simulation.graph_key
+        outputs : filenames of the unmatched outputs
+
+        Returns
+        list of (params, stderr) of the components or None on a miss
+        '''
+
+        with self.store.lock(key):
+            path = self.store.get(key)
+            try:
+                if path is None:
+                    raise FileNotFoundError(key)
+                with open(os.path.join(path, self.manifest)) as f:
+                    manifest = json.load(f)
+                if sorted(manifest['outputs']) != sorted(outputs):
+                    raise ValueError('Outputs do not match the cached entry.')
+                for i, name in enumerate(manifest['outputs']):
+                    place(os.path.join(path, str(i)), name)
+            except (OSError, ValueError, KeyError) as e:
+                if path is not None:
+                    print('Failed to restore cached results.', e)
+                    self.store.remove(key)
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return manifest['logs']
+
+    ###########################################################################
+    def save(self, key, outputs, logs):
+        ''' Store copies of the outputs and the logs of a completed run '''
+
+        with self.store.lock(key):
+            if self.store.get(key) is not None:
+                return
+            tmp = self.store.tempname(key)
+            try:
+                os.mkdir(tmp)
+                for i, name in enumerate(outputs):
+                    shutil.copyfile(name, os.path.join(tmp, str(i)))
+                with open(os.path.join(tmp, self.manifest), 'w') as f:
+                    json.dump(dict(outputs=list(outputs), logs=logs), f)
+                self.store.commit(key, tmp)
+            except OSError as e:
+                print('Failed to write result cache.', e)
+            finally:
+                DiskStore.delete(tmp)
+
+    ###########################################################################
+    def clear(self):
+        self.store.clear()
+
+###############################################################################
+# Global caches
+#
+# param_cache, grid_cache and result_cache are created on first use. By
+# default, parameters are cached in memory only and grids and results are
+# not cached. With $PYSIMFS_CACHE_DIR set, all three persist in that
+# directory. The configure functions replace them at any time.
+###############################################################################
+
+_globals_lock = threading.Lock()
+
+def _default_cache(name):
+    cachedir = os.environ.get('PYSIMFS_CACHE_DIR') or None
+    if name == 'param_cache':
+        return ParamCache(cachedir=cachedir)
+    if not cachedir:
+        return None
+    cls = GridCache if name == 'grid_cache' else ResultCache
+    try:
+        return cls(cachedir)
+    except OSError as e:
+        print(f'{cls.__name__} in {cachedir} not available.', e)
+        return None
+
+def __getattr__(name):
+    if name not in ('param_cache', 'grid_cache', 'result_cache'):
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    with _globals_lock:
+        if name not in globals():
+            globals()[name] = _default_cache(name)
+        return globals()[name]
+
+###############################################################################
+def configure(maxsize=4096, cachedir=None, max_disk_entries=65536):
+    ''' Replace the global parameter cache
+
+    Arguments
+    maxsize : number of list results kept in memory
+    cachedir : directory of the persistent cache, None for memory only
+    max_disk_entries : number of list results kept on disk
+
+    Returns
+    The new ParamCache
+    '''
+
+    global param_cache
+    param_cache = ParamCache(maxsize, cachedir, max_disk_entries)
+    return param_cache
+
+###############################################################################
+def configure_grids(cachedir=None, max_bytes=4<<30):
+    ''' Replace the global grid cache
+
+    Arguments
+    cachedir : directory of the grid cache, None disables caching
+    max_bytes : size limit of the stored grids
+
+    Returns
+    The new GridCache (or None)
+    '''
+
+    global grid_cache
+    grid_cache = GridCache(cachedir, max_bytes) if cachedir else None
+    return grid_cache
+
+###############################################################################
+def configure_results(cachedir=None, max_bytes=16<<30, max_age=30*24*3600):
+    ''' Replace the global result cache used by Simulation(memoize=True)
+
+    Arguments
+    cachedir : directory of the result cache, None disables memoization
+    max_bytes : size limit of the stored outputs
+    max_age : seconds after which unused entries are dropped
+
+    Returns
+    The new ResultCache (or None)
+    '''
+
+    global result_cache
+    result_cache = ResultCache(cachedir, max_bytes, max_age) if cachedir else None
+    return result_cache
@@ -0,0 +1,177 @@
+import os
+import stat
+
+###############################################################################
+class GraphError(ValueError):
+    '''The simulation graph cannot run (e.g. dangling pipes or cycles)'''
+
+###############################################################################
+class DeadlockError(RuntimeError):
+    '''All component processes stopped making progress'''
+
+###############################################################################
+def node_name(node) -> str:
+    return getattr(node, 'name', repr(node))
+
+###############################################################################
+def pipe_ends(sim) -> dict:
+    ''' Writers and readers of every matched pipe
+
+    Returns
+    dict pipe -> (list of writer nodes, list of reader nodes)
+    '''
+
+    ends = {elem.name: ([], []) for elem in sim.matched}
+    for node in sim.components + sim.sinks:
+        for elem in node.outputs:
+            if elem.name in ends:
+                ends[elem.name][0].append(node)
+        for elem in node.inputs:
+            if elem.name in ends:
+                ends[elem.name][1].append(node)
+    return ends
+
+###############################################################################
+def is_fifo(path) -> bool:
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+###############################################################################
+def find_cycle(ends):
+    ''' A cycle of nodes connected by pipes
+
+    Arguments
+    ends : see pipe_ends
+
+    Returns
+    list of nodes on the cycle or None
+    '''
+
+    succ = {}
+    for writers, readers in ends.values():
+        for w in writers:
+            succ.setdefault(id(w), (w, []))[1].extend(readers)
+
+    WHITE, GREY, BLACK = 0, 1, 2
+    color = {}
+    for start, _ in succ.items():
+        if color.get(start, WHITE) != WHITE:
+            continue
+        # iterative depth first search, path holds (node, iterator)
+        path = [(succ[start][0], iter(succ[start][1]))]
+        color[start] = GREY
+        while path:
+            node, children = path[-1]
+            child = next(children, None)
+            if child is None:
+                color[id(node)] = BLACK
+                path.pop()
+                continue
+            c = color.get(id(child), WHITE)
+            if c == GREY:
+                nodes = [n for n, _ in path]
+                return nodes[[id(n) for n in nodes].index(id(child)):]
+            if c == WHITE:
+                color[id(child)] = GREY
+                path.append((child, iter(succ.get(id(child), (child, []))[1])))
+    return None
+
+###############################################################################
+def check_graph(sim) -> list:
+    ''' Static checks of a simulation graph before it is run
+
+    Finds pipes without writer or reader, pipes with several writers,
+    unmatched inputs and outputs that are named pipes (which would block
+    forever) and cycles of pipes.
+
+    Arguments
+    sim : Simulation (remapped, see Simulation.remap)
+
+    Returns
+    list of problem descriptions (empty if the graph is fine)
+    '''
+
+    problems = []
+    ends = pipe_ends(sim)
+    for pipe, (writers, readers) in sorted(ends.items()):
+        name = sim.pipe_names.get(pipe, pipe)
+        if not writers:
+            problems.append(f'Pipe {name} has no writer.')
+        if not readers:
+            problems.append(f'Pipe {name} has no reader.')
+        if len(writers) > 1:
+            problems.append(
+                f'Pipe {name} has several writers: '
+                + ', '.join(node_name(n) for n in writers)
+            )
+
+    for elem in sorted(sim.unmatched_in):
+        if is_fifo(elem.name):
+            problems.append(f'Input {elem.name} is a named pipe without writer in the graph.')
+    for elem in sorted(sim.unmatched_out):
+        if elem.name != os.devnull and is_fifo(elem.name):
+            problems.append(f'Output {elem.name} is a named pipe without reader in the graph.')
+
+    cycle = find_cycle(ends)
+    if cycle:
+        problems.append(
+            'Cycle of pipes: ' + ' -> '.join(node_name(n) for n in cycle+cycle[:1])
+        )
+    return problems
+
+###############################################################################
+def open_pipes_of(pid) -> set:
+    '''Paths of the named pipes a process has open (Linux)'''
+    fddir = f'/proc/{pid}/fd'
+    paths = set()
+    try:
+        fds = os.listdir(fddir)
+    except OSError:
+        return paths
+    for fd in fds:
+        try:
+            paths.add(os.readlink(os.path.join(fddir, fd)))
+        except OSError:
+            pass
+    return paths
+
+###############################################################################
+def diagnose(sim, procs) -> str:
+    ''' Describe the state of the processes of a stuck simulation
+
+    Arguments
+    sim : the running Simulation
+    procs : component name -> Popen of the started processes
+
+    Returns
+    one line per component naming its pipes and whether it has opened them
+    or is still waiting to open them
+    '''
+
+    lines = []
+    for c in sim.components:
+        if c.inprocess:
+            lines.append(f'  {c.name}: in-process ({c.records} records read)')
+            continue
+        proc = procs.get(c.name)
+        if proc is None:
+            continue
+        if proc.returncode is not None:
+            lines.append(f'  {c.name}: exited ({proc.returncode})')
+            continue
+        opened = open_pipes_of(proc.pid)
+        ends = []
+        for kind, io in [('reads', c.inputs), ('writes', c.outputs)]:
+            for elem in sorted(io):
+                if elem.name == os.devnull:
+                    continue
+                # writers of profiled pipes write to the relay at pipe.w
+                paths = {os.path.abspath(elem.name), os.path.abspath(elem.name+'.w')}
+                state = 'open' if paths & opened else 'waiting to open'
+                ends.append(f'{kind} {sim.pipe_names.get(elem.name, elem.name)} ({state})')
+        lines.append(f'  {c.name}: ' + ', '.join(ends))
+    for s in sim.sinks:
+        lines.append(f'  {s!r}: reads {sim.pipe_names.get(s.input, s.input)} ({s.records} records)')
+    return '\n'.join(lines)
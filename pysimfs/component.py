@@ -2,9 +2,14 @@
 ###############################################################################
 ###############################################################################
 
-from . import IO, coordinate_t, timed_value_t, timetag_t, cmp_dir
+from . import IO, coordinate_t, routed_t, timed_value_t, timetag_t, cmp_dir
 from . pysimfs import Simulation 
+from . import cache
+from . utils import GridData
 
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
 import json
 import os
 import uuid
@@ -13,11 +18,15 @@ class Component:
 
     input_paths = []
     output_paths = []
+    file_inputs = []
+    file_outputs = []
     opts = []
     cmd = ''
+    cacheable = False
+    inprocess = False
 
     ########################################################################### 
-    def __init__(self, name=None, **params):
+    def __init__(self, name=None, lazy=False, **params):
 
         self.call = os.path.join(cmp_dir, self.cmd)
         self.name = f'{self.cmd}:{str(uuid.uuid1())[:8]}'
@@ -26,17 +35,34 @@ class Component:
             self.name = ':'.join((name, self.name))
 
         self.params= params
+        self._validated = False
         self._params = params
-        self.validate_params()
+        if not lazy:
+            self.validate_params()
 
     @property
     def all_params(self):
         return self._params
 
+    @property
+    def _params(self):
+        '''Full parameter set, validated on first access for lazy components'''
+        if not self._validated:
+            self.validate_params()
+        return self._full_params
+
+    @_params.setter
+    def _params(self, params):
+        self._full_params = params
 
     def validate_params(self):
         '''Pass configured params to simfs-core component and get full params
-        back'''
+        back. Results are served from the parameter cache if possible.'''
+        self._validated = True
+        cached = cache.param_cache.get(self.call, self.opts, self.params)
+        if cached is not None:
+            self._params, self.err = cached
+            return
         try:
             out, err = Simulation.call_simfs(
                     self.call, 
@@ -49,37 +75,81 @@ class Component:
         except Exception as e:
             print('Error calling SiMFS.', self.call, e)
             return
+        cache.param_cache.put(self.call, self.opts, self.params, out, err)
 
     def __repr__(self):
         return f'{self.name}'
 
+    def copy(self):
+        '''Independent, unvalidated copy. Only the configured params are
+        copied, the full params are derived again on validation.'''
+        comp = copy.copy(self)
+        comp.params = copy.deepcopy(self.params)
+        comp._params = comp.params
+        comp._validated = False
+        return comp
+
+    def fingerprint(self):
+        '''Digest of the code that runs the component (the simfs binary)'''
+        return cache.file_digest(self.call)
+
     ########################################################################### 
     @property
     def inputs(self):
         inputs = set()
-        for p in self.__class__.input_paths:
-            val = Component.get_dict_path(self._params, p.name.split('/'))
-            inputs.update({IO(v, p.dtype) for v in val})
+        for keys, dtype in Component.compile_paths(tuple(self.input_paths)):
+            val = Component.get_dict_path(self._params, keys)
+            inputs.update({IO(v, dtype) for v in val})
         return inputs
 
     ########################################################################### 
     def remap_inputs(self, mapping):
-        for p in self.__class__.input_paths:
-            Component.set_dict_path(self._params, p.name.split('/'), mapping)
+        for keys, _ in Component.compile_paths(tuple(self.input_paths)):
+            Component.set_dict_path(self._params, keys, mapping)
 
     ########################################################################### 
     @property
     def outputs(self):
         outputs = set()
-        for p in self.__class__.output_paths:
-            val = Component.get_dict_path(self._params, p.name.split('/'))
-            outputs.update({IO(v, p.dtype) for v in val})
+        for keys, dtype in Component.compile_paths(tuple(self.output_paths)):
+            val = Component.get_dict_path(self._params, keys)
+            outputs.update({IO(v, dtype) for v in val})
         return outputs
 
     ########################################################################### 
     def remap_outputs(self, mapping):
-        for p in self.__class__.output_paths:
-            Component.set_dict_path(self._params, p.name.split('/'), mapping)
+        for keys, _ in Component.compile_paths(tuple(self.output_paths)):
+            Component.set_dict_path(self._params, keys, mapping)
+
+    ########################################################################### 
+    @property
+    def input_files(self):
+        '''Files read by the component besides its inputs (e.g. grids)'''
+        files = set()
+        for keys, _ in Component.compile_paths(tuple(self.file_inputs)):
+            files.update(Component.get_dict_path(self._params, keys))
+        return files
+
+    ########################################################################### 
+    @property
+    def output_files(self):
+        '''Files written by the component besides its outputs'''
+        files = set()
+        for keys, _ in Component.compile_paths(tuple(self.file_outputs)):
+            files.update(Component.get_dict_path(self._params, keys))
+        return files
+
+    ########################################################################### 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def compile_paths(paths):
+        '''Split IO paths (or plain path strings) into key tuples once per
+        component class'''
+        compiled = []
+        for p in paths:
+            name, dtype = (p.name, p.dtype) if isinstance(p, IO) else (p, None)
+            compiled.append((tuple(name.split('/')), dtype))
+        return tuple(compiled)
 
    ########################################################################### 
     @staticmethod
@@ -119,6 +189,41 @@ class Component:
         Component.set_dict_path(d.get(keys[0]), keys[1:], mapping)
 
 
+###############################################################################
+def validate_components(components, max_workers=None):
+    ''' Validate a batch of components
+
+    Components that are not validated yet (e.g. created with lazy=True) are
+    validated concurrently. Components with identical configurations cost a
+    single simfs call, the rest are served from the parameter cache.
+
+    Arguments
+    components : iterable of Component instances
+    max_workers : number of concurrent simfs calls (default: executor default)
+
+    Returns
+    list of the components
+    '''
+
+    components = list(components)
+    first, rest, seen = [], [], set()
+    for c in components:
+        if c._validated:
+            continue
+        try:
+            key = cache.param_cache.key(c.call, c.opts, c.params)
+        except (OSError, TypeError):
+            key = id(c)
+        (rest if key in seen else first).append(c)
+        seen.add(key)
+
+    with ThreadPoolExecutor(max_workers) as ex:
+        list(ex.map(lambda c: c.validate_params(), first))
+    for c in rest:
+        c.validate_params()
+    return components
+
+
 ###############################################################################
 # Component interfaces
 ###############################################################################
@@ -203,6 +308,14 @@ class Mixer(Component):
         IO('output', timetag_t),
     ]
 
+    @property
+    def outputs(self):
+        '''With routed, the output records carry the input index (routed_t)'''
+        outputs = Component.outputs.fget(self)
+        if not self._params.get('routed'):
+            return outputs
+        return {IO(o.name, routed_t) for o in outputs}
+
 ###############################################################################
 class Splitter(Component):
     cmd = 'utl/simfs_spl'
@@ -224,6 +337,7 @@ class Excitation(Component):
     output_paths=[
         IO('output', timed_value_t),
     ]
+    file_inputs = ['shape/file']
 
 ###############################################################################
 class Detection(Component):
@@ -234,12 +348,39 @@ class Detection(Component):
     output_paths=[
         IO('output', timed_value_t),
     ]
+    file_inputs = ['shape/file']
 
 ###############################################################################
 class Precalculate(Component):
     cmd = 'fcs/simfs_pre'
     input_paths=[ ]
     output_paths=[ ]
+    file_outputs = ['filename']
+    cacheable = True
+
+    def run_cached(self):
+        '''Write the grid to filename. Grids with the same optical parameters
+        are calculated once and then taken from the grid cache.'''
+
+        def calculate(filename):
+            _, self.err = Simulation.call_simfs(
+                    self.call, *self.opts, **dict(self._params, filename=filename)
+            )
+
+        self.err = ''
+        if cache.grid_cache is None:
+            calculate(self._params['filename'])
+        else:
+            key = cache.grid_cache.key(self.call, self._params)
+            cache.grid_cache.fetch(key, self._params['filename'], calculate)
+        return self._params, self.err
+
+    def grid_shape(self, interpolation='nearest'):
+        '''Focus parameters of Excitation/Detection that use this grid'''
+        return dict(
+                type='grid', 
+                shape=dict(file=self._params['filename'], interpolation=interpolation)
+        )
 
 
 ###############################################################################
@@ -259,4 +400,22 @@ class Imager(Component):
         IO('coordinate_inputs', coordinate_t),
         IO('time_inputs', timetag_t)
     ]
-            
+    output_paths=[ ]
+    file_outputs = ['output_file']
+
+    def read_image(self):
+        '''Photon counts per grid point of output_file (see
+        pysimfs.analysis.image for building images in Python)'''
+        return GridData(self._params['output_file'], '<u4')
+
+###############################################################################
+class T3RWriter(Component):
+    '''Write routed time tags (e.g. of a routed Mixer) to a PicoQuant T3R
+    file, the channel of a record becomes its route. See pysimfs.t3r for
+    reading the file.'''
+    cmd = 'utl/simfs_t3r'
+    input_paths=[
+        IO('input', routed_t),
+    ]
+    output_paths=[ ]
+    file_outputs = ['output_file']
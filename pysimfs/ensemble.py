@@ -0,0 +1,198 @@
+import os
+import threading
+
+import numpy as np
+
+from . sink import CallbackSink, HistogramSink, TeeSink
+from . sweep import Sweep, reseed
+from . analysis import Correlator, CorrelationSink
+
+###############################################################################
+class Welford:
+
+    '''Running mean and variance of scalars or equally shaped arrays
+    (Welford's algorithm), safe to update from several threads.'''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Welford(n={self.n}, mean={self.mean}, std={self.std})'
+
+    ###########################################################################
+    def update(self, x):
+        x = np.asarray(x, dtype='f8')
+        with self._lock:
+            self.n += 1
+            if self.mean is None:
+                self.mean = x.copy()
+                self._m2 = np.zeros_like(x)
+                return
+            delta = x - self.mean
+            self.mean = self.mean + delta/self.n
+            self._m2 = self._m2 + delta*(x - self.mean)
+
+    ###########################################################################
+    def merge(self, other):
+        '''Combine with the statistics of another set of samples'''
+        with self._lock:
+            if other.n == 0:
+                return self
+            if self.n == 0:
+                self.n, self.mean, self._m2 = other.n, other.mean.copy(), other._m2.copy()
+                return self
+            n = self.n + other.n
+            delta = other.mean - self.mean
+            self.mean = self.mean + delta*other.n/n
+            self._m2 = self._m2 + other._m2 + delta**2*self.n*other.n/n
+            self.n = n
+        return self
+
+    ###########################################################################
+    @property
+    def var(self):
+        '''Sample variance (nan for fewer than two samples)'''
+        if self.n < 2:
+            return None if self.mean is None else np.full_like(self.mean, np.nan)
+        return self._m2/(self.n-1)
+
+    @property
+    def std(self):
+        return None if self.var is None else np.sqrt(self.var)
+
+    @property
+    def sem(self):
+        '''Standard error of the mean'''
+        return None if self.var is None else np.sqrt(self.var/self.n)
+
+###############################################################################
+class Reducer:
+
+    '''Reduction of one output of a replica to a value (scalar or array).
+
+    sink creates a fresh Sink for every replica, value extracts the reduced
+    value from it once the replica has finished.
+    '''
+
+    def sink(self, input, dtype):
+        raise NotImplementedError
+
+    def value(self, sink):
+        raise NotImplementedError
+
+###############################################################################
+class Count(Reducer):
+
+    '''Number of records (e.g. photons)'''
+
+    def sink(self, input, dtype):
+        return CallbackSink(input, lambda chunk: None, dtype)
+
+    def value(self, sink):
+        return sink.records
+
+###############################################################################
+class Histogram(Reducer):
+
+    '''Histogram of a field (see HistogramSink)'''
+
+    def __init__(self, bins, field=None):
+        self.bins = np.asarray(bins)
+        self.field = field
+
+    def sink(self, input, dtype):
+        return HistogramSink(input, self.bins, self.field, dtype)
+
+    def value(self, sink):
+        return sink.counts
+
+###############################################################################
+class Correlation(Reducer):
+
+    '''Autocorrelation curve G(tau) of timetags (see Correlator)'''
+
+    def __init__(self, resolution=1e-8, levels=24, channels=16, duration=None):
+        self.correlator = dict(resolution=resolution, levels=levels, channels=channels)
+        self.duration = duration
+
+    @property
+    def tau(self):
+        return Correlator(**self.correlator).tau
+
+    def sink(self, input, dtype):
+        return CorrelationSink(input, Correlator(**self.correlator))
+
+    def value(self, sink):
+        return sink.correlator.finalize(self.duration)[1]
+
+###############################################################################
+class Ensemble(Sweep):
+
+    '''Replicas of one graph with distinct seeds, reduced on the fly.
+
+    The graph factory is run replicas times concurrently (under the process
+    budget of a Sweep), each replica with independent seeds drawn from seed.
+    The outputs named in reducers are streamed into sinks that reduce them
+    to a value per replica, which is accumulated across replicas in a
+    Welford aggregate. All other unmatched outputs are discarded, so no raw
+    data is written and memory does not grow with the number of replicas.
+
+    Example
+    ens = Ensemble(graph, 200, {'photons': [Count(), Correlation(1e-7)]})
+    ens.run_all()
+    ens.stats['photons'][0].mean # mean photon count
+    ens.stats['photons'][1].sem  # standard error of G(tau)
+    '''
+
+    def __init__(self, factory, replicas, reducers, seed=None, budget=None,
+            timeout=None, retries=0, tmpdir='./pysimfs_tmp'):
+
+        super().__init__(
+            factory, [dict(replica=i) for i in range(replicas)],
+            budget, timeout, retries, tmpdir
+        )
+        self.reducers = {
+            name: list(r) if isinstance(r, (list, tuple)) else [r]
+            for name, r in reducers.items()
+        }
+        self.stats = {
+            name: [Welford() for _ in r] for name, r in self.reducers.items()
+        }
+        self.seeds = np.random.SeedSequence(seed).spawn(replicas)
+        self._sinks = {}
+
+    ###########################################################################
+    def build(self, sim, factory, point):
+        replica = point['replica']
+        for comp in reseed(list(factory()), self.seeds[replica]):
+            sim.add(comp)
+
+        dtypes = {o.name: o.dtype for o in sim.unmatched_out}
+        missing = set(self.reducers) - set(dtypes)
+        if missing:
+            raise KeyError(f'{missing} are not unmatched outputs of the graph.')
+        sim.rename_outputs({
+            name: os.devnull for name in dtypes if name not in self.reducers
+        })
+
+        sinks = {}
+        for name, reducers in self.reducers.items():
+            sinks[name] = [r.sink(name, dtypes[name]) for r in reducers]
+            if len(reducers) == 1:
+                sim.add_sink(sinks[name][0])
+            else:
+                sim.add_sink(TeeSink(name, sinks[name], dtypes[name]))
+        self._sinks[replica] = sinks
+
+    ###########################################################################
+    def run_one(self, index, factory, point):
+        result = super().run_one(index, factory, point)
+        sinks = self._sinks.pop(point['replica'], {})
+        if result.error is None:
+            for name, reducers in self.reducers.items():
+                for r, sink, stats in zip(reducers, sinks[name], self.stats[name]):
+                    stats.update(r.value(sink))
+        return result
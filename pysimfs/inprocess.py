@@ -0,0 +1,372 @@
+import copy
+import os
+import queue
+import threading
+
+import numpy as np
+
+from . import coordinate_t, routed_t, timed_value_t, timetag_t
+from . import cache
+from . component import Component, Shift, Mixer, Splitter
+from . component import CoordinateBuffer, TimedValueBuffer, TimetagBuffer
+from . pysimfs import Simulation
+from . utils import read_chunks
+
+###############################################################################
+class InProcessComponent(Component):
+
+    '''Component that runs as a thread of the Python process instead of a
+    simfs binary.
+
+    In-process components take the same params and are connected like the
+    components they replace, but save a process and a pipe copy for stages
+    that do little work per record. Their full params are the defaults of
+    the class updated with the configured params, no simfs call is needed.
+    Subclasses implement process(), which streams the inputs block by block
+    to the outputs.
+    '''
+
+    inprocess = True
+    defaults = {}
+    chunk_size = 1<<16
+
+    ###########################################################################
+    def __init__(self, name=None, lazy=False, **params):
+        super().__init__(name, lazy, **params)
+        self.records = 0
+        self._cancelled = threading.Event()
+
+    ###########################################################################
+    def validate_params(self):
+        self._validated = True
+        self.err = ''
+        params = copy.deepcopy(self.defaults)
+        params.update(copy.deepcopy(self.params))
+        self._params = params
+
+    ###########################################################################
+    def copy(self):
+        comp = super().copy()
+        comp.records = 0
+        comp._cancelled = threading.Event()
+        return comp
+
+    ###########################################################################
+    def fingerprint(self):
+        return cache.file_digest(__file__)
+
+    ###########################################################################
+    def run_inprocess(self):
+        '''Run the stage until its inputs are exhausted
+
+        Returns
+        (params, err) like a simfs process
+        '''
+        self.records = 0
+        self._cancelled.clear()
+        self.process()
+        return self._params, self.err
+
+    ###########################################################################
+    def process(self):
+        raise NotImplementedError
+
+    ###########################################################################
+    def cancel(self):
+        '''Stop a running stage. Opens the other end of its pipes, so that
+        it does not wait in open() forever.'''
+        self._cancelled.set()
+        for elem in self.inputs:
+            Simulation.unblock_reader(elem.name)
+        for elem in self.outputs:
+            Simulation.unblock_writer(elem.name)
+
+    ###########################################################################
+    def chunks(self, f, dtype):
+        '''Chunks of an open input until it is exhausted or cancelled'''
+        for chunk in read_chunks(f, dtype, self.chunk_size):
+            if self._cancelled.is_set():
+                return
+            self.records += len(chunk)
+            yield chunk
+
+    ###########################################################################
+    def read_all(self, paths, dtypes):
+        ''' Read several inputs concurrently
+
+        Every input is read by its own thread, so that a writer of several
+        of them never blocks on one while this stage waits for another.
+
+        Returns
+        queue of (index, chunk), chunk is None once input index is exhausted
+        or the exception raised while reading it
+        '''
+
+        events = queue.Queue()
+        def read(i, path, dtype):
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in self.chunks(f, dtype):
+                        events.put((i, chunk))
+            except Exception as e:
+                events.put((i, e))
+                return
+            events.put((i, None))
+
+        for i, (path, dtype) in enumerate(zip(paths, dtypes)):
+            threading.Thread(target=read, args=(i, path, dtype), daemon=True).start()
+        return events
+
+    ###########################################################################
+    @staticmethod
+    def write(f, chunk):
+        f.write(np.ascontiguousarray(chunk).data)
+
+###############################################################################
+class InProcessShift(InProcessComponent):
+
+    '''Shift coordinates in space and time (as Shift)'''
+
+    cmd = 'inprocess/sft'
+    input_paths = Shift.input_paths
+    output_paths = Shift.output_paths
+    defaults = dict(
+        delay=0.0, input='__coordinates__', output='__shifted_coordinates__',
+        shift_x=0.0, shift_y=0.0, shift_z=0.0
+    )
+
+    def process(self):
+        p = self._params
+        with open(p['input'], 'rb') as f, open(p['output'], 'wb') as out:
+            for chunk in self.chunks(f, coordinate_t):
+                chunk['x'] += p['shift_x']
+                chunk['y'] += p['shift_y']
+                chunk['z'] += p['shift_z']
+                chunk['t'] += p['delay']
+                self.write(out, chunk)
+
+###############################################################################
+class InProcessMixer(InProcessComponent):
+
+    '''Merge time tags of several inputs in order of time (as Mixer)
+
+    Records are written once every input that is still open has reached
+    their time. With routed, the records are (t, channel) pairs with the
+    index of the input (routed_t), like the routed output of simfs_mix.
+    '''
+
+    cmd = 'inprocess/mix'
+    input_paths = Mixer.input_paths
+    output_paths = Mixer.output_paths
+    outputs = Mixer.outputs
+    defaults = dict(
+        heartbeat=False, inputs=['__tags1__'], output='__mixed__', routed=False
+    )
+
+    def process(self):
+        p = self._params
+        k = len(p['inputs'])
+        events = self.read_all(p['inputs'], [timetag_t]*k)
+        pending = [np.empty(0, timetag_t) for _ in range(k)]
+        horizon = [-np.inf]*k
+        running = set(range(k))
+
+        with open(p['output'], 'wb') as out:
+            while running:
+                i, chunk = events.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if chunk is None:
+                    running.discard(i)
+                    horizon[i] = np.inf
+                else:
+                    pending[i] = np.concatenate((pending[i], chunk))
+                    horizon[i] = chunk[-1]
+                safe = min(horizon)
+
+                parts = []
+                for j in range(k):
+                    n = np.searchsorted(pending[j], safe, 'right')
+                    if n:
+                        parts.append((j, pending[j][:n]))
+                        pending[j] = pending[j][n:]
+                if not parts:
+                    continue
+                t = np.concatenate([part for _, part in parts])
+                order = np.argsort(t, kind='stable')
+                if p['routed']:
+                    merged = np.empty(len(t), routed_t)
+                    merged['t'] = t[order]
+                    merged['channel'] = np.concatenate([
+                        np.full(len(part), j) for j, part in parts
+                    ])[order]
+                else:
+                    merged = t[order]
+                self.write(out, merged)
+
+###############################################################################
+class InProcessSplitter(InProcessComponent):
+
+    '''Accept photons with the detection efficiency at their time, reject
+    the rest (as Splitter)
+
+    The efficiency is the value of the latest efficiency record at or
+    before a photon (0 before the first one), every photon is accepted
+    with that probability.
+    '''
+
+    cmd = 'inprocess/spl'
+    input_paths = Splitter.input_paths
+    output_paths = Splitter.output_paths
+    defaults = dict(
+        accepted_output='./accepted', efficiency_input='./efficiency',
+        heartbeat=False, photon_input='./emission', rejected_output=os.devnull
+    )
+
+    def validate_params(self):
+        super().validate_params()
+        if self._params.get('seed') is None:
+            self._params['seed'] = int(np.random.SeedSequence().generate_state(1)[0])
+
+    def process(self):
+        p = self._params
+        rng = np.random.default_rng(p['seed'])
+        events = self.read_all(
+            [p['photon_input'], p['efficiency_input']], [timetag_t, timed_value_t]
+        )
+        photons = np.empty(0, timetag_t)
+        efficiency = np.empty(0, timed_value_t)
+        running = {0, 1}
+
+        with open(p['accepted_output'], 'wb') as acc, \
+                open(p['rejected_output'], 'wb') as rej:
+            while running:
+                i, chunk = events.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if chunk is None:
+                    running.discard(i)
+                elif i == 0:
+                    photons = np.concatenate((photons, chunk))
+                else:
+                    efficiency = np.concatenate((efficiency, chunk))
+
+                # photons before the latest efficiency record are decided
+                if 1 not in running:
+                    n = len(photons)
+                elif len(efficiency):
+                    n = np.searchsorted(photons, efficiency['t'][-1], 'left')
+                else:
+                    n = 0
+                if not n:
+                    continue
+                ready, photons = photons[:n], photons[n:]
+                index = np.searchsorted(efficiency['t'], ready, 'right') - 1
+                value = np.where(
+                    index >= 0, efficiency['v'][np.maximum(index, 0)], 0.0
+                ) if len(efficiency) else np.zeros(n)
+                accepted = rng.random(n) < value
+                self.write(acc, ready[accepted])
+                self.write(rej, ready[~accepted])
+                # keep the efficiency record that holds at the next photon
+                efficiency = efficiency[max(0, index[-1]):]
+
+###############################################################################
+class InProcessBuffer(InProcessComponent):
+
+    '''Copy the input to several outputs (as the Buffer components)
+
+    Every output is written by its own thread from an unbounded queue, so a
+    slow reader does not hold up the others.
+    '''
+
+    dtype = None
+    defaults = dict(input='__input__', outputs=['__output1__', '__output2__'])
+
+    def process(self):
+        p = self._params
+        queues = [queue.Queue() for _ in p['outputs']]
+        errors = []
+
+        def drain(path, q):
+            chunk = ()
+            try:
+                with open(path, 'wb') as out:
+                    while (chunk := q.get()) is not None:
+                        self.write(out, chunk)
+            except BrokenPipeError:
+                pass
+            except Exception as e:
+                errors.append(e)
+            # the reader has gone, discard the rest
+            while chunk is not None:
+                chunk = q.get()
+
+        writers = [
+            threading.Thread(target=drain, args=(path, q), daemon=True)
+            for path, q in zip(p['outputs'], queues)
+        ]
+        for w in writers:
+            w.start()
+        try:
+            with open(p['input'], 'rb') as f:
+                for chunk in self.chunks(f, self.dtype):
+                    for q in queues:
+                        q.put(chunk)
+        finally:
+            for q in queues:
+                q.put(None)
+            for w in writers:
+                w.join()
+        if errors:
+            raise errors[0]
+
+###############################################################################
+class InProcessCoordinateBuffer(InProcessBuffer):
+    cmd = 'inprocess/buf'
+    dtype = coordinate_t
+    input_paths = CoordinateBuffer.input_paths
+    output_paths = CoordinateBuffer.output_paths
+
+###############################################################################
+class InProcessTimedValueBuffer(InProcessBuffer):
+    cmd = 'inprocess/buf'
+    dtype = timed_value_t
+    input_paths = TimedValueBuffer.input_paths
+    output_paths = TimedValueBuffer.output_paths
+
+###############################################################################
+class InProcessTimetagBuffer(InProcessBuffer):
+    cmd = 'inprocess/buf'
+    dtype = timetag_t
+    input_paths = TimetagBuffer.input_paths
+    output_paths = TimetagBuffer.output_paths
+
+###############################################################################
+REPLACEMENTS = {
+    Shift: InProcessShift,
+    Mixer: InProcessMixer,
+    Splitter: InProcessSplitter,
+    CoordinateBuffer: InProcessCoordinateBuffer,
+    TimedValueBuffer: InProcessTimedValueBuffer,
+    TimetagBuffer: InProcessTimetagBuffer,
+}
+
+###############################################################################
+def to_inprocess(comp):
+    ''' In-process equivalent of a component
+
+    Arguments
+    comp : Component
+
+    Returns
+    an unvalidated in-process component with the same configured params
+    and name, or a copy of comp if there is no in-process equivalent
+    '''
+
+    cls = REPLACEMENTS.get(type(comp))
+    if cls is None:
+        return comp.copy()
+    new = cls(lazy=True, **copy.deepcopy(comp.params))
+    new.name = comp.name.replace(comp.cmd, cls.cmd, 1)
+    return new
@@ -1,6 +1,7 @@
 import numpy as np
 from . import coordinate_t
 from . utils import new_filename
+from . scan import GridScan
 
 from typing import Tuple
 
@@ -27,17 +28,20 @@ def single_coordinate(
     return fn
 
 ###############################################################################
-def coordinate_grid(xspec: Gridspec, yspec: Gridspec, zspec: Gridspec) -> str:
+def coordinate_grid(
+        xspec: Gridspec, yspec: Gridspec, zspec: Gridspec, dwell: float=1.0
+        ) -> str:
     ''' Create a grid of coordinates
 
     Arguments
     xspec : (min, max, n) range and number of points in x
     yspec : (min, max, n) range and number of points in y
     zspec : (min, max, n) range and number of points in z
+    dwell : time per grid point
 
     Returns
-    filename to coordinate grid file
+    filename to coordinate grid file, the grid points in the order of
+    GridData (x slowest), see pysimfs.scan.GridScan to map results back
     '''
 
-    raise NotImplementedError('Not yet implemented')
-    return fn
+    return GridScan(xspec, yspec, zspec, dwell).write(new_filename('coordinate_grid'))
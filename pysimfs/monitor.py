@@ -0,0 +1,201 @@
+from collections import namedtuple
+import asyncio
+import copy
+import os
+import time
+
+import numpy as np
+
+###############################################################################
+Progress = namedtuple('Progress', [
+    'elapsed', 'simulated', 'experiment_time', 'fraction', 'eta',
+    'stages', 'outputs'
+])
+Progress.__doc__ = '''Snapshot of a running simulation: wall time elapsed,
+latest simulated time seen in the outputs, the experiment_time of the
+simulation, their ratio and the estimated remaining wall time (seconds),
+plus per stage and per output throughput.'''
+
+StageProgress = namedtuple('StageProgress', [
+    'name', 'read', 'written', 'rate', 'running'
+])
+StageProgress.__doc__ = '''Bytes read and written by a component process and
+its write rate in records per second (of its first output's dtype).'''
+
+OutputProgress = namedtuple('OutputProgress', ['name', 'records', 'rate', 't'])
+OutputProgress.__doc__ = '''Records written to an output file or consumed by
+a sink, records per second and the time stamp of the latest record.'''
+
+###############################################################################
+def last_time(record):
+    '''Time stamp of a record of any simfs dtype'''
+    if record.dtype.names is None:
+        return float(record)
+    return float(record['t'])
+
+###############################################################################
+def proc_io(pid):
+    ''' Bytes read and written by a process so far (Linux /proc/pid/io)
+
+    Returns
+    (rchar, wchar) or None if not available
+    '''
+
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+###############################################################################
+def proc_cpu(pid):
+    ''' CPU time used by a process so far in clock ticks (Linux /proc/pid/stat)
+
+    Returns
+    utime+stime or None if not available
+    '''
+
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+
+###############################################################################
+class Monitor:
+
+    '''Samples the progress of a running simulation.
+
+    Nothing is inserted into the data path: output files are watched by
+    their size and last record, component processes by their I/O counters,
+    and sinks count what they consume. A sample costs a few system calls
+    per stage, independent of the data rate.
+    '''
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.start = time.time()
+        self.procs = {}
+        self.stopped = set()
+        self.finished = asyncio.Event()
+        self._previous = {}
+        self._io = {}
+
+        times = [
+            c._params.get('experiment_time') for c in simulation.components
+        ]
+        times = [t for t in times if isinstance(t, (int, float))]
+        self.experiment_time = max(times) if times else None
+
+    ###########################################################################
+    def fork(self):
+        '''Monitor of the same run with its own rate measurements, for
+        sampling at another interval without affecting this one'''
+        monitor = copy.copy(self)
+        monitor._previous = {}
+        monitor._io = {}
+        return monitor
+
+    ###########################################################################
+    @property
+    def done(self) -> bool:
+        return self.finished.is_set()
+
+    ###########################################################################
+    def _rate(self, key, now, count):
+        then, before = self._previous.get(key, (self.start, 0))
+        self._previous[key] = (now, count)
+        return (count-before)/(now-then) if now > then else 0.0
+
+    ###########################################################################
+    def stages(self, now):
+        stages = []
+        for c in self.simulation.components:
+            proc = self.procs.get(c.name)
+            if proc is None:
+                continue
+            running = proc.returncode is None
+            io = proc_io(proc.pid) if running else None
+            if io is None:
+                io = self._io.get(c.name, (0, 0))
+            self._io[c.name] = io
+            dtypes = [o.dtype for o in c.outputs if o.name != os.devnull]
+            itemsize = np.dtype(dtypes[0]).itemsize if dtypes else 1
+            rate = self._rate(c.name, now, io[1] // itemsize)
+            stages.append(StageProgress(c.name, io[0], io[1], rate, running))
+        return stages
+
+    ###########################################################################
+    def outputs(self, now):
+        outputs = []
+        for o in self.simulation.unmatched_out:
+            if o.name == os.devnull:
+                continue
+            dtype = np.dtype(o.dtype)
+            try:
+                size = os.path.getsize(o.name)
+            except OSError:
+                size = 0
+            records, t = size // dtype.itemsize, None
+            if records:
+                try:
+                    with open(o.name, 'rb') as f:
+                        f.seek((records-1)*dtype.itemsize)
+                        t = last_time(np.frombuffer(f.read(dtype.itemsize), dtype)[0])
+                except (OSError, ValueError):
+                    pass
+            outputs.append(OutputProgress(
+                o.name, records, self._rate(o.name, now, records), t
+            ))
+        for s in self.simulation.sinks:
+            outputs.append(OutputProgress(
+                repr(s), s.records, self._rate(id(s), now, s.records), s.last
+            ))
+        return outputs
+
+    ###########################################################################
+    def activity(self):
+        '''Signature of everything that moves in a running simulation: I/O
+        and CPU counters of the running processes and the sink counters.
+        Unchanged signatures mean no progress in between.'''
+        procs = tuple(
+            (name, proc_io(p.pid), proc_cpu(p.pid))
+            for name, p in sorted(self.procs.items()) if p.returncode is None
+        )
+        stages = tuple(
+            c.records for c in self.simulation.components if c.inprocess
+        )
+        return procs, stages, tuple(s.records for s in self.simulation.sinks)
+
+    ###########################################################################
+    def sample(self) -> Progress:
+        now = time.time()
+        stages = self.stages(now)
+        outputs = self.outputs(now)
+        times = [o.t for o in outputs if o.t is not None]
+        simulated = max(times) if times else None
+        fraction = eta = None
+        if simulated is not None and self.experiment_time:
+            fraction = min(1.0, simulated/self.experiment_time)
+            if fraction > 0:
+                eta = (now-self.start)*(1-fraction)/fraction
+        return Progress(
+            now-self.start, simulated, self.experiment_time, fraction, eta,
+            stages, outputs
+        )
+
+###############################################################################
+def print_progress(progress):
+    '''Progress callback that prints one line per sample'''
+    p = progress
+    line = f'{p.elapsed:8.1f} s'
+    if p.fraction is not None:
+        line += f' | {100*p.fraction:5.1f} % of {p.experiment_time} s simulated'
+    if p.eta is not None:
+        line += f' | eta {p.eta:.0f} s'
+    for s in p.stages:
+        if s.running:
+            line += f' | {s.name.split(":")[0]} {s.rate:.3g}/s'
+    print(line, flush=True)
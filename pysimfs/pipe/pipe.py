@@ -14,6 +14,10 @@ class BasePipe():
         '''Deletes the filesystem pipe object'''
         raise NotImplementedError
 
+    def resize(self):
+        '''Applies the requested buffer capacity to the open pipe'''
+        raise NotImplementedError
+
     @property
     def path(self):
         '''The full path to the named pipe'''
@@ -1,12 +1,27 @@
+import fcntl
 import os
 
 from . pipe import BasePipe
 
+# Linux only, fcntl exports them from python 3.10 on
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+F_GETPIPE_SZ = getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+
+def max_capacity():
+    '''Largest pipe buffer an unprivileged process may set (Linux), or None'''
+    try:
+        with open('/proc/sys/fs/pipe-max-size') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
 class UnixPipe(BasePipe):
     '''Pipe handler implementation that uses UNIX named pipes'''
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, capacity: int = None) -> None:
         self._path = path
+        self.capacity = capacity
+        self.size = None
 
     def __str__(self) -> str:
         return str(self.path)
@@ -16,9 +31,31 @@ class UnixPipe(BasePipe):
         return self
 
     def __exit__(self, ex_type, ex_value, traceback):
-        if os.path.exists(self._path):
+        try:
             os.remove(self._path)
-        
+        except FileNotFoundError:
+            pass
+
+    def resize(self):
+        '''Set the buffer of the pipe to capacity bytes (Linux, limited to
+        /proc/sys/fs/pipe-max-size). A named pipe only has a buffer while it
+        is open, so this takes effect once both ends are open and holds until
+        they are closed. Returns the buffer size or None if not resized.'''
+        limit = max_capacity()
+        if self.capacity is None or limit is None:
+            return None
+        try:
+            fd = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return None
+        try:
+            self.size = fcntl.fcntl(fd, F_SETPIPE_SZ, min(self.capacity, limit))
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+        return self.size
+
     @property
     def path(self) -> str:
         return self._path
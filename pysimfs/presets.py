@@ -21,7 +21,8 @@ class SimfsDefaultMagics(Magics):
             'spl': os.path.join('utl', 'simfs_spl'),
             'mix': os.path.join('utl', 'simfs_mix'),
             'buf': os.path.join('utl', 'simfs_buf'),
-            'img': os.path.join('utl', 'simfs_img')
+            'img': os.path.join('utl', 'simfs_img'),
+            't3r': os.path.join('utl', 'simfs_t3r')
             }
 
     ###########################################################################
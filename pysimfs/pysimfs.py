@@ -1,29 +1,80 @@
 import subprocess
 
 import asyncio
-import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import os
+import signal
+import sys
 import copy
 import json
 import time
 import uuid
+import hashlib
 import numpy as np
 
 from . import IO, ComponentLog
+from . import cache
+from . utils import map_file, iter_chunks, relay
+from . report import RunReport, ProcessStats, PipeStats
+from . monitor import Monitor
+from . stop import bind_conditions
+from . check import check_graph, diagnose, pipe_ends, open_pipes_of
+from . check import GraphError, DeadlockError
+from . pipe import Pipe
 
 ###############################################################################
 class Simulation:
 
     ########################################################################### 
-    def __init__(self, name=None, tmpdir='./pysimfs_tmp', datadir='./pysimfs_data'):
+    def __init__(self, name=None, tmpdir='./pysimfs_tmp', datadir='./pysimfs_data',
+            memoize=False, profile=False, stall_timeout=60.0, pipe_capacity=None,
+            inprocess=False):
+        '''
+        Arguments
+        name : unused
+        tmpdir : directory of the pipes
+        datadir : directory for output data
+        memoize : restore the outputs of identical earlier runs from the
+                  result cache instead of running (True for the global
+                  pysimfs.cache.result_cache, which has to be configured,
+                  or a ResultCache)
+        profile : count the data moved through every matched pipe (see
+                  report), at the cost of relaying it through a thread
+        stall_timeout : abort a run with a DeadlockError when none of its
+                        processes and sinks moved data or used CPU for this
+                        many seconds (None to wait forever)
+        pipe_capacity : buffer size in bytes of the matched pipes, for all
+                        pipes (int) or by pipe name and/or dtype (dict, e.g.
+                        {coordinate_t: 1<<20, 'photons': 1<<18}), limited to
+                        /proc/sys/fs/pipe-max-size. None keeps the system
+                        default (64 KiB on Linux).
+        inprocess : replace Shift, Mixer, Splitter and buffers (including the
+                    fan-out buffers) by their NumPy equivalents, which run
+                    as threads of this process (see pysimfs.inprocess)
+        '''
         self.tmpdir = tmpdir
         self.datadir = datadir
+        self.memoize = memoize
+        self.profile = profile
+        self.stall_timeout = stall_timeout
+        self.pipe_capacity = pipe_capacity
+        self.inprocess = inprocess
+        self.report = None
+        self.monitor = None
+        self.running = None
+        self.stopped = None
         self.matched = set()
+        self.pipe_names = {}
         self.components = []
+        self.sinks = []
         self.unmatched_in = set()
         self.unmatched_out = set()
-        self.open_pipes = set()
+        self.open_pipes = {}
+        self._readers = {}
+        self._writers = {}
+        self._remaps = {}
+        self._edges = {}
 
         for d in (self.tmpdir, self.datadir):
             try:
@@ -42,81 +93,702 @@ class Simulation:
     ########################################################################### 
     def add(self, comp):
 
-        _comp = copy.deepcopy(comp)
+        if self.inprocess:
+            from . inprocess import to_inprocess
+            _comp = to_inprocess(comp)
+        else:
+            _comp = comp.copy()
         _comp.validate_params()
         self.components.append(_comp)
+        self.connect(_comp)
 
-        new_in = _comp.inputs
-        new_out = _comp.outputs
-                                            
-        self.unmatched_in.update(new_in)
-        self.unmatched_out.update(new_out)
-                                                                    
-        updates = {}
-        new_matches = set()
-        
-        for elem in self.unmatched_in:
-            if elem in self.unmatched_out:
-                # match        
-                new_matches.add(elem)
-                pipe = self.new_pipe(elem.name)
-                updates[elem.name] = pipe
-                self.matched.add(IO(pipe, elem.dtype))
-
-        self.unmatched_out.difference_update(new_matches)
-        self.unmatched_in.difference_update(new_matches)
-        
-        for c in self.components:
-            c.remap_inputs(updates)
-            c.remap_outputs(updates)
+    ########################################################################### 
+    def add_sink(self, sink):
+        '''Attach a Python sink (see pysimfs.sink) to an output by name. The
+        sink itself is added, not a copy, so its state is accessible after
+        the run.'''
+        self.sinks.append(sink)
+        self.connect(sink)
+
+    ########################################################################### 
+    def store_compact(self, output, filename=None, **options):
+        ''' Store an output in a compact record file instead of a raw one
+
+        Time stamps are stored as integer ticks, delta encoded and
+        compressed in chunks with an index for reading time ranges. Read the
+        file with pysimfs.storage.TickReader.
+
+        Arguments
+        output : name of an unmatched output of the graph
+        filename : compact file (default: output + '.tick')
+        options : resolution, codec, level, records_per_chunk (see CompactSink)
+
+        Returns
+        the CompactSink
+        '''
+
+        from . sink import CompactSink
+        dtypes = {o.name: o.dtype for o in self.unmatched_out}
+        if output not in dtypes:
+            raise KeyError(f'{output} is not an unmatched output of the graph.')
+        sink = CompactSink(
+            output, filename or output + '.tick', dtypes[output], **options
+        )
+        self.add_sink(sink)
+        return sink
+
+    ########################################################################### 
+    def connect(self, node):
+        '''Match the endpoints of a new node against the unmatched endpoints
+        of the graph. Unmatched endpoints are indexed by IO, so the cost
+        does not depend on the size of the graph. Matched names are not
+        replaced by their pipes right away, see remap.'''
+
+        for elem in node.inputs:
+            if elem in self._edges:
+                self.fan_out(elem, node)
+            elif elem in self.unmatched_out:
+                self.match(elem, readers=[node])
+            else:
+                self.unmatched_in.add(elem)
+                self._readers.setdefault(elem, []).append(node)
+
+        for elem in node.outputs:
+            if elem in self.unmatched_in:
+                self.match(elem, writers=[node])
+            else:
+                self.unmatched_out.add(elem)
+                self._writers.setdefault(elem, []).append(node)
+
+    ########################################################################### 
+    def match(self, elem, readers=(), writers=()):
+        readers = self._readers.pop(elem, []) + list(readers)
+        writers = self._writers.pop(elem, []) + list(writers)
+        pipe = self.new_match(elem)
+        for node in writers:
+            self.remap_later(node, outputs={elem.name: pipe})
+        self.remap_later(readers[0], inputs={elem.name: pipe})
+        self._edges[elem] = dict(pipe=pipe, reader=readers[0], buffer=None)
+        for node in readers[1:]:
+            self.fan_out(elem, node)
+        self.unmatched_in.discard(elem)
+        self.unmatched_out.discard(elem)
+
+    ########################################################################### 
+    def fan_out(self, elem, node):
+        '''Connect another reader to a matched output. On the second reader,
+        a buffer component of the output's dtype is inserted between the
+        writer and the readers, which then all read from their own pipe.
+        simfs_buf queues the data of every output separately in memory, so
+        readers running at different speeds do not block each other.'''
+
+        edge = self._edges[elem]
+        if edge['buffer'] is None:
+            first = self.new_match(elem)
+            self.remap_later(
+                edge['reader'], inputs={elem.name: first, edge['pipe']: first}
+            )
+            edge['buffer'] = Simulation.buffer_for(elem.dtype, self.inprocess)(
+                name='fanout', input=edge['pipe'], outputs=[first]
+            )
+            self.components.append(edge['buffer'])
+        pipe = self.new_match(elem)
+        # configured and validated params, so that the output also survives
+        # copies and a new validation of the buffer
+        buffer = edge['buffer']
+        buffer.params['outputs'].append(pipe)
+        if buffer._params['outputs'] is not buffer.params['outputs']:
+            buffer._params['outputs'].append(pipe)
+        self.remap_later(node, inputs={elem.name: pipe})
+
+    ########################################################################### 
+    @staticmethod
+    def buffer_for(dtype, inprocess=False):
+        from . component import CoordinateBuffer, TimedValueBuffer, TimetagBuffer
+        from . inprocess import REPLACEMENTS
+        for cls in (CoordinateBuffer, TimedValueBuffer, TimetagBuffer):
+            if np.dtype(cls.input_paths[0].dtype) == np.dtype(dtype):
+                return REPLACEMENTS[cls] if inprocess else cls
+        raise ValueError(f'No buffer component for dtype {dtype}.')
+
+    ########################################################################### 
+    def new_match(self, elem):
+        pipe = self.new_pipe(elem.name)
+        self.pipe_names[pipe] = elem.name
+        self.matched.add(IO(pipe, elem.dtype))
+        return pipe
+
+    ########################################################################### 
+    def remap_later(self, node, inputs=None, outputs=None):
+        _, in_map, out_map = self._remaps.setdefault(id(node), (node, {}, {}))
+        in_map.update(inputs or {})
+        out_map.update(outputs or {})
+
+    ########################################################################### 
+    def remap(self):
+        '''Replace matched names by their pipes in all nodes matched since the
+        last remap. Called before the simulation runs.'''
+        for node, in_map, out_map in self._remaps.values():
+            if in_map:
+                node.remap_inputs(in_map)
+            if out_map:
+                node.remap_outputs(out_map)
+        self._remaps = {}
+
+    ########################################################################### 
+    def rename_outputs(self, mapping):
+        '''Write the unmatched outputs given in mapping (old -> new name) to
+        other files.'''
+        renamed = [o for o in self.unmatched_out if o.name in mapping]
+        for o in renamed:
+            new = IO(mapping[o.name], o.dtype)
+            for node in self._writers.pop(o, []):
+                node.remap_outputs({o.name: new.name})
+                self._writers.setdefault(new, []).append(node)
+            self.unmatched_out.discard(o)
+            self.unmatched_out.add(new)
 
     ########################################################################### 
     def make_pipes(self):
-        for elem in self.matched:
-            try:
-                os.mkfifo(elem.name)
-                self.open_pipes.add(elem.name)
-            except:
-                print(f'Failed to create pipe {elem.name}')
+        '''Create the named pipes of all matched IOs. If one cannot be
+        created, the ones created so far are removed again.'''
+        try:
+            for elem in self.matched:
+                self.open_pipe(elem.name, self.capacity_of(elem))
+        except OSError:
+            self.remove_pipes()
+            raise
+
+    ########################################################################### 
+    def open_pipe(self, path, capacity=None):
+        pipe = Pipe(path, capacity).__enter__()
+        self.open_pipes[path] = pipe
+        return pipe
+
+    ########################################################################### 
+    def capacity_of(self, elem):
+        '''Requested buffer size of a matched pipe (see pipe_capacity)'''
+        capacity = self.pipe_capacity
+        if not isinstance(capacity, dict):
+            return capacity
+        name = self.pipe_names.get(elem.name)
+        if name in capacity:
+            return capacity[name]
+        return capacity.get(np.dtype(elem.dtype))
+
+    ########################################################################### 
+    def run(self, timeout=None, progress=None, interval=1.0, stop=None):
+        '''Run the simulation and block until all components have finished.
+
+        Thin wrapper around run_async. If called from a running event loop
+        (e.g. in jupyter), the simulation runs on a private loop in a
+        separate thread.
+        '''
+        run = self.run_async(timeout, progress, interval, stop)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(run)
+        with ThreadPoolExecutor(1) as ex:
+            return ex.submit(asyncio.run, run).result()
+
+    ########################################################################### 
+    async def run_async(self, timeout=None, progress=None, interval=1.0,
+            stop=None):
+        '''Run the simulation on the current event loop.
+
+        Many simulations can be awaited concurrently. If the run is
+        cancelled, times out or a component fails, all component processes
+        are killed and the pipes are removed before the error is raised.
+
+        While the processes run, progress (if given) is called with a
+        pysimfs.monitor.Progress sample every interval seconds, e.g.
+        pysimfs.monitor.print_progress. See also watch.
+
+        With memoize, a run whose graph_key is in the result cache restores
+        the outputs from there. Simulations with sinks always run.
+
+        The graph is checked before anything starts (see check), a GraphError
+        is raised if it cannot run. A run that stalls for stall_timeout
+        seconds is aborted with a DeadlockError naming the stuck pipes.
+
+        stop is a condition or a list of conditions on the live outputs
+        (see pysimfs.stop, e.g. PhotonCount(10**6, 'photons'), or any
+        callable taking a Progress sample). Once one is met, the sources
+        of the graph are stopped (see stop_sources) and the rest of the
+        pipeline finishes with the data already generated. The met
+        condition is in stopped, the output files end with whole records.
+        Stopped runs are not stored in the result cache.
+        '''
+
+        # published before anything can fail, see watch
+        self.running = run = asyncio.get_running_loop().create_future()
+        self.monitor = None
+        try:
+            logs = await self.execute(timeout, progress, interval, stop)
+        except asyncio.CancelledError:
+            run.cancel()
+            raise
+        except BaseException as e:
+            run.set_exception(e)
+            # retrieved by watch, if anybody watches
+            run.exception()
+            raise
+        run.set_result(logs)
+        return logs
 
     ########################################################################### 
-    def run(self):
+    async def execute(self, timeout, progress, interval, stop):
+        '''The run of run_async'''
 
         for f in self.unmatched_in:
             assert os.path.exists(f.name), f'File "{f.name}" does not exist.'
+        self.remap()
+        problems = self.check()
+        if problems:
+            raise GraphError('\n'.join(problems))
+        conditions = bind_conditions(stop, self)
+        self.stopped = None
+
+        loop = asyncio.get_running_loop()
+        cached = [c for c in self.components if c.cacheable]
+        start = time.time()
+
+        store = self.result_store
+        if store is not None:
+            key = await loop.run_in_executor(None, self.graph_key)
+            logs = await loop.run_in_executor(
+                None, store.restore, key, self.result_files
+            )
+            if logs is not None:
+                for c in cached:
+                    await loop.run_in_executor(None, c.run_cached)
+                print('Restored simulation results from cache.')
+                self.results = logs
+                self.report = RunReport(wall=time.time()-start, restored=True)
+                return [ComponentLog(p, e) for (p, e) in self.results]
      
         self.make_pipes()
+        try:
+            relays = self.make_relays() if self.profile else {}
+        except OSError:
+            self.remove_pipes()
+            raise
 
-        # new event loop in a thread (to run 2 loops in case the environment is already runnign asyncio -> jupyterhub)
-        loop = asyncio.new_event_loop()
-        asyncio.get_child_watcher().attach_loop(loop) # register loop (?)
-        
-        commands = asyncio.gather(
-                *(Simulation.call_simfs_async(c.call, *c.opts, **c._params) for c in self.components), loop=loop
-        )                  
+        processes = self.processes
+        threads = [c for c in self.components if c.inprocess]
+        tasks = []
+        stages = []
+        drains = []
+        copies = []
+        main = None
+        self.monitor = monitor = Monitor(self)
+        tuner = asyncio.ensure_future(self.tune_pipes(monitor, relays))
+        reporter = None
+        if progress is not None:
+            reporter = asyncio.ensure_future(
+                Simulation.report_progress(monitor, progress, interval)
+            )
+        stopper = None
+        if conditions:
+            stopper = asyncio.ensure_future(self.stop_when(monitor, conditions))
+        # every in-process stage, sink and relay blocks one thread while it
+        # runs, processes are served on the event loop
+        workers = ThreadPoolExecutor(
+            max(1, len(threads)+len(self.sinks)+len(relays))
+        )
         
         #Run the commands
-        start = time.time()
-        print(f'Started simulation with {len(self.components)} component processes.')
-        t = threading.Thread(target=self.run_loop, args=(loop, commands))
-        t.start()
-        t.join()
+        print(f'Started simulation with {len(processes)} component processes.')
+        try:
+            # cached components have no pipes, their outputs are in place
+            # before any process starts
+            logs = await asyncio.wait_for(asyncio.gather(
+                *(Simulation.run_cached_async(c) for c in cached)
+            ), timeout)
+            logs = dict(zip(map(id, cached), logs))
+            if timeout is not None:
+                timeout = max(0, timeout - (time.time()-start))
+
+            tasks = [
+                asyncio.ensure_future(Simulation.run_simfs_async(
+                    c.call, c.opts, self.relayed_params(c, relays),
+                    started=lambda proc, name=c.name: monitor.procs.update({name: proc}),
+                    stopped=lambda name=c.name: name in monitor.stopped
+                ))
+                for c in processes
+            ]
+            stages = [
+                loop.run_in_executor(workers, Simulation.run_inprocess, c)
+                for c in threads
+            ]
+            drains = [loop.run_in_executor(workers, s.drain) for s in self.sinks]
+            copies = [
+                loop.run_in_executor(workers, relay, src, dst)
+                for dst, src in relays.items()
+            ]
+            main = asyncio.gather(*tasks, *stages, *drains, *copies)
+            watchdog = asyncio.ensure_future(self.watchdog(monitor))
+            # the watchdog and the reporter only end before the run if they
+            # raise, e.g. an exception of the progress callback
+            helpers = {watchdog} | ({reporter} if reporter is not None else set())
+            done, _ = await asyncio.wait(
+                {main} | helpers, timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for helper in helpers & done:
+                main.cancel()
+                helper.result()
+            watchdog.cancel()
+            if main not in done:
+                main.cancel()
+                raise asyncio.TimeoutError()
+            results = main.result()
+            logs.update(zip(map(id, processes+threads), results))
+            transferred = results[len(tasks)+len(stages)+len(drains):]
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(
+                *tasks, *([main] if main else []), return_exceptions=True
+            )
+            for c in threads:
+                c.cancel()
+            for s in self.sinks:
+                Simulation.unblock_reader(s.input)
+            for dst, src in relays.items():
+                Simulation.unblock_reader(src)
+                Simulation.unblock_writer(dst)
+            await loop.run_in_executor(None, workers.shutdown)
+            raise
+        finally:
+            workers.shutdown(wait=False)
+            monitor.finished.set()
+            tuner.cancel()
+            self.remove_pipes()
+            for helper in (reporter, stopper):
+                if helper is not None:
+                    helper.cancel()
+            await asyncio.gather(
+                *(h for h in (reporter, stopper) if h is not None),
+                return_exceptions=True
+            )
+        # a callback that failed after the processes had finished
+        for helper in (reporter, stopper):
+            if helper is not None and not helper.cancelled() and helper.exception():
+                raise helper.exception()
+        if self.stopped is not None:
+            self.truncate_outputs()
         end = time.time()
+
+        self.results = [logs[id(c)][:2] for c in self.components]
+        self.report = RunReport(
+            [ProcessStats(c.name, c.cmd, **logs[id(c)][2]) for c in self.components],
+            self.pipe_stats(relays, transferred),
+            end-start, stopped=self.stopped
+        )
         print(f'Simulation completed after {round(end-start, 2)} seconds.')
+        if store is not None and self.stopped is None:
+            await loop.run_in_executor(
+                None, store.save, key, self.result_files, self.results
+            )
         return [ComponentLog(p, e) for (p, e) in self.results]
-    
+
     ########################################################################### 
-    def run_loop(self, loop, commands):
-        self.results = loop.run_until_complete(commands)
+    def check(self):
+        '''Static check of the graph for pipes without writer or reader,
+        stray named pipes and cycles (see pysimfs.check.check_graph).
+
+        Returns
+        list of problem descriptions, empty if the graph can run
+        '''
+        self.remap()
+        return check_graph(self)
 
     ########################################################################### 
-    def clear(self):
-        self.components = []
-        for p in self.open_pipes:
+    async def watchdog(self, monitor):
+        '''Raise a DeadlockError once nothing moved for stall_timeout seconds.
+        Only waits for the end of the run if stalls cannot be detected
+        (stall_timeout None or no /proc).'''
+        window = self.stall_timeout
+        if window is None or not os.path.exists(f'/proc/{os.getpid()}/io'):
+            return await monitor.finished.wait()
+        poll = min(1.0, window/4)
+        last, since = None, time.time()
+        while not monitor.done:
+            await asyncio.sleep(poll)
+            now, activity = time.time(), monitor.activity()
+            if activity != last:
+                last, since = activity, now
+            elif now - since >= window:
+                raise DeadlockError(
+                    f'No progress for {window} seconds, aborted.\n'
+                    + diagnose(self, monitor.procs)
+                )
+
+    ########################################################################### 
+    async def stop_when(self, monitor, conditions, poll=0.05):
+        '''Evaluate the stop conditions on progress samples every poll
+        seconds and stop the sources once one of them is met.'''
+        sampler = monitor.fork()
+        while not monitor.done:
+            await asyncio.sleep(poll)
+            sample = sampler.sample()
+            met = [c for c in conditions if c(sample)]
+            if met:
+                self.stopped = met[0]
+                print(f'Stop condition {met[0]} met, stopping the sources.')
+                return await self.stop_sources(monitor, poll)
+
+    ########################################################################### 
+    async def stop_sources(self, monitor, poll=0.05):
+        '''Stop the components without matched inputs: processes are
+        terminated, in-process stages cancelled. Their output pipes close,
+        so every component downstream reads to the end of the data written
+        so far and finishes normally. Processes that have not started yet
+        are stopped as soon as they are.'''
+        matched = {elem.name for elem in self.matched}
+        pending = [
+            c for c in self.components
+            if not c.cacheable and not any(e.name in matched for e in c.inputs)
+        ]
+        while pending and not monitor.done:
+            for c in list(pending):
+                if c.inprocess:
+                    c.cancel()
+                elif c.name in monitor.procs:
+                    monitor.stopped.add(c.name)
+                    try:
+                        monitor.procs[c.name].terminate()
+                    except ProcessLookupError:
+                        pass
+                else:
+                    continue
+                # readers still waiting for the source to open a pipe
+                for elem in c.outputs:
+                    if elem.name in matched:
+                        Simulation.unblock_reader(elem.name)
+                pending.remove(c)
+            await asyncio.sleep(poll)
+
+    ########################################################################### 
+    def truncate_outputs(self):
+        '''Cut the output files of a stopped run to whole records, a source
+        may have been stopped in the middle of a write.'''
+        for o in self.unmatched_out:
+            try:
+                size = os.path.getsize(o.name)
+            except OSError:
+                continue
+            itemsize = np.dtype(o.dtype).itemsize
+            if os.path.isfile(o.name) and size % itemsize:
+                os.truncate(o.name, size - size % itemsize)
+
+    ########################################################################### 
+    async def tune_pipes(self, monitor, relays, poll=0.005):
+        '''Resize the pipes that have a capacity as soon as all their ends
+        are open, their buffers do not exist before (see Pipe.resize).'''
+        pending = {
+            path: pipe for path, pipe in self.open_pipes.items()
+            if pipe.capacity is not None and path not in relays.values()
+        }
+        ends = pipe_ends(self)
+        while pending and not monitor.done:
+            await asyncio.sleep(poll)
+            own = open_pipes_of(os.getpid())
+            opened = {
+                name: open_pipes_of(p.pid) for name, p in monitor.procs.items()
+                if p.returncode is None
+            }
+            for path in list(pending):
+                writers, readers = ends[path]
+                procs = [getattr(n, 'name', None) for n in writers+readers]
+                procs = [monitor.procs[n] for n in procs if n in monitor.procs]
+                # sinks and the relays of profiled pipes run in this process
+                states = [
+                    path in opened.get(n.name, ())
+                    if getattr(n, 'name', None) in monitor.procs else path in own
+                    for n in ([] if path in relays else writers) + readers
+                ]
+                if path in relays:
+                    states.append(path in own)
+                if all(states):
+                    pending.pop(path).resize()
+                elif any(p.returncode is not None for p in procs):
+                    # an end has finished already, too late to resize
+                    pending.pop(path)
+
+    ########################################################################### 
+    @staticmethod
+    async def report_progress(monitor, callback, interval):
+        while not monitor.done:
             try:
-                os.remove(p)
-            except Exception as e:
+                await asyncio.wait_for(monitor.finished.wait(), interval)
+            except asyncio.TimeoutError:
+                callback(monitor.sample())
+
+    ########################################################################### 
+    async def watch(self, interval=1.0):
+        '''Async iterator of progress samples of the current run.
+
+        Waits for run_async to start if it has not yet, yields a
+        pysimfs.monitor.Progress every interval seconds and ends with the
+        run, raising its exception if it failed:
+
+            task = asyncio.ensure_future(S.run_async())
+            async for p in S.watch(10):
+                print(p.fraction, p.eta)
+            await task
+        '''
+        run = self.running
+        if run is None or run.done():
+            # a run that has been started but not entered run_async yet
+            while self.running is run:
+                await asyncio.sleep(min(interval, 0.05))
+            run = self.running
+        while not run.done():
+            await asyncio.wait({run}, timeout=interval)
+            if not run.done() and self.monitor is not None:
+                yield self.monitor.sample()
+        if not run.cancelled() and run.exception() is not None:
+            raise run.exception()
+
+    ########################################################################### 
+    def make_relays(self):
+        '''Route every matched pipe through a counting relay. Returns a
+        mapping of pipe to the pipe its writer writes to instead.'''
+        relays = {}
+        for elem in self.matched:
+            src = elem.name + '.w'
+            self.open_pipe(src)
+            relays[elem.name] = src
+        return relays
+
+    ########################################################################### 
+    @staticmethod
+    def relayed_params(comp, relays):
+        if not relays:
+            return comp._params
+        comp = copy.deepcopy(comp)
+        comp.remap_outputs(relays)
+        return comp._params
+
+    ########################################################################### 
+    def pipe_stats(self, relays, transferred):
+        dtypes = {elem.name: elem.dtype for elem in self.matched}
+        ends = {}
+        for node in self.components + self.sinks:
+            for elem in node.outputs:
+                ends.setdefault(elem.name, [None, None])[0] = node.name
+            for elem in node.inputs:
+                ends.setdefault(elem.name, [None, None])[1] = getattr(
+                    node, 'name', repr(node)
+                )
+        return [
+            PipeStats(
+                self.pipe_names.get(p, p), p, *ends.get(p, (None, None)),
+                n, n // np.dtype(dtypes[p]).itemsize
+            )
+            for p, n in zip(relays, transferred)
+        ]
+
+    ########################################################################### 
+    @property
+    def result_store(self):
+        if not self.memoize or self.sinks:
+            return None
+        if self.memoize is True:
+            if cache.result_cache is None:
+                print(
+                    'No result cache configured, the run is not memoized '
+                    '(see pysimfs.cache.configure_results).'
+                )
+            return cache.result_cache
+        return self.memoize
+
+    ########################################################################### 
+    @property
+    def result_files(self):
+        '''Files a memoized run saves and restores: the unmatched outputs and
+        the files written by the processes (e.g. the image of an Imager).
+        Cacheable components run again on a restore.'''
+        files = {o.name for o in self.unmatched_out}
+        for c in self.components:
+            if not c.cacheable:
+                files.update(c.output_files)
+        files.discard(os.devnull)
+        return sorted(files)
+
+    ########################################################################### 
+    def graph_key(self):
+        '''Hash of everything that determines the outputs of a run: the
+        validated params (with seeds) of all components, with pipe names
+        replaced by placeholders, the simfs binaries and the content of all
+        input files not written by the simulation itself.'''
+
+        self.remap()
+        placeholders = {p: f'<pipe:{n}>' for p, n in self.pipe_names.items()}
+        def normalize(x):
+            if isinstance(x, dict):
+                return {k: normalize(v) for k, v in x.items()}
+            if isinstance(x, list):
+                return [normalize(v) for v in x]
+            if isinstance(x, str):
+                return placeholders.get(x, x)
+            return x
+
+        graph = [
+            [c.fingerprint(), list(c.opts), normalize(c._params)]
+            for c in self.components
+        ]
+        files = {f.name for f in self.unmatched_in}
+        written = set()
+        for c in self.components:
+            files.update(c.input_files)
+            written.update(c.output_files)
+        digests = {
+            f: cache.file_digest(f)
+            for f in sorted(files - written) if os.path.isfile(f)
+        }
+        h = hashlib.sha256(cache.canonical_json([graph, digests]).encode())
+        return h.hexdigest()
+
+    ########################################################################### 
+    @staticmethod
+    def unblock_reader(path):
+        '''Release a reader waiting in open() on a pipe without writer.'''
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+    ########################################################################### 
+    @staticmethod
+    def unblock_writer(path):
+        '''Release a writer waiting in open() on a pipe without reader.'''
+        try:
+            os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+    ########################################################################### 
+    def remove_pipes(self):
+        for pipe in self.open_pipes.values():
+            try:
+                pipe.__exit__(None, None, None)
+            except OSError as e:
                 print('error', e)
+        self.open_pipes = {}
+
+    ########################################################################### 
+    def clear(self):
+        self.components = []
+        self.sinks = []
+        self._readers = {}
+        self._writers = {}
+        self._remaps = {}
+        self._edges = {}
+        self.remove_pipes()
         try:
             os.rmdir(self.tmpdir)
         except Exception as e:
@@ -128,14 +800,41 @@ class Simulation:
         return os.path.abspath(os.path.join(self.tmpdir, uid))
 
     ########################################################################### 
-    def get_results(self):
+    def get_results(self, mmap=True):
+        '''Results of all unmatched outputs by filename.
+
+        With mmap (default), results are read-only memory maps of the output
+        files, otherwise they are loaded into memory.'''
         res = {}
         for o in self.unmatched_out:
             if o.name == os.devnull: 
                 continue
-            res[o.name] = np.fromfile(o.name, o.dtype)
+            if mmap:
+                res[o.name] = map_file(o.name, o.dtype)
+            else:
+                res[o.name] = np.fromfile(o.name, o.dtype)
         return res
+
+    ########################################################################### 
+    def iter_results(self, name, chunk_size=1<<20):
+        '''Read the unmatched output name block by block.
+
+        Yields structured arrays of at most chunk_size records of the
+        output's dtype, so outputs larger than memory can be processed.'''
+        for o in self.unmatched_out:
+            if o.name == name:
+                return iter_chunks(o.name, o.dtype, chunk_size)
+        raise KeyError(f'{name} is not an output of the simulation.')
            
+    ########################################################################### 
+    @property
+    def processes(self):
+        '''Components that run as simfs processes: neither in-process stages
+        nor cacheable components, which run before the processes start'''
+        return [
+            c for c in self.components if not (c.cacheable or c.inprocess)
+        ]
+
     ########################################################################### 
     @property
     def inputs(self):
@@ -167,11 +866,198 @@ class Simulation:
     ########################################################################### 
     @staticmethod
     async def call_simfs_async(cmd, *opts, **params):
-        proc = await asyncio.create_subprocess_exec(
-            cmd, *opts, 
-            stdin=asyncio.subprocess.PIPE, 
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        out, err, _ = await Simulation.run_simfs_async(cmd, opts, params)
+        return out, err
+
+    ########################################################################### 
+    @staticmethod
+    async def run_simfs_async(cmd, opts, params, started=None, stopped=None):
+        '''Run a component process and measure its resource usage.
+
+        The pipes of the process are served and the process is reaped on the
+        event loop (see wait_simfs), no thread is blocked while it runs. On
+        cancellation the process is killed and reaped before the
+        cancellation is propagated. started is called with the Popen object
+        once the process is running. stopped tells if the process was
+        stopped on purpose (see stop_sources). If it was terminated by that,
+        its params are returned as given, a process that exited by itself
+        before is reported as usual.
+
+        Returns
+        (params, stderr, usage) with usage a dict of returncode, wall, user
+        and sys time in seconds and max_rss in bytes (None if unknown)
+        '''
+
+        proc = subprocess.Popen(
+            [cmd]+list(opts), 
+            stdin=subprocess.PIPE, 
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.PIPE,
         )
-        out, err = await proc.communicate(input=json.dumps(params).encode('utf-8'))
-        return json.loads(out.decode().strip()), err.decode().strip()
+        if started is not None:
+            started(proc)
+        start = time.perf_counter()
+        future = asyncio.ensure_future(
+            Simulation.wait_simfs(proc, json.dumps(params).encode('utf-8'))
+        )
+        try:
+            out, err, returncode, rusage = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            # repeated cancellations are ignored, the process is already dead
+            while not future.done():
+                try:
+                    await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    pass
+            raise
+        usage = dict(
+            returncode=returncode,
+            wall=time.perf_counter()-start,
+            user=rusage and rusage.ru_utime,
+            sys=rusage and rusage.ru_stime,
+            max_rss=rusage and rusage.ru_maxrss*(1 if sys.platform == 'darwin' else 1024)
+        )
+        terminated = usage['returncode'] == -signal.SIGTERM
+        if terminated and stopped is not None and stopped():
+            return params, err.decode().strip() or 'Stopped', usage
+        return json.loads(out.decode().strip()), err.decode().strip(), usage
+
+    ########################################################################### 
+    @staticmethod
+    async def wait_simfs(proc, data):
+        '''Send data to a process, collect its output and reap it, all on the
+        event loop. Returns (stdout, stderr, returncode, rusage).'''
+        out, err, _ = await asyncio.gather(
+            Simulation.read_pipe(proc.stdout),
+            Simulation.read_pipe(proc.stderr),
+            Simulation.write_pipe(proc.stdin, data)
+        )
+        returncode, rusage = await Simulation.reap(proc)
+        return out, err, returncode, rusage
+
+    ########################################################################### 
+    @staticmethod
+    def read_pipe(f):
+        '''Future of everything read from the pipe file f until EOF. f is
+        read when the event loop finds it readable and closed at the end.'''
+        loop = asyncio.get_running_loop()
+        fd = f.fileno()
+        os.set_blocking(fd, False)
+        chunks, done = [], loop.create_future()
+        def read():
+            try:
+                chunk = os.read(fd, 1 << 16)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                done.set_exception(e)
+                return
+            if chunk:
+                chunks.append(chunk)
+            else:
+                done.set_result(b''.join(chunks))
+        def close(_):
+            loop.remove_reader(fd)
+            f.close()
+        done.add_done_callback(close)
+        loop.add_reader(fd, read)
+        return done
+
+    ########################################################################### 
+    @staticmethod
+    async def write_pipe(f, data):
+        '''Write data to the pipe file f when the event loop finds it
+        writable and close it. A reader that has gone is ignored.'''
+        loop = asyncio.get_running_loop()
+        fd = f.fileno()
+        os.set_blocking(fd, False)
+        try:
+            while data:
+                try:
+                    data = data[os.write(fd, data):]
+                except BlockingIOError:
+                    await Simulation.fd_ready(fd, loop.add_writer, loop.remove_writer)
+        except BrokenPipeError:
+            pass
+        finally:
+            f.close()
+
+    ########################################################################### 
+    @staticmethod
+    async def fd_ready(fd, add, remove):
+        '''Wait until the event loop reports fd as ready, add and remove are
+        loop.add_reader/remove_reader or loop.add_writer/remove_writer'''
+        ready = asyncio.get_running_loop().create_future()
+        add(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+    ########################################################################### 
+    @staticmethod
+    async def reap(proc):
+        '''Reap proc with wait4 once it has exited. The exit is awaited on a
+        pidfd where available (Linux), otherwise wait4 is polled.
+
+        Returns
+        (returncode, rusage), rusage is None if the process was reaped
+        elsewhere (by Popen.poll, e.g. in terminate)
+        '''
+
+        loop = asyncio.get_running_loop()
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+        delay = 1e-3
+        try:
+            while True:
+                try:
+                    pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+                except ChildProcessError:
+                    return proc.returncode, None
+                if pid:
+                    break
+                if pidfd is not None:
+                    await Simulation.fd_ready(pidfd, loop.add_reader, loop.remove_reader)
+                else:
+                    await asyncio.sleep(delay)
+                    delay = min(2*delay, 0.05)
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, rusage
+
+    ########################################################################### 
+    @staticmethod
+    def run_inprocess(comp):
+        start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            params, err = comp.run_inprocess()
+            returncode = 0
+        except BrokenPipeError:
+            # the reader of an output has gone
+            params, err, returncode = comp._params, 'Broken pipe', 1
+        usage = dict(
+            returncode=returncode, wall=time.perf_counter()-start,
+            user=time.thread_time()-cpu, sys=0.0, max_rss=None
+        )
+        return params, err, usage
+
+    ########################################################################### 
+    @staticmethod
+    async def run_cached_async(comp):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        params, err = await loop.run_in_executor(None, comp.run_cached)
+        usage = dict(
+            returncode=0, wall=time.perf_counter()-start,
+            user=None, sys=None, max_rss=None
+        )
+        return params, err, usage
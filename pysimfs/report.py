@@ -0,0 +1,102 @@
+from collections import namedtuple
+import json
+
+###############################################################################
+ProcessStats = namedtuple('ProcessStats', [
+    'component', 'cmd', 'returncode', 'wall', 'user', 'sys', 'max_rss'
+])
+ProcessStats.__doc__ = '''Resource usage of one component: wall, user and
+system time in seconds and peak resident memory in bytes (None where not
+measured, e.g. for cached components).'''
+
+PipeStats = namedtuple('PipeStats', [
+    'name', 'path', 'writer', 'reader', 'bytes', 'records'
+])
+PipeStats.__doc__ = '''Data moved through one matched pipe, from the writer
+component to the reader (component or sink).'''
+
+###############################################################################
+class RunReport:
+
+    '''Structured profile of a simulation run.
+
+    Every Simulation.run stores a report in Simulation.report. Process stats
+    are always collected. Pipe stats are only available for simulations
+    created with profile=True, which relays every matched pipe through a
+    counting thread. stopped is the stop condition that ended the run
+    early, if any (its repr in reports loaded from JSON).
+    '''
+
+    def __init__(self, processes=(), pipes=(), wall=0.0, restored=False,
+            stopped=None):
+        self.processes = list(processes)
+        self.pipes = list(pipes)
+        self.wall = wall
+        self.restored = restored
+        self.stopped = stopped
+
+    def __repr__(self):
+        return f'RunReport({len(self.processes)} processes, {round(self.wall, 3)} s)'
+
+    def __str__(self):
+        lines = [f'{"component":40} {"wall/s":>9} {"user/s":>9} {"sys/s":>9} {"rss/MB":>9}']
+        fmt = lambda v, scale=1: f'{v/scale:9.3f}' if v is not None else f'{"-":>9}'
+        for p in self.processes:
+            lines.append(
+                f'{p.component:40} {fmt(p.wall)} {fmt(p.user)} {fmt(p.sys)} '
+                f'{fmt(p.max_rss, 1<<20)}'
+            )
+        if self.pipes:
+            lines.append(f'{"pipe":40} {"MB":>9} {"records":>19}')
+            for p in self.pipes:
+                lines.append(f'{p.name:40} {fmt(p.bytes, 1<<20)} {p.records:19d}')
+        total = f'total {self.wall:.3f} s' + (' (restored)' if self.restored else '')
+        if self.stopped is not None:
+            total += f' (stopped by {self.stopped})'
+        lines.append(total)
+        return '\n'.join(lines)
+
+    ###########################################################################
+    @property
+    def bottleneck(self):
+        '''ProcessStats of the component with the most CPU time'''
+        measured = [p for p in self.processes if p.user is not None]
+        if not measured:
+            return None
+        return max(measured, key=lambda p: p.user+p.sys)
+
+    ###########################################################################
+    def to_dict(self) -> dict:
+        return dict(
+            wall=self.wall,
+            restored=self.restored,
+            stopped=None if self.stopped is None else repr(self.stopped),
+            processes=[p._asdict() for p in self.processes],
+            pipes=[p._asdict() for p in self.pipes],
+        )
+
+    ###########################################################################
+    def to_json(self, filename=None) -> str:
+        ''' JSON representation of the report
+
+        Arguments
+        filename : if given, the JSON is also written to this file
+
+        Returns
+        JSON string
+        '''
+
+        s = json.dumps(self.to_dict(), indent=2)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(s)
+        return s
+
+    ###########################################################################
+    @staticmethod
+    def from_dict(d):
+        return RunReport(
+            [ProcessStats(**p) for p in d['processes']],
+            [PipeStats(**p) for p in d['pipes']],
+            d['wall'], d['restored'], d.get('stopped')
+        )
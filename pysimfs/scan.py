@@ -0,0 +1,354 @@
+import numpy as np
+
+from . import IO, coordinate_t
+from . import cache
+from . inprocess import InProcessComponent
+from . utils import new_filename
+
+###############################################################################
+# Scans
+#
+# A scan visits positions one after the other and stays at each for its
+# dwell time. As a coordinate_t stream, position i is a record at its start
+# time, a last record repeats the final position at the end time of the
+# scan. Components that sample coordinates (Excitation, Detection) write
+# one record per position at its start time, photons fall into the dwell
+# time of the position they were emitted at, so results are mapped back to
+# the positions by time (see Scan.index_of, Scan.reduce, Scan.to_grid).
+###############################################################################
+
+class Scan:
+
+    '''Positions visited in order, each for a dwell time.
+
+    Positions are generated block by block from their index, so large scans
+    are never held in memory as a whole.
+
+    Arguments
+    dwell : time per position, scalar or one value per position
+    t0 : start time of the first position
+    '''
+
+    kind = None
+    shape = ()
+
+    def __init__(self, dwell=1e-3, t0=0.0):
+        self.t0 = float(t0)
+        if np.ndim(dwell) == 0:
+            self.dwell = float(dwell)
+            self._starts = None
+        else:
+            self.dwell = np.asarray(dwell, 'f8')
+            if self.dwell.shape != (len(self),):
+                raise ValueError(f'{len(self.dwell)} dwell times for {len(self)} positions.')
+            self._starts = self.t0 + np.concatenate(([0.0], np.cumsum(self.dwell)))
+
+    def __len__(self):
+        return int(np.prod(self.shape))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(shape={self.shape}, duration={self.duration})'
+
+    ###########################################################################
+    def spec(self) -> dict:
+        '''JSON compatible description, see Scan.from_spec'''
+        dwell = self.dwell if self._starts is None else self.dwell.tolist()
+        return dict(type=self.kind, dwell=dwell, t0=self.t0, **self._spec())
+
+    def _spec(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def from_spec(spec):
+        spec = dict(spec)
+        return SCANS[spec.pop('type')](**spec)
+
+    ###########################################################################
+    def grid_index(self, i):
+        '''Index into an array of shape for the positions i'''
+        return np.unravel_index(i, self.shape)
+
+    def positions(self, i) -> np.ndarray:
+        '''Positions i as (len(i), 3) array of x, y, z'''
+        raise NotImplementedError
+
+    ###########################################################################
+    def starts(self, i) -> np.ndarray:
+        '''Start times of the positions i (i = len(self) is the end time)'''
+        if self._starts is None:
+            return self.t0 + np.asarray(i)*self.dwell
+        return self._starts[i]
+
+    @property
+    def duration(self):
+        return float(self.starts(len(self))) - self.t0
+
+    ###########################################################################
+    def coordinates(self, start=0, stop=None) -> np.ndarray:
+        '''Records of the positions start to stop (coordinate_t)'''
+        i = np.arange(start, len(self) if stop is None else stop)
+        c = np.empty(len(i), coordinate_t)
+        pos = self.positions(i)
+        c['x'], c['y'], c['z'] = pos[:, 0], pos[:, 1], pos[:, 2]
+        c['t'] = self.starts(i)
+        return c
+
+    ###########################################################################
+    def chunks(self, chunk_size=1<<16):
+        '''The coordinate_t stream of the scan block by block, the last
+        block holds the record at the end time'''
+        n = len(self)
+        for start in range(0, n, chunk_size):
+            yield self.coordinates(start, min(n, start+chunk_size))
+        end = self.coordinates(n-1, n)
+        end['t'] = self.starts(n)
+        yield end
+
+    ###########################################################################
+    def write(self, filename=None, chunk_size=1<<16) -> str:
+        ''' Write the coordinate_t stream to a file
+
+        Arguments
+        filename : file to write (default: new file named after the scan)
+
+        Returns
+        filename
+        '''
+
+        filename = filename or new_filename(f'{self.kind}_scan')
+        with open(filename, 'wb') as f:
+            for chunk in self.chunks(chunk_size):
+                f.write(chunk.tobytes())
+        return filename
+
+    ###########################################################################
+    def index_of(self, t) -> np.ndarray:
+        '''Position at times t, -1 before the start and after the end'''
+        t = np.asarray(t, 'f8')
+        n = len(self)
+        if self._starts is None:
+            i = np.clip(np.floor((t - self.t0)/self.dwell), 0, n).astype('i8')
+            # the quotient may round across a boundary, the start times decide
+            i -= (i > 0) & (self.starts(i) > t)
+            i += (i < n) & (self.starts(i+1) <= t)
+        else:
+            i = np.searchsorted(self._starts, t, 'right') - 1
+        return np.where((t < self.t0) | (i >= n) | (i < 0), -1, i)
+
+    ###########################################################################
+    def reduce(self, t, values=None, statistic='count') -> np.ndarray:
+        ''' Per position statistic of records at times t
+
+        Arguments
+        t : time stamps of the records
+        values : values of the records (for 'sum' and 'mean')
+        statistic : 'count', 'rate' (count per dwell time), 'sum' or 'mean'
+                    (nan for positions without records)
+
+        Returns
+        array with one value per position
+        '''
+
+        i = self.index_of(t)
+        keep = i >= 0
+        counts = np.bincount(i[keep], minlength=len(self))
+        if statistic == 'count':
+            return counts
+        if statistic == 'rate':
+            return counts / self.dwell
+        if values is None:
+            raise ValueError(f'Statistic {statistic} needs values.')
+        sums = np.bincount(i[keep], np.asarray(values)[keep], minlength=len(self))
+        if statistic == 'sum':
+            return sums
+        if statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(counts > 0, sums/counts, np.nan)
+        raise ValueError(f'Unknown statistic {statistic}.')
+
+    ###########################################################################
+    def to_grid(self, per_position, fill=np.nan) -> np.ndarray:
+        '''Arrange one value per position in an array of shape'''
+        per_position = np.asarray(per_position)
+        grid = np.full(self.shape, fill, np.result_type(per_position, type(fill)))
+        grid[self.grid_index(np.arange(len(self)))] = per_position
+        return grid
+
+    ###########################################################################
+    def image(self, records) -> np.ndarray:
+        ''' Map an output of a scanned simulation onto the grid
+
+        Arguments
+        records : timed_value_t records (e.g. of Excitation or Detection) or
+                  time tags (e.g. photons)
+
+        Returns
+        array of shape, the mean value per position for timed values, the
+        count rate per position for time tags
+        '''
+
+        if records.dtype.names is None:
+            return self.to_grid(self.reduce(records, statistic='rate'))
+        return self.to_grid(self.reduce(records['t'], records['v'], 'mean'))
+
+###############################################################################
+class GridScan(Scan):
+
+    '''Regular 3D grid, x slowest and z fastest (the order of GridData)
+
+    Arguments
+    xspec, yspec, zspec : (min, max, n) range and number of points
+    '''
+
+    kind = 'grid'
+
+    def __init__(self, xspec, yspec, zspec, dwell=1e-3, t0=0.0):
+        self.axes = [np.linspace(*s[:2], int(s[2])) for s in (xspec, yspec, zspec)]
+        self.shape = tuple(len(a) for a in self.axes)
+        super().__init__(dwell, t0)
+
+    def _spec(self):
+        return dict(zip(
+            ('xspec', 'yspec', 'zspec'),
+            ([float(a[0]), float(a[-1]), len(a)] for a in self.axes)
+        ))
+
+    def positions(self, i):
+        ix, iy, iz = self.grid_index(i)
+        x, y, z = self.axes
+        return np.column_stack((x[ix], y[iy], z[iz]))
+
+###############################################################################
+class RasterScan(Scan):
+
+    '''Lines along x stepped in y at height z, as a confocal raster scan
+
+    Arguments
+    xspec, yspec : (min, max, n) range and number of points
+    z : height of the scanned plane
+    bidirectional : scan every other line backwards
+
+    The grid shape is (ny, nx), rows are lines.
+    '''
+
+    kind = 'raster'
+
+    def __init__(self, xspec, yspec, z=0.0, dwell=1e-3, t0=0.0, bidirectional=False):
+        self.x = np.linspace(*xspec[:2], int(xspec[2]))
+        self.y = np.linspace(*yspec[:2], int(yspec[2]))
+        self.z = float(z)
+        self.bidirectional = bool(bidirectional)
+        self.shape = (len(self.y), len(self.x))
+        super().__init__(dwell, t0)
+
+    def _spec(self):
+        return dict(
+            xspec=[float(self.x[0]), float(self.x[-1]), len(self.x)],
+            yspec=[float(self.y[0]), float(self.y[-1]), len(self.y)],
+            z=self.z, bidirectional=self.bidirectional
+        )
+
+    def grid_index(self, i):
+        row, col = np.divmod(np.asarray(i), len(self.x))
+        if self.bidirectional:
+            col = np.where(row % 2, len(self.x)-1 - col, col)
+        return row, col
+
+    def positions(self, i):
+        row, col = self.grid_index(i)
+        return np.column_stack((self.x[col], self.y[row], np.full(len(row), self.z)))
+
+###############################################################################
+class LineScan(Scan):
+
+    '''Equally spaced points from start to stop, repeated
+
+    Arguments
+    start, stop : (x, y, z) end points of the line
+    n : number of points on the line
+    repeats : number of passes
+
+    The grid shape is (repeats, n).
+    '''
+
+    kind = 'line'
+
+    def __init__(self, start, stop, n, dwell=1e-3, t0=0.0, repeats=1):
+        self.start = np.asarray(start, 'f8')
+        self.stop = np.asarray(stop, 'f8')
+        self.shape = (int(repeats), int(n))
+        super().__init__(dwell, t0)
+
+    def _spec(self):
+        return dict(
+            start=self.start.tolist(), stop=self.stop.tolist(),
+            n=self.shape[1], repeats=self.shape[0]
+        )
+
+    def positions(self, i):
+        n = self.shape[1]
+        f = (np.asarray(i) % n) / max(1, n-1)
+        return self.start + f[:, None]*(self.stop - self.start)
+
+###############################################################################
+class PointScan(Scan):
+
+    '''Arbitrary positions
+
+    Arguments
+    points : (n, 3) array of x, y, z
+    '''
+
+    kind = 'points'
+
+    def __init__(self, points, dwell=1e-3, t0=0.0):
+        self.points = np.asarray(points, 'f8').reshape(-1, 3)
+        self.shape = (len(self.points),)
+        super().__init__(dwell, t0)
+
+    def _spec(self):
+        return dict(points=self.points.tolist())
+
+    def positions(self, i):
+        return self.points[i]
+
+SCANS = {cls.kind: cls for cls in (GridScan, RasterScan, LineScan, PointScan)}
+
+###############################################################################
+class ScanSource(InProcessComponent):
+
+    '''Write the coordinates of a scan to output, a thread of the Python
+    process like the in-process components.
+
+    Matched with the input of e.g. Excitation, the coordinates are streamed
+    through a pipe as they are generated and never stored.
+
+    Example
+    scan = RasterScan((-1e-6, 1e-6, 101), (-1e-6, 1e-6, 101), dwell=1e-4)
+    S.add(ScanSource(scan, output='coords'))
+    S.add(Excitation(input='coords', output='flux'))
+    S.run()
+    image = scan.image(S.get_results()['flux'])
+    '''
+
+    cmd = 'inprocess/scan'
+    output_paths = [IO('output', coordinate_t)]
+    defaults = dict(output='__coordinates__', scan=None)
+
+    def __init__(self, scan=None, name=None, lazy=False, **params):
+        if isinstance(scan, Scan):
+            scan = scan.spec()
+        super().__init__(name, lazy, scan=scan, **params)
+
+    def fingerprint(self):
+        return cache.file_digest(__file__)
+
+    def process(self):
+        p = self._params
+        scan = Scan.from_spec(p['scan'])
+        with open(p['output'], 'wb') as out:
+            for chunk in scan.chunks(self.chunk_size):
+                if self._cancelled.is_set():
+                    return
+                self.write(out, chunk)
+                self.records += len(chunk)
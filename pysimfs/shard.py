@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+
+from . sweep import Sweep, reseed
+from . utils import iter_chunks, map_file
+
+###############################################################################
+def merge_shards(files, output, dtype, duration, warmup=0.0, chunk_size=1<<20):
+    ''' Concatenate the outputs of time shards into one output
+
+    Shard i covers [warmup, warmup+duration) of its own simulated time.
+    Records outside this window are dropped (the last shard keeps its tail),
+    the rest are moved to i*duration + t - warmup.
+
+    Arguments
+    files : shard outputs in order of time
+    output : filename of the merged output
+    dtype : record type of the outputs (timetag_t or a dtype with field t)
+    duration : simulated time per shard (without warmup)
+    warmup : simulated time dropped at the start of every shard
+    chunk_size : number of records processed at once
+
+    Returns
+    number of records written
+    '''
+
+    dtype = np.dtype(dtype)
+    n = 0
+    with open(output, 'wb') as out:
+        for i, fn in enumerate(files):
+            last = i == len(files)-1
+            for chunk in iter_chunks(fn, dtype, chunk_size):
+                t = chunk if dtype.names is None else chunk['t']
+                keep = t >= warmup
+                if not last:
+                    keep &= t < warmup+duration
+                chunk = chunk[keep]
+                if dtype.names is None:
+                    chunk = chunk + (i*duration - warmup)
+                else:
+                    chunk['t'] += i*duration - warmup
+                out.write(chunk.tobytes())
+                n += len(chunk)
+    return n
+
+###############################################################################
+class Shards(Sweep):
+
+    '''Run one long simulation as concurrent shards in time.
+
+    The experiment_time of the graph (the longest experiment_time of its
+    components unless given) is split into shards of equal length,
+    which are simulated concurrently as independent graphs (under the
+    process budget of a Sweep) and merged into the graph's outputs with
+    their time offsets. Every component with a seed gets an independent
+    seed per shard, drawn from seed.
+
+    This assumes that shards are statistically independent, which holds
+    for freely diffusing molecules started at random positions. Fluorophore
+    states and other correlations on timescales above warmup are reset at
+    every shard boundary; with warmup > 0, each shard is simulated for
+    that much longer and the start is discarded.
+
+    Example
+    def graph():
+        return [Diffusion(experiment_time=3600, ...), Excitation(...), ...]
+
+    Shards(graph, shards=32, warmup=1e-3).run_all()
+    '''
+
+    def __init__(self, factory, shards=None, experiment_time=None, warmup=0.0,
+            seed=None, budget=None, timeout=None, retries=0,
+            tmpdir='./pysimfs_tmp'):
+
+        shards = shards or os.cpu_count() or 1
+        if experiment_time is None:
+            experiment_time = max(
+                c._params.get('experiment_time', 0) for c in factory()
+            )
+        super().__init__(
+            factory, [dict(shard=i) for i in range(shards)],
+            budget, timeout, retries, tmpdir
+        )
+        self.experiment_time = experiment_time
+        self.duration = experiment_time/shards
+        self.warmup = warmup
+        self.seeds = np.random.SeedSequence(seed).spawn(shards)
+        self.outputs = {}
+
+    ###########################################################################
+    @staticmethod
+    def shard_file(name, shard):
+        return f'{name}.shard{shard}'
+
+    ###########################################################################
+    def build(self, sim, factory, point):
+        shard = point['shard']
+        components = reseed(list(factory()), self.seeds[shard])
+        for comp in components:
+            if 'experiment_time' in comp._params:
+                comp.params['experiment_time'] = self.duration + self.warmup
+            sim.add(comp)
+        outputs = {o.name: o.dtype for o in sim.unmatched_out if o.name != os.devnull}
+        self.outputs.update(outputs)
+        sim.rename_outputs({o: Shards.shard_file(o, shard) for o in outputs})
+
+    ###########################################################################
+    def run(self):
+        '''Generator of the SweepResults of all shards in order of completion.
+        The outputs are merged once all shards have completed.'''
+
+        failed = []
+        for r in super().run():
+            if r.error is not None:
+                failed.append(r.index)
+            yield r
+        if failed:
+            raise RuntimeError(f'Shards {failed} failed, outputs not merged.')
+        self.merge()
+
+    ###########################################################################
+    def merge(self):
+        for name, dtype in self.outputs.items():
+            files = [Shards.shard_file(name, i) for i in range(len(self.runs))]
+            merge_shards(files, name, dtype, self.duration, self.warmup)
+            for fn in files:
+                os.remove(fn)
+
+    ###########################################################################
+    def get_results(self):
+        '''Merged outputs by filename (read-only memory maps)'''
+        return {name: map_file(name, dtype) for name, dtype in self.outputs.items()}
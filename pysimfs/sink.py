@@ -0,0 +1,194 @@
+import numpy as np
+
+from . import IO, timetag_t
+from . utils import iter_chunks
+from . monitor import last_time
+from . storage import TickWriter
+
+###############################################################################
+class Sink:
+
+    '''Python consumer of a simulation output.
+
+    A sink is added to a Simulation with add_sink and matched to a component
+    output by name, like a component input. While the simulation runs, the
+    connecting pipe is read in a background thread and every block of up to
+    chunk_size records is passed to consume. The simulation's writer blocks
+    as long as consume is busy, so a slow sink throttles its producer
+    instead of buffering data. If the input remains unmatched, the sink
+    reads the existing file of that name.
+
+    Subclasses implement consume(chunk) and optionally close(), which is
+    called once the input is exhausted.
+    '''
+
+    dtype = timetag_t
+
+    def __init__(self, input, dtype=None, chunk_size=1<<16):
+        self.input = input
+        self.dtype = np.dtype(self.dtype if dtype is None else dtype)
+        self.chunk_size = chunk_size
+        self.records = 0
+        self.last = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}:{self.input}'
+
+    ###########################################################################
+    @property
+    def inputs(self):
+        return {IO(self.input, self.dtype)}
+
+    ###########################################################################
+    @property
+    def outputs(self):
+        return set()
+
+    ###########################################################################
+    def remap_inputs(self, mapping):
+        self.input = mapping.get(self.input, self.input)
+
+    ###########################################################################
+    def remap_outputs(self, mapping):
+        pass
+
+    ###########################################################################
+    def consume(self, chunk: np.ndarray):
+        raise NotImplementedError
+
+    ###########################################################################
+    def close(self):
+        pass
+
+    ###########################################################################
+    def drain(self):
+        '''Read the input until the writer closes it. Counts the records
+        and keeps the latest time stamp for progress monitoring.'''
+        try:
+            for chunk in iter_chunks(self.input, self.dtype, self.chunk_size):
+                self.consume(chunk)
+                self.records += len(chunk)
+                self.last = last_time(chunk[-1])
+        finally:
+            self.close()
+
+###############################################################################
+class CallbackSink(Sink):
+
+    '''Sink that passes every block to callback(chunk)'''
+
+    def __init__(self, input, callback, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.callback = callback
+
+    def consume(self, chunk):
+        self.callback(chunk)
+
+###############################################################################
+class ArraySink(Sink):
+
+    '''Sink that collects the complete stream in memory (as data)'''
+
+    def __init__(self, input, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.chunks = []
+        self.data = np.empty(0, self.dtype)
+
+    def consume(self, chunk):
+        self.chunks.append(chunk)
+
+    def close(self):
+        self.data = np.concatenate([self.data]+self.chunks)
+        self.chunks = []
+
+###############################################################################
+class HistogramSink(Sink):
+
+    '''Sink that accumulates a histogram of the stream.
+
+    Arguments
+    input : name of the output to consume
+    bins : bin edges passed to np.histogram
+    field : record field to histogram, e.g. 't' for coordinate_t and
+            timed_value_t streams, None for plain timetags
+    '''
+
+    def __init__(self, input, bins, field=None, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.bins = np.asarray(bins)
+        self.field = field
+        self.counts = np.zeros(len(self.bins)-1, dtype='i8')
+
+    def consume(self, chunk):
+        values = chunk if self.field is None else chunk[self.field]
+        self.counts += np.histogram(values, self.bins)[0]
+
+###############################################################################
+class FileSink(Sink):
+
+    '''Sink that writes the stream to filename'''
+
+    def __init__(self, input, filename, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.filename = filename
+        self.file = None
+        self.n = 0
+
+    def consume(self, chunk):
+        if self.file is None:
+            self.file = open(self.filename, 'wb')
+        self.file.write(chunk.tobytes())
+        self.n += len(chunk)
+
+    def close(self):
+        if self.file is None:
+            open(self.filename, 'wb').close()
+        else:
+            self.file.close()
+            self.file = None
+
+###############################################################################
+class CompactSink(Sink):
+
+    '''Sink that writes the stream to a compact record file (integer ticks
+    of resolution, delta encoded and compressed in chunks of
+    records_per_chunk, see pysimfs.storage.TickWriter)'''
+
+    def __init__(self, input, filename, dtype=None, resolution=1e-12,
+            codec='zlib', level=None, records_per_chunk=1<<20, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.filename = filename
+        self.options = dict(
+            resolution=resolution, codec=codec, level=level,
+            chunk_size=records_per_chunk
+        )
+        self.writer = None
+
+    def consume(self, chunk):
+        if self.writer is None:
+            self.writer = TickWriter(self.filename, self.dtype, **self.options)
+        self.writer.write(chunk)
+
+    def close(self):
+        if self.writer is None:
+            self.writer = TickWriter(self.filename, self.dtype, **self.options)
+        self.writer.close()
+        self.writer = None
+
+###############################################################################
+class TeeSink(Sink):
+
+    '''Sink that passes every block to several sinks of the same input'''
+
+    def __init__(self, input, sinks, dtype=None, chunk_size=1<<16):
+        super().__init__(input, dtype, chunk_size)
+        self.sinks = list(sinks)
+
+    def consume(self, chunk):
+        for s in self.sinks:
+            s.consume(chunk)
+            s.records += len(chunk)
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
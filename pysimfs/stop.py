@@ -0,0 +1,117 @@
+import copy
+
+###############################################################################
+# Stop conditions
+#
+# Conditions are evaluated on the live progress samples of a run (see
+# pysimfs.monitor.Progress), i.e. on the output files as they grow and the
+# records consumed by sinks. Once one is met, Simulation.run stops the
+# sources of the graph and lets the rest of the pipeline drain. Any
+# callable taking a Progress and returning a bool is a condition as well.
+###############################################################################
+
+class StopCondition:
+
+    '''Base of the stop conditions that refer to outputs by name
+
+    Arguments
+    output : name of an unmatched output or of the output a sink reads
+             (default: all outputs)
+    '''
+
+    def __init__(self, output=None):
+        self.output = output
+        self._names = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.output or "all outputs"})'
+
+    ###########################################################################
+    def bind(self, simulation):
+        '''Copy of the condition for one simulation, which knows the output
+        names of the sinks and outputs in its progress samples'''
+
+        bound = copy.copy(self)
+        bound._names = {}
+        for o in simulation.unmatched_out:
+            bound._names[o.name] = o.name
+        for s in simulation.sinks:
+            bound._names[repr(s)] = simulation.pipe_names.get(s.input, s.input)
+        if self.output is not None and self.output not in bound._names.values():
+            raise KeyError(f'{self.output} is not an output of the simulation.')
+        return bound
+
+    ###########################################################################
+    def selected(self, progress):
+        ''' Progress of the selected outputs by output name. An output read by
+        several sinks counts once.
+
+        Returns
+        dict of output name -> list of OutputProgress
+        '''
+
+        outputs = {}
+        for o in progress.outputs:
+            name = self._names.get(o.name, o.name) if self._names else o.name
+            if self.output is None or name == self.output:
+                outputs.setdefault(name, []).append(o)
+        return outputs
+
+    ###########################################################################
+    def __call__(self, progress) -> bool:
+        raise NotImplementedError
+
+###############################################################################
+class PhotonCount(StopCondition):
+
+    '''Stop once the selected outputs hold n records in total (e.g. photons
+    of all detection channels)'''
+
+    def __init__(self, n, output=None):
+        super().__init__(output)
+        self.n = n
+
+    def __repr__(self):
+        return f'PhotonCount({self.n}, {self.output or "all outputs"})'
+
+    def __call__(self, progress):
+        counts = [max(o.records for o in v) for v in self.selected(progress).values()]
+        return sum(counts) >= self.n
+
+###############################################################################
+class SimulatedTime(StopCondition):
+
+    '''Stop once the latest record of the selected outputs is at time t'''
+
+    def __init__(self, t, output=None):
+        super().__init__(output)
+        self.t = t
+
+    def __repr__(self):
+        return f'SimulatedTime({self.t}, {self.output or "all outputs"})'
+
+    def __call__(self, progress):
+        times = [
+            o.t for v in self.selected(progress).values() for o in v
+            if o.t is not None
+        ]
+        return bool(times) and max(times) >= self.t
+
+###############################################################################
+def bind_conditions(stop, simulation):
+    ''' Conditions of Simulation.run bound to simulation
+
+    Arguments
+    stop : None, a condition or a list of conditions
+
+    Returns
+    list of callables taking a Progress
+    '''
+
+    if stop is None:
+        return []
+    if callable(stop):
+        stop = [stop]
+    return [
+        c.bind(simulation) if isinstance(c, StopCondition) else c for c in stop
+    ]
@@ -0,0 +1,318 @@
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+from . utils import iter_chunks
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # zstd codec not available
+
+###############################################################################
+# Compact record files
+#
+#   magic | chunk 0 | chunk 1 | ... | index | header | footer
+#
+# Time stamps are stored as integer ticks of a fixed resolution. Every chunk
+# holds the tick differences in the smallest integer type that fits, then
+# the other fields column by column, each with its bytes grouped by
+# significance (shuffled), compressed with the codec. The index
+# has one entry per chunk with its position and tick range, the header
+# describes the records (JSON), the footer locates index and header.
+###############################################################################
+
+MAGIC = b'PYSIMFS\x01'
+FOOTER = struct.Struct('<QQQ8s')
+
+index_t = np.dtype([
+    ('offset', '<u8'), ('size', '<u8'), ('n', '<u8'),
+    ('first', '<i8'), ('min', '<i8'), ('max', '<i8'), ('width', 'i1')
+])
+
+###############################################################################
+def codecs(level=None):
+    '''Available codecs: name -> (compress, decompress)'''
+    available = {
+        'none': (lambda b: b, lambda b: b),
+        'zlib': (
+            lambda b: zlib.compress(b, 6 if level is None else level),
+            zlib.decompress
+        ),
+        'lzma': (
+            lambda b: lzma.compress(b, preset=6 if level is None else level),
+            lzma.decompress
+        ),
+    }
+    if zstandard is not None:
+        available['zstd'] = (
+            zstandard.ZstdCompressor(level=3 if level is None else level).compress,
+            zstandard.ZstdDecompressor().decompress
+        )
+    return available
+
+###############################################################################
+def delta_width(deltas) -> int:
+    '''Bytes per tick difference (negative for signed 8 byte differences)'''
+    if len(deltas) == 0:
+        return 1
+    if deltas.min() < 0:
+        return -8
+    top = int(deltas.max())
+    for width in (1, 2, 4):
+        if top < 1 << 8*width:
+            return width
+    return 8
+
+def width_dtype(width):
+    return np.dtype('<i8') if width < 0 else np.dtype(f'<u{width}')
+
+###############################################################################
+def shuffle(values) -> bytes:
+    '''Bytes of values grouped by significance, which compresses better'''
+    values = np.ascontiguousarray(values)
+    return values.view('u1').reshape(-1, values.dtype.itemsize).T.tobytes()
+
+def unshuffle(buf, dtype, n, offset=0):
+    '''Inverse of shuffle for n values of dtype at offset of buf'''
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(buf, 'u1', n*dtype.itemsize, offset)
+    return np.ascontiguousarray(planes.reshape(dtype.itemsize, n).T).view(dtype).reshape(n)
+
+###############################################################################
+def dtype_to_json(dtype):
+    dtype = np.dtype(dtype)
+    return dtype.str if dtype.names is None else [list(d) for d in dtype.descr]
+
+def dtype_from_json(desc):
+    return np.dtype(desc if isinstance(desc, str) else [tuple(d) for d in desc])
+
+###############################################################################
+class TickWriter:
+
+    '''Writes records with time stamps to a compact record file.
+
+    Arguments
+    filename : file to write
+    dtype : record type, timetag_t or a dtype with a field t
+    resolution : time per tick, time stamps are rounded to it
+    chunk_size : records per compressed chunk (the unit of random access)
+    codec : 'zlib', 'lzma', 'zstd' (if zstandard is installed) or 'none'
+    level : compression level of the codec (codec default if None)
+
+    Example
+    with TickWriter('photons.tick', timetag_t, resolution=1e-12) as w:
+        for chunk in chunks:
+            w.write(chunk)
+    '''
+
+    def __init__(self, filename, dtype, resolution=1e-12, chunk_size=1<<20,
+            codec='zlib', level=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        if self.dtype.names is not None and 't' not in self.dtype.names:
+            raise ValueError(f'Records of {self.dtype} have no time stamp t.')
+        self.resolution = resolution
+        self.chunk_size = chunk_size
+        self.codec = codec
+        self.level = level
+        self.compress = codecs(level)[codec][0]
+        self.records = 0
+        self._index = []
+        self._pending = []
+        self._npending = 0
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    ###########################################################################
+    def write(self, records):
+        '''Append records (array of dtype), buffered to full chunks'''
+        records = np.asarray(records, self.dtype)
+        self._pending.append(records)
+        self._npending += len(records)
+        if self._npending >= self.chunk_size:
+            pending = np.concatenate(self._pending)
+            full = len(pending) - len(pending) % self.chunk_size
+            for start in range(0, full, self.chunk_size):
+                self._write_chunk(pending[start:start+self.chunk_size])
+            self._pending = [pending[full:]]
+            self._npending = len(pending) - full
+
+    ###########################################################################
+    def _write_chunk(self, records):
+        t = records if self.dtype.names is None else records['t']
+        ticks = np.rint(t / self.resolution).astype('<i8')
+        deltas = np.diff(ticks)
+        width = delta_width(deltas)
+        columns = [shuffle(deltas.astype(width_dtype(width)))]
+        for field in self.dtype.names or ():
+            if field != 't':
+                columns.append(shuffle(records[field]))
+        payload = self.compress(b''.join(columns))
+
+        self._index.append((
+            self._file.tell(), len(payload), len(records),
+            ticks[0], ticks.min(), ticks.max(), width
+        ))
+        self._file.write(payload)
+        self.records += len(records)
+
+    ###########################################################################
+    def close(self):
+        if self._file is None:
+            return
+        if self._npending:
+            self._write_chunk(np.concatenate(self._pending))
+        self._pending, self._npending = [], 0
+
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._index, index_t).tobytes())
+        header = json.dumps(dict(
+            dtype=dtype_to_json(self.dtype), resolution=self.resolution,
+            codec=self.codec, records=self.records
+        )).encode()
+        self._file.write(header)
+        self._file.write(FOOTER.pack(index_offset, len(self._index), len(header), MAGIC))
+        self._file.close()
+        self._file = None
+
+###############################################################################
+class TickReader:
+
+    '''Reads a compact record file written by TickWriter.
+
+    Time stamps are decoded to float seconds (ticks times resolution).
+    Chunks are located through the index, so reading a time range only
+    decompresses the chunks that overlap it.
+
+    Example
+    r = TickReader('photons.tick')
+    len(r), r.resolution
+    r.read(1.0, 2.0)       # records with 1.0 <= t < 2.0
+    for chunk in r.iter_chunks(): ...
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a compact record file.')
+            f.seek(-FOOTER.size, 2)
+            offset, chunks, header_size, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{filename} is incomplete.')
+            f.seek(offset)
+            self.index = np.frombuffer(f.read(chunks*index_t.itemsize), index_t)
+            header = json.loads(f.read(header_size))
+        self.dtype = dtype_from_json(header['dtype'])
+        self.resolution = header['resolution']
+        self.codec = header['codec']
+        self.records = header['records']
+        self.decompress = codecs()[self.codec][1]
+
+    def __len__(self):
+        return self.records
+
+    def __repr__(self):
+        return f'TickReader({self.filename}, {self.records} records, {self.dtype})'
+
+    ###########################################################################
+    def _decode(self, i):
+        '''Ticks and the remaining payload (other fields) of chunk i'''
+        entry = self.index[i]
+        n = int(entry['n'])
+        with open(self.filename, 'rb') as f:
+            f.seek(int(entry['offset']))
+            payload = self.decompress(f.read(int(entry['size'])))
+        width = width_dtype(entry['width'])
+        ticks = np.empty(n, '<i8')
+        ticks[0] = entry['first']
+        np.cumsum(unshuffle(payload, width, n-1), dtype='<i8', out=ticks[1:])
+        ticks[1:] += entry['first']
+        return ticks, memoryview(payload)[(n-1)*width.itemsize:]
+
+    ###########################################################################
+    def ticks(self, i):
+        '''Integer time stamps of chunk i'''
+        return self._decode(i)[0]
+
+    ###########################################################################
+    def chunk(self, i):
+        '''Records of chunk i'''
+        ticks, payload = self._decode(i)
+        if self.dtype.names is None:
+            return (ticks * self.resolution).astype(self.dtype)
+        records = np.empty(len(ticks), self.dtype)
+        records['t'] = ticks * self.resolution
+        offset = 0
+        for field in self.dtype.names:
+            if field == 't':
+                continue
+            ftype = self.dtype.fields[field][0]
+            records[field] = unshuffle(payload, ftype, len(ticks), offset)
+            offset += len(ticks)*ftype.itemsize
+        return records
+
+    ###########################################################################
+    def iter_chunks(self, start=None, stop=None):
+        ''' Records block by block, optionally only those with start <= t < stop
+
+        Arguments
+        start, stop : time range in seconds (None for open ends)
+
+        Returns
+        generator of arrays of dtype
+        '''
+
+        for i, entry in enumerate(self.index):
+            if start is not None and entry['max']*self.resolution < start:
+                continue
+            if stop is not None and entry['min']*self.resolution >= stop:
+                continue
+            chunk = self.chunk(i)
+            if start is not None or stop is not None:
+                t = chunk if self.dtype.names is None else chunk['t']
+                keep = np.ones(len(chunk), bool)
+                if start is not None:
+                    keep &= t >= start
+                if stop is not None:
+                    keep &= t < stop
+                chunk = chunk[keep]
+            yield chunk
+
+    ###########################################################################
+    def read(self, start=None, stop=None):
+        '''All records with start <= t < stop as one array'''
+        return np.concatenate([np.empty(0, self.dtype), *self.iter_chunks(start, stop)])
+
+###############################################################################
+def compact_file(source, filename, dtype, **options):
+    ''' Convert a raw record file (e.g. a simulation output) to a compact one
+
+    Arguments
+    source : raw file of records of dtype
+    filename : compact file to write
+    options : see TickWriter
+
+    Returns
+    number of records written
+    '''
+
+    with TickWriter(filename, dtype, **options) as w:
+        for chunk in iter_chunks(source, dtype, options.get('chunk_size', 1<<20)):
+            w.write(chunk)
+    return w.records
+
+###############################################################################
+def read_compact(filename, start=None, stop=None):
+    '''Records of a compact record file, optionally a time range of them'''
+    return TickReader(filename).read(start, stop)
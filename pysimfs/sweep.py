@@ -0,0 +1,188 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
+import os
+import threading
+import time
+
+from . pysimfs import Simulation
+
+SweepResult = namedtuple(
+    'SweepResult',
+    ['index', 'point', 'simulation', 'logs', 'error', 'attempts', 'elapsed']
+)
+
+###############################################################################
+def grid(**axes) -> list:
+    ''' Cartesian product of parameter axes
+
+    Arguments
+    axes : parameter name -> iterable of values
+
+    Returns
+    list of dicts, one per grid point, e.g.
+    grid(a=[1, 2], b=[3]) -> [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    '''
+
+    names = list(axes.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*axes.values())
+    ]
+
+###############################################################################
+def reseed(components, sequence):
+    ''' Give every component that takes a seed a new one
+
+    Arguments
+    components : list of components (not yet added to a simulation)
+    sequence : np.random.SeedSequence the seeds are drawn from
+    '''
+
+    seeds = sequence.generate_state(len(components))
+    for comp, seed in zip(components, seeds):
+        if 'seed' in comp._params:
+            comp.params['seed'] = int(seed)
+    return components
+
+###############################################################################
+class ProcessBudget:
+
+    '''Counting semaphore for simfs processes shared by concurrent runs.
+
+    A simulation acquires one unit per component process. Requests larger
+    than the total budget are clamped, so oversized graphs run alone instead
+    of blocking forever.
+    '''
+
+    def __init__(self, total: int):
+        self.total = max(1, total)
+        self.used = 0
+        self._cond = threading.Condition()
+
+    ###########################################################################
+    def acquire(self, n: int) -> int:
+        n = min(max(1, n), self.total)
+        with self._cond:
+            self._cond.wait_for(lambda: self.used + n <= self.total)
+            self.used += n
+        return n
+
+    ###########################################################################
+    def release(self, n: int):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+###############################################################################
+class Sweep:
+
+    '''Run many simulations concurrently under a global process budget.
+
+    Each run is described by a graph factory: a callable that returns the
+    components of one simulation. Runs are either given as a list of
+    factories, or as a single factory and a list of parameter points (see
+    grid), in which case the factory is called as factory(**point).
+
+    Every simulation counts its number of component processes against
+    budget (default: number of CPUs). Failed or timed out runs are retried
+    up to retries times with a freshly built graph. Outputs are written to
+    the files named by the graphs' unmatched outputs, so factories of
+    parameter sweeps should derive output names from their point. stop
+    conditions (see pysimfs.stop) end every run early once met.
+
+    Example
+    def graph(D, epsilon):
+        ...
+        return [Diffusion(...), Excitation(...), Fluorophore(...)]
+
+    for r in Sweep(graph, grid(D=[1e-11, 1e-10], epsilon=[1e4, 1e5])):
+        print(r.point, r.error, r.simulation.get_results())
+    '''
+
+    def __init__(self, factories, points=None, budget=None, timeout=None,
+            retries=0, tmpdir='./pysimfs_tmp', stop=None):
+
+        if points is None:
+            self.runs = [(f, {}) for f in factories]
+        else:
+            self.runs = [(factories, p) for p in points]
+
+        self.budget = ProcessBudget(budget or os.cpu_count() or 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.tmpdir = tmpdir
+        self.stop = stop
+
+    ###########################################################################
+    def __len__(self):
+        return len(self.runs)
+
+    ###########################################################################
+    def __iter__(self):
+        return self.run()
+
+    ###########################################################################
+    def run(self):
+        '''Generator of SweepResults in order of completion'''
+
+        os.makedirs(self.tmpdir, exist_ok=True)
+        with ThreadPoolExecutor(self.budget.total) as ex:
+            futures = [
+                ex.submit(self.run_one, i, factory, point)
+                for i, (factory, point) in enumerate(self.runs)
+            ]
+            for f in as_completed(futures):
+                yield f.result()
+        try:
+            os.rmdir(self.tmpdir)
+        except OSError:
+            pass
+
+    ###########################################################################
+    def run_all(self) -> list:
+        '''Run the sweep and return all SweepResults in order of submission'''
+        return sorted(self.run(), key=lambda r: r.index)
+
+    ###########################################################################
+    def build(self, sim, factory, point):
+        '''Add the components of one run to sim'''
+        for comp in factory(**point):
+            sim.add(comp)
+
+    ###########################################################################
+    def run_one(self, index, factory, point) -> SweepResult:
+
+        start = time.time()
+        error = None
+        for attempt in range(1, self.retries+2):
+            rundir = os.path.join(self.tmpdir, f'run_{index}_{attempt}')
+            os.makedirs(rundir, exist_ok=True)
+            sim = Simulation(
+                    tmpdir=os.path.join(rundir, 'tmp'),
+                    datadir=os.path.join(rundir, 'data')
+            )
+            n = 0
+            try:
+                with sim:
+                    self.build(sim, factory, point)
+                    n = self.budget.acquire(len(sim.processes))
+                    logs = sim.run(timeout=self.timeout, stop=self.stop)
+                return SweepResult(
+                    index, point, sim, logs, None, attempt, time.time()-start
+                )
+            except Exception as e:
+                error = e
+                print(f'Run {index} {point} failed (attempt {attempt}).', repr(e))
+            finally:
+                if n:
+                    self.budget.release(n)
+                for d in (os.path.join(rundir, 'data'), rundir):
+                    try:
+                        os.rmdir(d)
+                    except OSError:
+                        pass
+
+        return SweepResult(
+            index, point, sim, None, error, attempt, time.time()-start
+        )
@@ -0,0 +1,172 @@
+import os
+import struct
+
+import numpy as np
+
+###############################################################################
+# PicoQuant TimeHarp T3R files (format version 6.0)
+#
+#   text header | binary header | board header | TTTR header | records
+#
+# Every record is a little endian 32 bit word:
+#
+#   bits  0-15 time tag (sync periods, wraps at 65536)
+#   bits 16-27 channel (TCSPC bin, position within the sync period)
+#   bits 28-29 route (detector)
+#   bit     30 valid (photon), otherwise a marker
+#
+# Invalid records with bit 11 of the channel set are overflows, each adds
+# 65536 to the time tags of all later records. simfs_t3r writes the number
+# of records right after the sync rate and starts the records at byte 644,
+# it stores the position of a photon within its sync period in 4095ths as
+# channel.
+###############################################################################
+
+TEXT_HEADER = struct.Struct('<16s6s18s12s18s2s256s')
+BOARD_HEADER = struct.Struct('<16s8s5if')
+TTTR_HEADER = struct.Struct('<7i6i')
+BINARY_HEADER_SIZE = 212
+
+WRAP = 1 << 16
+SIMFS_CHANNELS = 4095
+SIMFS_DATA_OFFSET = 644
+
+t3r_t = np.dtype([('timetag', '<u8'), ('channel', '<u2'), ('route', 'u1')])
+
+###############################################################################
+def decode(words, overflows=0):
+    ''' Decode T3R records
+
+    Arguments
+    words : array of uint32 records
+    overflows : number of overflows before the first record
+
+    Returns
+    (array of t3r_t of the photons with the overflows added to their time
+    tags, number of overflows up to the last record)
+    '''
+
+    words = np.asarray(words, '<u4')
+    valid = (words >> 30) & 1 == 1
+    overflow = ~valid & ((words >> 27) & 1 == 1)
+    wraps = np.cumsum(overflow, dtype='<u8')
+    wraps += overflows
+
+    photons = np.empty(np.count_nonzero(valid), t3r_t)
+    kept = words[valid]
+    photons['timetag'] = kept & 0xffff
+    photons['timetag'] += wraps[valid] * WRAP
+    photons['channel'] = (kept >> 16) & 0xfff
+    photons['route'] = (kept >> 28) & 3
+    return photons, int(wraps[-1]) if len(wraps) else overflows
+
+###############################################################################
+class T3RFile:
+
+    '''Memory mapped T3R file, e.g. written by T3RWriter.
+
+    The records are decoded without Python loops, block by block for large
+    files (iter_chunks) or at once (read).
+
+    Example
+    f = T3RFile('photons.t3r')
+    photons = f.read()        # timetag, channel, route of every photon
+    t = f.seconds(photons)    # arrival times
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(SIMFS_DATA_OFFSET)
+        if len(header) < 640:
+            raise ValueError(f'{filename} is not a T3R file.')
+
+        text = [
+            field.split(b'\0', 1)[0].decode('ascii', 'replace')
+            for field in TEXT_HEADER.unpack_from(header)
+        ]
+        self.ident, self.format_version, self.creator = text[0], text[1], text[2]
+        self.comment = text[6]
+        offset = TEXT_HEADER.size
+        self.number_of_channels, _, _, self.routing_channels = \
+            struct.unpack_from('<4i', header, offset)
+        offset += BINARY_HEADER_SIZE
+        board = BOARD_HEADER.unpack_from(header, offset)
+        self.resolution = board[-1]
+        offset += BOARD_HEADER.size
+        tttr = TTTR_HEADER.unpack_from(header, offset)
+        self.globclock = tttr[0]
+        self.sync_rate = tttr[7]
+
+        size = os.path.getsize(filename)
+        if self.ident.startswith('SiMFS'):
+            self.data_offset = SIMFS_DATA_OFFSET
+            self.number_of_records = tttr[8]
+            self.channels = SIMFS_CHANNELS
+        else:
+            spec_header_length = tttr[12]
+            self.data_offset = offset + TTTR_HEADER.size + 4*spec_header_length
+            self.number_of_records = tttr[11]
+            self.channels = self.number_of_channels
+        # records of an incomplete file
+        self.number_of_records = min(
+            self.number_of_records, max(0, size - self.data_offset) // 4
+        )
+
+    def __len__(self):
+        return self.number_of_records
+
+    def __repr__(self):
+        return f'T3RFile({self.filename}, {self.number_of_records} records, {self.sync_rate} Hz)'
+
+    ###########################################################################
+    @property
+    def records(self):
+        '''Raw records (read-only memory map)'''
+        if self.number_of_records == 0:
+            return np.empty(0, '<u4')
+        return np.memmap(
+            self.filename, '<u4', 'r', self.data_offset, (self.number_of_records,)
+        )
+
+    ###########################################################################
+    def iter_chunks(self, chunk_size=1<<22):
+        '''Photons (t3r_t) block by block, chunk_size records at a time'''
+        records = self.records
+        overflows = 0
+        for start in range(0, len(records), chunk_size):
+            photons, overflows = decode(records[start:start+chunk_size], overflows)
+            yield photons
+
+    ###########################################################################
+    def read(self):
+        '''All photons as one array of t3r_t'''
+        return decode(self.records)[0]
+
+    ###########################################################################
+    def seconds(self, photons):
+        ''' Arrival times of photons
+
+        Arguments
+        photons : array of t3r_t (see read)
+
+        Returns
+        float array, sync periods plus the channel as fraction of a period
+        divided by the sync rate
+        '''
+
+        periods = photons['timetag'] + photons['channel'] / self.channels
+        return periods / self.sync_rate
+
+###############################################################################
+def read_t3r(filename):
+    ''' Photons of a T3R file
+
+    Returns
+    (timetag, channel, route, sync_rate), timetag are overflow corrected
+    sync periods
+    '''
+
+    f = T3RFile(filename)
+    photons = f.read()
+    return photons['timetag'], photons['channel'], photons['route'], f.sync_rate
@@ -18,11 +18,105 @@ def new_filename(name: str) -> str:
     uid = '_'.join((name, str(uuid.uuid1())[:8]))
     return os.path.abspath(uid)
 
+########################################################################### 
+def map_file(filename: str, dtype) -> np.ndarray:
+    ''' Read-only memory map of a binary record file
+
+    Arguments
+    filename : path to the file
+    dtype : record type, e.g. coordinate_t
+
+    Returns
+    np.memmap of all complete records in the file (an empty array for empty
+    files, which cannot be mapped)
+    '''
+
+    dtype = np.dtype(dtype)
+    n = os.path.getsize(filename) // dtype.itemsize
+    if n == 0:
+        return np.empty(0, dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(n,))
+
+########################################################################### 
+def iter_chunks(filename: str, dtype, chunk_size: int=1<<20):
+    ''' Read a binary record file block by block
+
+    Arguments
+    filename : path to the file (or named pipe)
+    dtype : record type, e.g. coordinate_t
+    chunk_size : maximum number of records per block
+
+    Returns
+    generator of arrays with up to chunk_size records each
+    '''
+
+    with open(filename, 'rb') as f:
+        yield from read_chunks(f, dtype, chunk_size)
+
+########################################################################### 
+def read_chunks(f, dtype, chunk_size: int=1<<20):
+    '''Like iter_chunks, for a file object opened in binary mode'''
+    dtype = np.dtype(dtype)
+    while True:
+        buf = bytearray(chunk_size*dtype.itemsize)
+        n = f.readinto(buf) // dtype.itemsize
+        if n == 0:
+            return
+        yield np.frombuffer(buf, dtype, count=n)
+
+########################################################################### 
+def relay(src: str, dst: str, block: int=1<<16) -> int:
+    ''' Copy a named pipe into another one until the writer closes it
+
+    Uses splice where available, so the data is not copied to user space.
+    A reader that goes away ends the relay early.
+
+    Arguments
+    src : pipe to read from
+    dst : pipe to write to
+    block : maximum number of bytes per transfer
+
+    Returns
+    number of bytes transferred
+    '''
+
+    n = 0
+    r = os.open(src, os.O_RDONLY)
+    try:
+        w = os.open(dst, os.O_WRONLY)
+        try:
+            while True:
+                if hasattr(os, 'splice'):
+                    k = os.splice(r, w, block)
+                else:
+                    data = memoryview(os.read(r, block))
+                    k = len(data)
+                    while data:
+                        data = data[os.write(w, data):]
+                if k == 0:
+                    return n
+                n += k
+        except BrokenPipeError:
+            return n
+        finally:
+            os.close(w)
+    finally:
+        os.close(r)
+
 
 
 class GridData():
 
+    '''Regular 3D grid of values stored as a binary file.
+
+    The file starts with three linspaces (min, max, n) for x, y and z,
+    followed by the values in C order (x slowest). Grid points are placed at
+    min + i*delta with delta = (max-min)/(n-1). The header is parsed once,
+    the values are memory-mapped, so large grids are not read into memory.
+    '''
+
     HEADER_SIZE = 9*8
+    LINSPACE_OFFSET = 0
     LinSpace_t = np.dtype([('min', 'f8'),('max', 'f8'),('n', 'i8')])
     Delta = namedtuple('Delta', ['x', 'y', 'z'])
     LinSpace = namedtuple('LinSpace', ['min', 'max', 'n'])
@@ -32,20 +126,35 @@ class GridData():
         self.filename = filename
         self.dtype = dtype
         self._load()
-        self.data = self._raw[GridData.HEADER_SIZE:].view(self.dtype)
-        self.data = self.data.reshape(*(d.n for d in self.shape))
 
     def _load(self):
-        self._raw = np.fromfile(self.filename, dtype='b')
+        linspaces = np.fromfile(
+                self.filename, GridData.LinSpace_t, count=3,
+                offset=self.LINSPACE_OFFSET
+        )
+        self._shape = GridData.GridSpace(
+                *(GridData.LinSpace(float(d[0]), float(d[1]), int(d[2])) for d in linspaces)
+        )
+        self._delta = GridData.Delta(
+                *((d.max-d.min)/(d.n-1) if d.n > 1 else 0.0 for d in self._shape)
+        )
+        self.data = np.memmap(
+                self.filename, dtype=self.dtype, mode='r',
+                offset=self.HEADER_SIZE, shape=tuple(d.n for d in self._shape)
+        )
 
     @property
     def shape(self):
-        linspaces = self._raw[:GridData.HEADER_SIZE].view(GridData.LinSpace_t)
-        return GridData.GridSpace(*(GridData.LinSpace(*d) for d in linspaces))
+        return self._shape
 
     @property
     def delta(self):
-        return GridData.Delta(*( (d.max-d.min)/(d.n-1) for d in self.shape))
+        return self._delta
+
+    @property
+    def axes(self):
+        '''Grid point positions along x, y and z'''
+        return GridData.GridSpace(*(np.linspace(*d) for d in self.shape))
     
     def _ix(self, x):
        return self._index_of(x, self.shape.x)
@@ -58,28 +167,97 @@ class GridData():
  
     @staticmethod
     def _index_of(d: float, space: LinSpace) -> int:
-        index = int((d-space.min)/((space.max-space.min)/space.n))
+        if space.n < 2:
+            return 0
+        index = int(round((d-space.min)/((space.max-space.min)/(space.n-1))))
         if index >= space.n:
             return space.n-1
         if index < 0:
             return 0
         return index
 
+    ###########################################################################
+    def _positions(self, coords):
+        '''Fractional grid indices of coordinates, clipped to the grid'''
+        if getattr(coords, 'dtype', None) is not None and coords.dtype.names:
+            xyz = (coords['x'], coords['y'], coords['z'])
+        else:
+            coords = np.asarray(coords, dtype='f8')
+            xyz = (coords[..., 0], coords[..., 1], coords[..., 2])
+        return [
+            np.clip((np.asarray(v, dtype='f8')-d.min)/dd, 0, d.n-1) if d.n > 1
+            else np.zeros(np.shape(v))
+            for v, d, dd in zip(xyz, self.shape, self.delta)
+        ]
+
+    ###########################################################################
+    def nearest(self, coords, chunk_size=1<<20) -> np.ndarray:
+        ''' Values at the grid points nearest to the coordinates
+
+        Arguments
+        coords : coordinate_t array or array of shape (N, 3)
+        chunk_size : number of coordinates processed at once
+
+        Returns
+        array of values, one per coordinate
+        '''
+
+        return self._lookup(coords, chunk_size, self._nearest)
+
+    ###########################################################################
+    def interpolate(self, coords, chunk_size=1<<20) -> np.ndarray:
+        ''' Trilinear interpolation of the grid values at the coordinates.
+        Coordinates outside of the grid are clamped to its border.
+
+        Arguments
+        coords : coordinate_t array or array of shape (N, 3)
+        chunk_size : number of coordinates processed at once
+
+        Returns
+        array of values, one per coordinate
+        '''
+
+        return self._lookup(coords, chunk_size, self._trilinear)
+
+    ###########################################################################
+    def _lookup(self, coords, chunk_size, method):
+        n = len(coords)
+        out = np.empty(n, dtype=self.dtype)
+        for i in range(0, n, chunk_size):
+            out[i:i+chunk_size] = method(*self._positions(coords[i:i+chunk_size]))
+        return out
+
+    def _nearest(self, fx, fy, fz):
+        return self.data[
+                np.rint(fx).astype('i8'), np.rint(fy).astype('i8'), np.rint(fz).astype('i8')
+        ]
+
+    def _trilinear(self, fx, fy, fz):
+        lo, w = [], []
+        for f, d in zip((fx, fy, fz), self.shape):
+            i = np.minimum(f.astype('i8'), max(d.n-2, 0))
+            lo.append(i)
+            w.append(f-i)
+        (ix, iy, iz), (wx, wy, wz) = lo, w
+        jx, jy, jz = (np.minimum(i+1, d.n-1) for i, d in zip(lo, self.shape))
+        d = self.data
+        return (
+            (d[ix, iy, iz]*(1-wz) + d[ix, iy, jz]*wz)*(1-wy)*(1-wx) +
+            (d[ix, jy, iz]*(1-wz) + d[ix, jy, jz]*wz)*wy*(1-wx) +
+            (d[jx, iy, iz]*(1-wz) + d[jx, iy, jz]*wz)*(1-wy)*wx +
+            (d[jx, jy, iz]*(1-wz) + d[jx, jy, jz]*wz)*wy*wx
+        )
+
 
 class PrecalculatedGridData(GridData):
 
+    '''Grid file written by Precalculate (fcs/simfs_pre): a GridData file
+    preceded by two normalization values.'''
+
     NORM_SIZE = 2*8
     HEADER_SIZE = 11*8
-
-    def __init__(self, filename, dtype='f8'):
-        self.filename = filename
-        self.dtype = dtype
-        self._load()
-        self.data = self._raw[PrecalculatedGridData.HEADER_SIZE:].view(self.dtype)
-        self.data = self.data.reshape(*(d.n for d in self.shape))
+    LINSPACE_OFFSET = NORM_SIZE
 
     @property
-    def shape(self):
-        linspaces = self._raw[PrecalculatedGridData.NORM_SIZE:PrecalculatedGridData.NORM_SIZE+GridData.HEADER_SIZE].view(GridData.LinSpace_t)
-        return GridData.GridSpace(*(GridData.LinSpace(*d) for d in linspaces))
-
+    def norm(self):
+        return np.fromfile(self.filename, 'f8', count=2)
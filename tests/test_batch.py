@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+
+'''Tests for batches of graphs with shared stages.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Batch, Diffusion, Excitation, Fluorophore, Simulation, grid
+from pysimfs.check import GraphError
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def graph(tmp_path):
+    '''Factory of diffusion -> excitation -> fluorophore graphs, the
+    fluorophore varies with epsilon'''
+    def factory(epsilon, seed=1, name='photons', output=None):
+        return [
+            Diffusion(
+                experiment_time=0.02, increment=1e-6, seed=seed,
+                coordinate_output='coords', collision_output=os.devnull
+            ),
+            Excitation(input='coords', output='flux'),
+            Fluorophore(seed=2, jablonsky={
+                'exi': {
+                    'from': 'S0', 'to': 'S1',
+                    'rate': {'input': 'flux', 'epsilon': epsilon}
+                },
+                'emi': {
+                    'from': 'S1', 'to': 'S0', 'rate': 1e8,
+                    'output': output or str(tmp_path/f'{name}_{epsilon}_{seed}')
+                },
+            }),
+        ]
+    return factory
+
+@pytest.fixture
+def dirs(tmp_path):
+    return dict(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'))
+
+#-----------------------------------------------------------------------------#
+
+def test_shared_stages(graph, dirs, tmp_path):
+    '''Identical upstream stages run once and give the results of separate
+    simulations'''
+    points = grid(epsilon=[1e7, 1e8, 1e9])
+    batch = Batch(graph, points, **dirs)
+    assert len(batch) == 3 and len(batch.stages) == 5
+    assert len(batch.shared) == 2
+    logs = batch.run()
+    assert [len(l) for l in logs] == [3, 3, 3]
+    assert logs[0][0] is logs[2][0]
+    # one buffer per shared pipe read by several graphs
+    assert len(batch.simulation.report.processes) == 5 + 1
+
+    results = batch.get_results()
+    assert len(results) == 3
+    for p in points:
+        name = str(tmp_path/f'photons_{p["epsilon"]}_1')
+        with Simulation(**dirs) as S:
+            for c in graph(name='single', **p):
+                S.add(c)
+            S.run()
+            single, = S.get_results().values()
+        assert len(single) > 0
+        assert np.array_equal(results[name], single)
+
+def test_seeds_differ(graph, dirs):
+    '''Stages with other seeds or downstream of them are not shared'''
+    batch = Batch(
+        [lambda s=s: graph(1e8, seed=s) for s in (1, 1, 2)], **dirs
+    )
+    assert len(batch.stages) == 6 and len(batch.shared) == 3
+    assert batch.keys[0] == batch.keys[1] != batch.keys[2]
+
+def test_conflicting_outputs(graph, dirs, tmp_path):
+    '''Different stages writing the same file are rejected'''
+    points = grid(epsilon=[1e7, 1e8], output=[str(tmp_path/'photons')])
+    with pytest.raises(GraphError):
+        Batch(graph, points, **dirs)
@@ -0,0 +1,302 @@
+#! /usr/bin/env python
+
+'''Tests for the pysimfs parameter and grid caches.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+import subprocess
+import sys
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+import pysimfs
+from pysimfs import cache, Diffusion, Excitation, Fluorophore, Precalculate, Simulation
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def param_cache(tmp_path):
+    '''Replaces the global parameter cache by one in a temporary directory'''
+    old = cache.param_cache
+    yield cache.configure(maxsize=16, cachedir=str(tmp_path))
+    cache.param_cache = old
+
+def count_calls(monkeypatch):
+    '''Utility: counts calls of simfs binaries'''
+    calls = []
+    call_simfs = Simulation.call_simfs
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return call_simfs(*args, **kwargs)
+    monkeypatch.setattr(Simulation, 'call_simfs', staticmethod(counting))
+    return calls
+
+#-----------------------------------------------------------------------------#
+
+def test_hit_skips_binary(param_cache, monkeypatch):
+    '''Identical configurations only call the binary once'''
+    calls = count_calls(monkeypatch)
+    d1 = Diffusion(experiment_time=0.1)
+    d2 = Diffusion(experiment_time=0.1)
+    assert len(calls) == 1
+    assert param_cache.hits == 1
+    assert d1._params['experiment_time'] == d2._params['experiment_time']
+
+def test_key_depends_on_params(param_cache, monkeypatch):
+    '''Different input params are separate cache entries'''
+    calls = count_calls(monkeypatch)
+    Diffusion(experiment_time=0.1)
+    Diffusion(experiment_time=0.2)
+    assert len(calls) == 2
+
+def test_hits_are_independent_copies(param_cache):
+    '''Mutating the params of one component does not affect later hits'''
+    d1 = Diffusion(experiment_time=0.1)
+    d1._params['coordinate_output'] = 'changed'
+    d2 = Diffusion(experiment_time=0.1)
+    assert d2._params['coordinate_output'] == '__coordinates__'
+
+def test_implicit_seed_redrawn(param_cache):
+    '''Seeds chosen by the binary are redrawn on every hit'''
+    seeds = {Diffusion(experiment_time=0.1)._params['seed'] for _ in range(8)}
+    assert len(seeds) > 1
+
+def test_explicit_seed_kept(param_cache):
+    '''Seeds given by the user are retained'''
+    for _ in range(2):
+        assert Diffusion(seed=42)._params['seed'] == 42
+
+def test_persistent(param_cache, tmp_path, monkeypatch):
+    '''A new cache instance on the same directory reuses the entries'''
+    Diffusion(experiment_time=0.1)
+    cache.configure(maxsize=16, cachedir=str(tmp_path))
+    calls = count_calls(monkeypatch)
+    Diffusion(experiment_time=0.1)
+    assert len(calls) == 0
+
+def test_memory_lru_eviction(param_cache):
+    '''The in-memory cache holds at most maxsize entries'''
+    for i in range(20):
+        Diffusion(experiment_time=0.1*(i+1))
+    assert len(param_cache._memory) == 16
+
+def test_disk_eviction(tmp_path):
+    '''DiskStore drops the least recently used entries'''
+    store = cache.DiskStore(str(tmp_path), max_entries=2)
+    store.write('a', b'1')
+    store.write('b', b'2')
+    os.utime(store.filename('a'), ns=(0, 0))
+    store.write('c', b'3')
+    assert store.read('a') is None
+    assert store.read('b') == b'2'
+    assert store.read('c') == b'3'
+
+#-----------------------------------------------------------------------------#
+
+def test_default_caches_in_memory(tmp_path):
+    '''Without $PYSIMFS_CACHE_DIR, importing and using pysimfs creates no
+    cache directory, parameters are cached in memory only'''
+    root = os.path.dirname(os.path.dirname(pysimfs.__file__))
+    env = dict(
+        os.environ, HOME=str(tmp_path), XDG_CACHE_HOME=str(tmp_path),
+        PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')])
+    )
+    env.pop('PYSIMFS_CACHE_DIR', None)
+    code = (
+        'from pysimfs import cache, Diffusion\n'
+        'Diffusion(experiment_time=0.1); Diffusion(experiment_time=0.1)\n'
+        'assert cache.param_cache.hits == 1\n'
+        'assert cache.param_cache.store is None\n'
+        'assert cache.grid_cache is None and cache.result_cache is None\n'
+    )
+    subprocess.run(
+        [sys.executable, '-c', code], env=env, cwd=tmp_path, check=True
+    )
+    assert os.listdir(tmp_path) == []
+
+def test_lazy_validation(param_cache, monkeypatch):
+    '''Lazy components call the binary on first access of their params'''
+    calls = count_calls(monkeypatch)
+    f = Fluorophore(lazy=True)
+    assert len(calls) == 0
+    assert 'jablonsky' in f._params
+    assert len(calls) == 1
+
+def test_batch_validation(param_cache, monkeypatch):
+    '''Batches only call the binary once per distinct configuration'''
+    calls = count_calls(monkeypatch)
+    comps = [Diffusion(lazy=True, experiment_time=0.1*(i%3+1)) for i in range(12)]
+    pysimfs.validate_components(comps)
+    assert len(calls) == 3
+    assert all(c._validated for c in comps)
+    assert comps[4]._params['experiment_time'] == comps[1]._params['experiment_time']
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def grid_cache(tmp_path):
+    '''Replaces the global grid cache by one in a temporary directory'''
+    old = cache.grid_cache
+    yield cache.configure_grids(str(tmp_path/'cache'))
+    cache.grid_cache = old
+
+def precalculate(tmp_path, name, n=11, **params):
+    '''Utility: runs a Precalculate component in a simulation'''
+    grid = {k: dict(min=-1e-6, max=1e-6, n=n) for k in 'xyz'}
+    fn = str(tmp_path/name)
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Precalculate(filename=fn, grid=grid, **params))
+        S.run()
+    return fn
+
+#-----------------------------------------------------------------------------#
+
+def test_grid_reused(grid_cache, tmp_path, monkeypatch):
+    '''Identical grids are calculated once and copied afterwards'''
+    fn1 = precalculate(tmp_path, 'a.dat')
+    calls = count_calls(monkeypatch)
+    fn2 = precalculate(tmp_path, 'b.dat')
+    assert grid_cache.hits == 1
+    assert not [c for c in calls if c[0].endswith('simfs_pre') and 'list' not in c]
+    with open(fn1, 'rb') as f1, open(fn2, 'rb') as f2:
+        assert f1.read() == f2.read()
+    assert not os.path.samefile(fn1, fn2)
+
+def test_grid_key_ignores_filename_only(grid_cache, tmp_path):
+    '''Different optical parameters are separate grids'''
+    precalculate(tmp_path, 'a.dat')
+    precalculate(tmp_path, 'b.dat', shape=dict(waist_x=3e-7, waist_y=3e-7, waist_z=7e-7))
+    assert grid_cache.misses == 2
+
+def test_grid_eviction(grid_cache, tmp_path):
+    '''The grid store is bounded in size'''
+    grid_cache.store.max_bytes = 2*(11**3*8 + 88)
+    precalculate(tmp_path, 'a.dat', n=11)
+    precalculate(tmp_path, 'b.dat', n=11, type='XYGaussZExp')
+    precalculate(tmp_path, 'c.dat', n=11, type='gaussBeam')
+    assert len(grid_cache.store.entries()) == 2
+    # lock files go with their entries
+    locks = [f for f in os.listdir(grid_cache.store.path) if f.endswith('.lock')]
+    assert len(locks) == 2
+
+def test_grid_larger_than_store(grid_cache, tmp_path):
+    '''A grid larger than the whole store is still placed'''
+    grid_cache.store.max_bytes = 100
+    fn = precalculate(tmp_path, 'a.dat', n=11)
+    assert os.path.getsize(fn) == 11**3*8 + 88
+    precalculate(tmp_path, 'b.dat', n=11, type='XYGaussZExp')
+    assert len(grid_cache.store.entries()) == 1
+
+def test_excitation_reads_cached_grid(grid_cache, tmp_path):
+    '''Excitations in the same simulation can use the precalculated grid'''
+    grid = {k: dict(min=-1e-6, max=1e-6, n=21) for k in 'xyz'}
+    pre = Precalculate(filename=str(tmp_path/'focus.dat'), grid=grid)
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(pre)
+        S.add(Diffusion(
+            experiment_time=1e-3, coordinate_output='coords',
+            collision_output=os.devnull
+        ))
+        S.add(Excitation(input='coords', output=str(tmp_path/'flux'), **pre.grid_shape()))
+        logs = S.run()
+        flux = S.get_results()[str(tmp_path/'flux')]
+    assert len(logs) == 3
+    assert len(flux) == 10000
+    assert flux['v'].max() > 0
+
+#-----------------------------------------------------------------------------#
+@pytest.fixture
+def result_cache(tmp_path):
+    '''A result cache in a temporary directory'''
+    return cache.ResultCache(str(tmp_path/'cache'))
+
+def memoized_run(tmp_path, store, seed=1, tag=''):
+    '''Utility: runs a seeded diffusion -> excitation chain with memoization'''
+    with Simulation(tmpdir=str(tmp_path/f'tmp{tag}'), datadir=str(tmp_path/'data'),
+            memoize=store) as S:
+        S.add(Diffusion(
+            experiment_time=1e-3, seed=seed, coordinate_output='coords',
+            collision_output=os.devnull
+        ))
+        S.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+        logs = S.run()
+        flux = np.array(S.get_results()[str(tmp_path/'flux')])
+    return logs, flux
+
+#-----------------------------------------------------------------------------#
+
+def test_result_restored(result_cache, tmp_path, monkeypatch):
+    '''Identical seeded graphs are restored from the cache without running'''
+    logs1, flux1 = memoized_run(tmp_path, result_cache)
+    os.remove(tmp_path/'flux')
+    started = []
+    monkeypatch.setattr(Simulation, 'run_simfs_async', staticmethod(
+        lambda *args, **kwargs: started.append(args)
+    ))
+    logs2, flux2 = memoized_run(tmp_path, result_cache, tag='2')
+    assert not started
+    assert result_cache.hits == 1
+    assert np.array_equal(flux1, flux2)
+    assert logs1[0].params['seed'] == logs2[0].params['seed']
+
+def test_result_restores_file_outputs(result_cache, tmp_path, monkeypatch):
+    '''Files written by components besides their outputs are restored'''
+    records = np.zeros(1000, pysimfs.routed_t)
+    records['t'] = np.linspace(0, 1e-3, len(records))
+    records.tofile(tmp_path/'routed')
+    fn = tmp_path/'photons.t3r'
+    def run(tag):
+        with Simulation(tmpdir=str(tmp_path/f'tmp{tag}'),
+                datadir=str(tmp_path/'data'), memoize=result_cache) as S:
+            S.add(pysimfs.T3RWriter(
+                input=str(tmp_path/'routed'), output_file=str(fn),
+                SyncRate=10000000
+            ))
+            S.run()
+        return fn.read_bytes()
+    t3r = run('1')
+    os.remove(fn)
+    monkeypatch.setattr(Simulation, 'run_simfs_async', None)
+    assert run('2') == t3r
+    assert result_cache.hits == 1
+
+def test_result_key_depends_on_seed(result_cache, tmp_path):
+    '''Runs with other seeds are simulated again'''
+    memoized_run(tmp_path, result_cache, seed=1)
+    memoized_run(tmp_path, result_cache, seed=2)
+    assert result_cache.hits == 0
+    assert len(result_cache.store.entries()) == 2
+
+def test_result_key_depends_on_input_files(tmp_path):
+    '''Changing the content of an input file changes the graph key'''
+    coords = tmp_path/'coords'
+    coords.write_bytes(np.zeros(10, pysimfs.coordinate_t).tobytes())
+    def key():
+        with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+            S.add(Excitation(input=str(coords), output=str(tmp_path/'flux')))
+            return S.graph_key()
+    k1 = key()
+    assert key() == k1
+    coords.write_bytes(np.ones(10, pysimfs.coordinate_t).tobytes())
+    assert key() != k1
+
+def test_result_eviction_by_age(tmp_path):
+    '''Directory entries unused for max_age seconds are dropped'''
+    store = cache.DiskStore(str(tmp_path), max_age=3600)
+    for key in 'ab':
+        tmp = store.tempname(key)
+        os.mkdir(tmp)
+        (tmp_path/os.path.basename(tmp)/'0').write_bytes(b'1234')
+        store.commit(key, tmp)
+    assert [e[1] for e in store.entries()] == [4, 4]
+    os.utime(store.filename('a'), ns=(0, 0))
+    store.evict()
+    assert store.get('a') is None
+    assert store.get('b') is not None
+
+#-----------------------------------------------------------------------------#
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+
+'''Tests for the streaming multi-tau correlator.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Excitation, Fluorophore, Simulation
+from pysimfs.analysis import Correlator, CorrelationSink, correlate
+from pysimfs.analysis import correlation
+
+#-----------------------------------------------------------------------------#
+
+RES = 1e-7
+T = 0.02
+LEVELS = 10
+CHANNELS = 8
+
+def naive(a, b, res=RES, levels=LEVELS, channels=CHANNELS, duration=T):
+    '''Reference: dense binning and explicit products on every level'''
+    ticks = int(np.ceil(duration/res))
+    na = np.bincount((a/res).astype(int), minlength=ticks).astype(float)
+    nb = np.bincount((b/res).astype(int), minlength=ticks).astype(float)
+    G = []
+    for level in range(levels):
+        w = 2**level
+        Tl = -(-ticks//w)
+        xa = np.pad(na, (0, Tl*w-ticks)).reshape(Tl, w).sum(1)
+        xb = np.pad(nb, (0, Tl*w-ticks)).reshape(Tl, w).sum(1)
+        lags = range(1, channels) if level == 0 else range(channels//2, channels)
+        for j in lags:
+            C = np.dot(xa[:-j], xb[j:])
+            G.append(C/(Tl-j)*Tl**2/(na.sum()*nb.sum())-1)
+    return np.array(G)
+
+def bunched(seed, duration=T):
+    '''Utility: sorted photon times with bunching on microsecond scales'''
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, duration, 1000)
+    t = np.concatenate(
+        [centers+rng.exponential(2e-6, 1000)*k for k in range(4)]
+        + [rng.uniform(0, duration, 5000)]
+    )
+    return np.sort(t[t < duration])
+
+@pytest.fixture
+def photons():
+    return bunched(1)
+
+#-----------------------------------------------------------------------------#
+
+@pytest.mark.parametrize('chunk_size', [97, 1000, 1<<20])
+def test_auto_matches_reference(photons, chunk_size):
+    '''Streaming auto-correlation equals the dense reference'''
+    tau, G = correlate(
+        photons, resolution=RES, levels=LEVELS, channels=CHANNELS,
+        duration=T, chunk_size=chunk_size
+    )
+    assert len(tau) == len(G)
+    assert np.all(np.diff(tau) > 0)
+    assert np.allclose(G, naive(photons, photons))
+
+@pytest.mark.parametrize('dense_factor', [0, 1<<30])
+def test_sparse_and_dense_paths(photons, monkeypatch, dense_factor):
+    '''Sparse lookups and dense dot products give identical lag sums'''
+    monkeypatch.setattr(correlation, 'DENSE_FACTOR', dense_factor)
+    _, G = correlate(
+        photons, resolution=RES, levels=LEVELS, channels=CHANNELS,
+        duration=T, chunk_size=500
+    )
+    assert np.allclose(G, naive(photons, photons))
+
+def test_cross_matches_reference(photons):
+    '''Streaming cross-correlation equals the dense reference'''
+    other = bunched(2)
+    _, G = correlate(
+        photons, other, resolution=RES, levels=LEVELS, channels=CHANNELS,
+        duration=T, chunk_size=300
+    )
+    assert np.allclose(G, naive(photons, other))
+
+def test_bunching_detected(photons):
+    '''Bunched photons correlate at short lags, not at long ones'''
+    tau, G = correlate(photons, resolution=RES, levels=LEVELS, channels=CHANNELS)
+    assert G[tau < 1e-6].mean() > 0.1
+    assert abs(G[tau > 5e-5].mean()) < 0.05
+
+def test_merge_replicas():
+    '''Merged correlators pool the lag sums of all replicas'''
+    replicas = [bunched(s) for s in range(3)]
+    merged = None
+    for r in replicas:
+        c = Correlator(RES, LEVELS, CHANNELS)
+        c.update(r)
+        c.finalize(T)
+        merged = c if merged is None else merged.merge(c)
+
+    pooled = np.concatenate([r+i*T for i, r in enumerate(replicas)])
+    _, G = correlate(pooled, resolution=RES, levels=LEVELS, channels=CHANNELS)
+    # pooling differs from concatenation only by pairs across replica borders
+    assert np.allclose(merged.G[:20], G[:20], atol=1e-3)
+
+def test_file_input(photons, tmp_path):
+    '''Timetag files are read chunk by chunk'''
+    fn = str(tmp_path/'photons')
+    photons.tofile(fn)
+    _, G = correlate(fn, resolution=RES, levels=LEVELS, channels=CHANNELS, duration=T)
+    assert np.allclose(G, naive(photons, photons))
+
+#-----------------------------------------------------------------------------#
+
+def test_live_sink(tmp_path):
+    '''A correlation sink correlates photons straight from the pipe'''
+    jablonsky = {
+        'exi': {'from': 'S0', 'to': 'S1', 'rate': {'input': 'flux', 'epsilon': 1e5}},
+        'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': 'photons'},
+    }
+    c = Correlator(resolution=1e-7, levels=12)
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Diffusion(
+            experiment_time=0.2, coordinate_output='coords',
+            collision_output=os.devnull
+        ))
+        S.add(Excitation(input='coords', output='flux'))
+        S.add(Fluorophore(jablonsky=jablonsky))
+        S.add_sink(CorrelationSink('photons', c))
+        S.run()
+    tau, G = c.finalize(0.2)
+    assert c.n_a > 0
+    assert np.all(np.isfinite(G))
+
+#-----------------------------------------------------------------------------#
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+
+'''Tests for replica ensembles with streaming aggregation.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Ensemble, Excitation, Fluorophore
+from pysimfs.ensemble import Count, Correlation, Histogram, Welford
+
+#-----------------------------------------------------------------------------#
+
+JABLONSKY = {
+    'exi': {'from': 'S0', 'to': 'S1', 'rate': {'input': 'flux', 'epsilon': 1e5}},
+    'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': 'photons'},
+}
+
+def photon_graph(tmp_path):
+    '''Factory of diffusion -> excitation -> fluorophore graphs'''
+    def factory():
+        return [
+            Diffusion(
+                experiment_time=0.05, coordinate_output='coords',
+                collision_output=str(tmp_path/'collisions')
+            ),
+            Excitation(input='coords', output='flux'),
+            Fluorophore(jablonsky=JABLONSKY),
+        ]
+    return factory
+
+#-----------------------------------------------------------------------------#
+
+def test_welford():
+    '''Running and merged statistics equal the batch statistics'''
+    x = np.random.default_rng(0).normal(size=(50, 3))
+    a, b = Welford(), Welford()
+    for row in x[:20]:
+        a.update(row)
+    for row in x[20:]:
+        b.update(row)
+    assert np.allclose(b.mean, x[20:].mean(0))
+    a.merge(b)
+    assert a.n == 50
+    assert np.allclose(a.mean, x.mean(0))
+    assert np.allclose(a.var, x.var(0, ddof=1))
+
+def test_ensemble(tmp_path):
+    '''Replicas are reduced into aggregates, raw outputs are discarded'''
+    bins = np.linspace(0, 0.05, 6)
+    corr = Correlation(resolution=1e-7, levels=10, duration=0.05)
+    ens = Ensemble(
+        photon_graph(tmp_path), 6,
+        {'photons': [Count(), Histogram(bins), corr]},
+        seed=1, budget=6, tmpdir=str(tmp_path/'tmp')
+    )
+    results = ens.run_all()
+    assert [r.error for r in results] == [None]*6
+
+    counts, hist, G = ens.stats['photons']
+    assert counts.n == hist.n == G.n == 6
+    assert counts.mean > 0 and counts.var > 0
+    assert np.isclose(hist.mean.sum(), counts.mean)
+    assert G.mean.shape == corr.tau.shape
+    assert not os.path.exists(tmp_path/'collisions')
+
+def test_ensemble_reproducible(tmp_path):
+    '''Ensembles with the same seed give the same aggregates'''
+    means = []
+    for _ in range(2):
+        ens = Ensemble(
+            photon_graph(tmp_path), 3, {'photons': Count()},
+            seed=3, tmpdir=str(tmp_path/'tmp')
+        )
+        ens.run_all()
+        means.append(ens.stats['photons'][0].mean)
+    assert means[0] == means[1]
+
+def test_ensemble_unknown_output(tmp_path):
+    '''Reducers of outputs the graph does not have fail the replicas'''
+    ens = Ensemble(
+        photon_graph(tmp_path), 1, {'nothing': Count()}, tmpdir=str(tmp_path/'tmp')
+    )
+    r, = ens.run_all()
+    assert isinstance(r.error, KeyError)
+    assert ens.stats['nothing'][0].n == 0
+
+#-----------------------------------------------------------------------------#
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+'''Tests for the in-process NumPy components.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import asyncio
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Excitation, Mixer, Shift, Simulation, Splitter
+from pysimfs import coordinate_t, timed_value_t, timetag_t
+from pysimfs import InProcessMixer, InProcessShift, InProcessSplitter
+from pysimfs.inprocess import routed_t, to_inprocess
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def simulation(tmp_path):
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        yield S
+
+def run(simulation, *components):
+    '''Utility: runs components and returns the results'''
+    for c in components:
+        simulation.add(c)
+    simulation.run()
+    return simulation.get_results(mmap=False)
+
+def time_tags(tmp_path, name, n, seed):
+    '''Utility: writes n sorted random time tags to a file'''
+    tags = np.sort(np.random.default_rng(seed).random(n))
+    tags.tofile(tmp_path/name)
+    return str(tmp_path/name)
+
+#-----------------------------------------------------------------------------#
+
+def test_shift(simulation, tmp_path):
+    '''Coordinates are moved in space and time'''
+    coords = np.zeros(200000, coordinate_t)
+    coords['t'] = np.arange(len(coords))
+    coords.tofile(tmp_path/'coords')
+    out = str(tmp_path/'shifted')
+    shifted, = run(simulation, InProcessShift(
+        input=str(tmp_path/'coords'), output=out, shift_x=1.0, shift_z=-2.0, delay=0.5
+    )).values()
+    assert len(shifted) == len(coords)
+    assert np.all(shifted['x'] == 1.0) and np.all(shifted['y'] == 0.0)
+    assert np.all(shifted['z'] == -2.0)
+    assert np.array_equal(shifted['t'], coords['t'] + 0.5)
+
+@pytest.mark.parametrize('routed', [False, True])
+def test_mixer_matches_binary(tmp_path, routed):
+    '''The merge is identical to the one of simfs_mix'''
+    inputs = [time_tags(tmp_path, f'tags{i}', 100000*(i+1), i) for i in range(3)]
+    results = []
+    for cls in (Mixer, InProcessMixer):
+        with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+            out = str(tmp_path/f'{cls.__name__}.out')
+            run(S, cls(inputs=inputs, output=out, routed=routed))
+            results.append(np.fromfile(out, routed_t if routed else timetag_t))
+    assert len(results[1]) == 600000
+    assert np.array_equal(results[0], results[1])
+
+def test_splitter_statistics(simulation, tmp_path):
+    '''Photons are accepted with the efficiency in effect at their time'''
+    photons = time_tags(tmp_path, 'photons', 200000, 1)
+    efficiency = np.array([(0.2, 0.1), (0.7, 0.5)], timed_value_t)
+    efficiency.tofile(tmp_path/'efficiency')
+    res = run(simulation, InProcessSplitter(
+        photon_input=photons, efficiency_input=str(tmp_path/'efficiency'),
+        accepted_output=str(tmp_path/'acc'), rejected_output=str(tmp_path/'rej'),
+        seed=1
+    ))
+    acc, rej = res[str(tmp_path/'acc')], res[str(tmp_path/'rej')]
+    assert len(acc) + len(rej) == 200000
+    assert not np.any(acc < 0.1)
+    for lo, hi, eff in [(0.1, 0.5, 0.2), (0.5, 1.0, 0.7)]:
+        a = np.sum((acc >= lo) & (acc < hi))
+        r = np.sum((rej >= lo) & (rej < hi))
+        assert abs(a/(a+r) - eff) < 0.01
+
+def test_splitter_seed(tmp_path):
+    '''Equal seeds give equal splits'''
+    photons = time_tags(tmp_path, 'photons', 10000, 1)
+    np.array([(0.5, 0.0)], timed_value_t).tofile(tmp_path/'efficiency')
+    results = []
+    for i in range(2):
+        with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+            res = run(S, InProcessSplitter(
+                photon_input=photons, efficiency_input=str(tmp_path/'efficiency'),
+                accepted_output=str(tmp_path/f'acc{i}'), seed=7
+            ))
+            results.append(res[str(tmp_path/f'acc{i}')])
+    assert np.array_equal(*results)
+
+#-----------------------------------------------------------------------------#
+
+def test_to_inprocess():
+    '''Components with an in-process equivalent are replaced, keeping params'''
+    shift = Shift(name='s', input='a', output='b', delay=1.0)
+    new = to_inprocess(shift)
+    assert isinstance(new, InProcessShift)
+    assert new.name.startswith('s:inprocess/sft:')
+    assert new._params['delay'] == 1.0 and new._params['input'] == 'a'
+    assert isinstance(to_inprocess(Splitter()), InProcessSplitter)
+    diffusion = Diffusion(experiment_time=0.01)
+    assert type(to_inprocess(diffusion)) is Diffusion
+
+def test_fan_out_inprocess(tmp_path):
+    '''An in-process simulation uses in-process buffers for fan-out'''
+    with Simulation(
+        tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'), inprocess=True
+    ) as S:
+        S.add(Diffusion(
+            experiment_time=0.01, increment=1e-5,
+            coordinate_output='coords', collision_output=os.devnull
+        ))
+        S.add(Shift(input='coords', output=str(tmp_path/'a'), shift_x=1.0))
+        S.add(Shift(input='coords', output=str(tmp_path/'b'), shift_x=2.0))
+        assert all(c.inprocess for c in S.components[1:])
+        S.run()
+        res = S.get_results()
+        a, b = res[str(tmp_path/'a')], res[str(tmp_path/'b')]
+        assert len(a) == len(b) == int(0.01/1e-5)
+        assert np.allclose(b['x'] - a['x'], 1.0)
+        assert len(S.report.processes) == 4
+
+def test_cancel_inprocess(tmp_path):
+    '''Runs with in-process stages time out and clean up'''
+    with Simulation(
+        tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'), inprocess=True
+    ) as S:
+        S.add(Diffusion(
+            experiment_time=1e4, increment=1e-5,
+            coordinate_output='coords', collision_output=os.devnull
+        ))
+        S.add(Shift(input='coords', output='shifted'))
+        S.add(Excitation(input='shifted', output=str(tmp_path/'flux')))
+        with pytest.raises(asyncio.TimeoutError):
+            S.run(timeout=0.5)
+        assert not S.open_pipes
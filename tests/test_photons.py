@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+'''Tests for the photon statistics analyzers.'''
+
+#-----------------------------------------------------------------------------#
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Fluorophore, Simulation, routed_t, timed_value_t
+from pysimfs.analysis import (
+    BurstSearch, CountTrace, InterPhotonHistogram, PhotonSink, TCSPCHistogram,
+    analyze, fret_efficiency
+)
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def photons():
+    '''Routed photons: background on two channels and bursts of 100 photons
+    with 30 % on channel 1'''
+    rng = np.random.default_rng(0)
+    t = [rng.uniform(0, 1.0, 20000)]
+    for start in rng.uniform(0, 1.0, 50):
+        t.append(start + rng.uniform(0, 2e-4, 100))
+    t = np.concatenate(t)
+    records = np.empty(len(t), routed_t)
+    order = np.argsort(t)
+    records['t'] = t[order]
+    channel = np.concatenate((
+        rng.integers(0, 2, 20000), (rng.random(5000) < 0.3).astype('i8')
+    ))
+    records['channel'] = channel[order]
+    return records
+
+def burst_search_loop(t, m, max_duration, min_photons):
+    '''Utility: sliding window burst search, one window at a time'''
+    bursts, start = [], None
+    for i in range(len(t)-m+1):
+        if t[i+m-1] - t[i] <= max_duration:
+            if start is None:
+                start = i
+        elif start is not None:
+            if i+m-1 - start >= min_photons:
+                bursts.append((start, i+m-1))
+            start = None
+    if start is not None and len(t) - start >= min_photons:
+        bursts.append((start, len(t)))
+    return bursts
+
+#-----------------------------------------------------------------------------#
+
+def test_count_trace(photons):
+    '''Counts per bin and channel do not depend on the block size'''
+    (t, counts), = analyze(photons, CountTrace(1e-3, channels=2), dtype=routed_t)
+    assert counts.shape == (2, len(t))
+    for c in range(2):
+        t_c = photons['t'][photons['channel'] == c]
+        expected = np.histogram(t_c, len(t), (0, len(t)*1e-3))[0]
+        assert np.array_equal(counts[c], expected)
+    (_, chunked), = analyze(photons, CountTrace(1e-3, channels=2), chunk_size=333)
+    assert np.array_equal(chunked, counts)
+
+    (t, total), = analyze(photons['t'], CountTrace(1e-2, start=0.5), chunk_size=1000)
+    assert total.sum() == np.count_nonzero(photons['t'] >= 0.5) and t[0] == 0.5
+    assert len(CountTrace(1e-3).finalize(duration=0.1)[1]) == 100
+
+def test_histograms(photons):
+    '''Inter-photon and TCSPC histograms match NumPy on the whole stream'''
+    bins = np.logspace(-9, -2, 50)
+    (_, ipt), (_, tcspc) = analyze(
+        photons, InterPhotonHistogram(bins), TCSPCHistogram(1e-4, 64, offset=1e-5),
+        chunk_size=777
+    )
+    assert np.array_equal(ipt, np.histogram(np.diff(photons['t']), bins)[0])
+    delays = np.mod(photons['t'] - 1e-5, 1e-4)
+    expected = np.histogram(delays, np.linspace(0, 1e-4, 65))[0]
+    assert np.array_equal(tcspc, expected)
+
+@pytest.mark.parametrize('chunk_size', [97, 1000, 1<<20])
+def test_burst_search(photons, chunk_size):
+    '''Bursts are those of the window by window search, for any block size'''
+    bursts, = analyze(
+        photons, BurstSearch(10, 1e-4, 30, channels=2), chunk_size=chunk_size
+    )
+    t = photons['t']
+    expected = burst_search_loop(t, 10, 1e-4, 30)
+    assert 40 <= len(bursts) == len(expected)
+    first, stop = np.array(expected).T
+    assert np.array_equal(bursts['start'], t[first])
+    assert np.array_equal(bursts['stop'], t[stop-1])
+    assert np.array_equal(bursts['n'], stop - first)
+    assert np.array_equal(bursts['counts'].sum(axis=1), bursts['n'])
+
+def test_fret_efficiency(photons):
+    '''Burst efficiencies are near the acceptor fraction of the bursts'''
+    bursts, = analyze(photons, BurstSearch(10, 1e-4, 50, channels=2))
+    E = fret_efficiency(bursts)
+    assert abs(np.median(E) - 0.3) < 0.05
+    # background subtraction and gamma
+    b = np.zeros(1, bursts.dtype)
+    b['stop'], b['counts'] = 1.0, [[60, 40]]
+    assert fret_efficiency(b, background=(10, 20))[0] == 20/70
+    assert fret_efficiency(b, gamma=2.0)[0] == 40/160
+
+def test_sink(tmp_path):
+    '''Analyzers run on the live output of a simulation'''
+    rate = np.array([(2.5e25, 0.0), (2.5e25, 0.1), (2.5e25, 0.2)], timed_value_t)
+    rate.tofile(tmp_path/'rate')
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Fluorophore(jablonsky={
+            'exi': {
+                'from': 'S0', 'to': 'S1',
+                'rate': {'input': str(tmp_path/'rate'), 'epsilon': 1e5}
+            },
+            'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': 'photons'},
+        }))
+        sink = PhotonSink(
+            'photons', CountTrace(1e-2),
+            InterPhotonHistogram(np.r_[0, np.logspace(-9, 0, 10)])
+        )
+        S.add_sink(sink)
+        S.run()
+    (t, counts), (_, ipt) = sink.results
+    assert counts.sum() == sink.records == ipt.sum() + 1
+    assert len(t) >= 19
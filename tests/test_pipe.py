@@ -5,6 +5,7 @@
 #-----------------------------------------------------------------------------#
 
 # stdlib
+import fcntl
 import os
 import threading
 
@@ -16,6 +17,7 @@ import pytest
 
 # package
 from pysimfs.pipe import Pipe
+from pysimfs.pipe.unix_pipe import F_GETPIPE_SZ, max_capacity
 
 #-----------------------------------------------------------------------------#
 
@@ -77,4 +79,28 @@ def test_read_write(pipe_instance, data):
 
 #-----------------------------------------------------------------------------#
 
+@pytest.mark.skipif(max_capacity() is None, reason='needs F_SETPIPE_SZ')
+def test_resize(tmp_dir):
+    '''The buffer of an open pipe is resized to the capacity'''
+    with Pipe(os.path.join(tmp_dir, 'pipe2'), capacity=1<<18) as p:
+        r = os.open(p.path, os.O_RDONLY | os.O_NONBLOCK)
+        w = os.open(p.path, os.O_WRONLY)
+        try:
+            assert p.resize() == 1<<18
+            assert fcntl.fcntl(w, F_GETPIPE_SZ) == 1<<18
+        finally:
+            os.close(w)
+            os.close(r)
+
+def test_resize_without_capacity(pipe_instance):
+    '''Pipes without capacity keep the system default'''
+    with pipe_instance as p:
+        assert p.resize() is None
+
+def test_exit_twice(pipe_instance):
+    '''Removing an already removed pipe is not an error'''
+    with pipe_instance as p:
+        os.remove(p.path)
+    assert not os.path.exists(p.path)
 
+#-----------------------------------------------------------------------------#
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+
+'''Tests for scans and streaming coordinate sources.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Excitation, Simulation, coordinate_t, mocks
+from pysimfs import GridScan, LineScan, PointScan, RasterScan, Scan, ScanSource
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def simulation(tmp_path):
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        yield S
+
+#-----------------------------------------------------------------------------#
+
+def test_grid_order(tmp_path):
+    '''Grid points are in GridData order and end with a closing record'''
+    scan = GridScan((0, 1, 2), (0, 2, 3), (0, 3, 4), dwell=0.5)
+    assert scan.shape == (2, 3, 4) and len(scan) == 24
+    c = np.concatenate(list(scan.chunks(chunk_size=5)))
+    assert len(c) == 25
+    assert np.array_equal(c['t'], np.arange(25)*0.5)
+    assert np.array_equal(c[:-1]['z'], np.tile(np.arange(4.0), 6))
+    assert np.array_equal(c[:-1]['x'], np.repeat([0.0, 1.0], 12))
+    assert c[-1]['x'] == c[-2]['x'] and c[-1]['z'] == c[-2]['z']
+
+    fn = mocks.coordinate_grid((0, 1, 2), (0, 2, 3), (0, 3, 4), dwell=0.5)
+    try:
+        assert np.array_equal(np.fromfile(fn, coordinate_t), c)
+    finally:
+        os.remove(fn)
+
+@pytest.mark.parametrize('dwell', [0.1, np.linspace(0.1, 0.3, 100)])
+def test_index_of(dwell):
+    '''Every start time belongs to its own position, despite rounding'''
+    scan = LineScan((0, 0, 0), (1, 0, 0), 50, dwell=dwell, t0=1.0, repeats=2)
+    starts = scan.coordinates()['t']
+    assert np.array_equal(scan.index_of(starts), np.arange(100))
+    assert np.array_equal(scan.index_of(np.nextafter(starts, 0)), np.arange(100)-1)
+    assert scan.index_of([0.5, 1.0 + scan.duration]).tolist() == [-1, -1]
+
+def test_reduce_and_grid():
+    '''Records are reduced per position and arranged on the grid'''
+    scan = RasterScan((0, 3, 4), (0, 2, 3), dwell=1.0, bidirectional=True)
+    c = scan.coordinates()
+    assert c['x'][:8].tolist() == [0, 1, 2, 3, 3, 2, 1, 0]
+    # two photons per position, value x+10y at every position
+    t = np.repeat(c['t'], 2) + np.tile([0.25, 0.75], len(c))
+    image = scan.to_grid(scan.reduce(t, statistic='rate'))
+    assert np.array_equal(image, np.full((3, 4), 2.0))
+    values = scan.to_grid(scan.reduce(c['t'], c['x'] + 10*c['y'], 'mean'))
+    assert np.array_equal(values, np.arange(4)[None, :] + 10*np.arange(3)[:, None])
+
+def test_spec_roundtrip():
+    '''Scans are rebuilt from their JSON description'''
+    for scan in [
+        GridScan((0, 1, 2), (0, 1, 2), (0, 1, 3), dwell=0.1, t0=2.0),
+        RasterScan((0, 1, 5), (0, 1, 5), z=1e-6, bidirectional=True),
+        LineScan((0, 0, 0), (1, 1, 1), 7, repeats=3),
+        PointScan(np.random.default_rng(0).random((9, 3)), dwell=np.ones(9)),
+    ]:
+        again = Scan.from_spec(scan.spec())
+        assert np.array_equal(again.coordinates(), scan.coordinates())
+
+def test_source_streams_into_excitation(simulation, tmp_path):
+    '''A scan streamed through a pipe gives the same image as a file'''
+    scan = RasterScan((-1e-6, 1e-6, 41), (-1e-6, 1e-6, 41), dwell=1e-4)
+    simulation.add(ScanSource(scan, output='coords'))
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+    assert not simulation.unmatched_in
+    simulation.run()
+    streamed = scan.image(np.fromfile(tmp_path/'flux', Excitation.output_paths[0].dtype))
+    assert not os.path.exists('coords')
+
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Excitation(input=scan.write(str(tmp_path/'coords')), output=str(tmp_path/'flux2')))
+        S.run()
+    image = scan.image(np.fromfile(tmp_path/'flux2', Excitation.output_paths[0].dtype))
+    assert np.array_equal(streamed, image)
+    # the focus is in the center of the image
+    assert np.unravel_index(np.argmax(image), image.shape) == (20, 20)
+    assert np.all(np.isfinite(image))
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+'''Tests for sharded simulations.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Excitation, Shards, timed_value_t, timetag_t
+from pysimfs.shard import merge_shards
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def chain(tmp_path):
+    '''Factory of diffusion -> excitation graphs writing to tmp_path/flux'''
+    def factory():
+        return [
+            Diffusion(
+                experiment_time=0.04, increment=1e-5,
+                coordinate_output='coords', collision_output=os.devnull
+            ),
+            Excitation(input='coords', output=str(tmp_path/'flux'))
+        ]
+    return factory
+
+#-----------------------------------------------------------------------------#
+
+def test_merge_offsets(tmp_path):
+    '''Shards are concatenated with time offsets, warmup is dropped'''
+    files = []
+    for i in range(3):
+        fn = str(tmp_path/f'shard{i}')
+        np.arange(0, 1.5, 0.25).astype(timetag_t).tofile(fn)
+        files.append(fn)
+    out = str(tmp_path/'merged')
+    n = merge_shards(files, out, timetag_t, duration=1.0, warmup=0.25)
+    merged = np.fromfile(out, timetag_t)
+    assert n == len(merged)
+    assert np.allclose(merged, [0, .25, .5, .75, 1, 1.25, 1.5, 1.75, 2, 2.25, 2.5, 2.75, 3])
+
+def test_shards(chain, tmp_path):
+    '''Sharded runs produce one continuous output of the full duration'''
+    shards = Shards(chain, shards=4, seed=1, tmpdir=str(tmp_path/'tmp'))
+    results = shards.run_all()
+    assert [r.error for r in results] == [None]*4
+    seeds = {r.logs[0].params['seed'] for r in results}
+    assert len(seeds) == 4
+    assert all(r.logs[0].params['experiment_time'] == 0.01 for r in results)
+
+    flux = shards.get_results()[str(tmp_path/'flux')]
+    assert flux.dtype == timed_value_t
+    assert len(flux) == 4*int(0.01/1e-5)
+    assert np.all(np.diff(flux['t']) > 0)
+    assert 0.039 < flux['t'][-1] < 0.04
+    assert not [f for f in os.listdir(tmp_path) if '.shard' in f]
+
+def test_shards_warmup(chain, tmp_path):
+    '''Warmup is simulated in every shard and discarded'''
+    shards = Shards(chain, shards=2, warmup=0.005, seed=1, tmpdir=str(tmp_path/'tmp'))
+    results = shards.run_all()
+    assert all(r.logs[0].params['experiment_time'] == 0.025 for r in results)
+    t = shards.get_results()[str(tmp_path/'flux')]['t']
+    assert t[0] == 0
+    assert np.all(np.diff(t) > 0)
+    assert t[-1] < 0.04
+
+def test_shards_reproducible(chain, tmp_path):
+    '''The same seed gives the same merged output'''
+    outputs = []
+    for _ in range(2):
+        shards = Shards(chain, shards=2, seed=7, tmpdir=str(tmp_path/'tmp'))
+        shards.run_all()
+        outputs.append(np.array(shards.get_results()[str(tmp_path/'flux')]))
+    assert np.array_equal(*outputs)
+
+#-----------------------------------------------------------------------------#
@@ -0,0 +1,484 @@
+#! /usr/bin/env python
+
+'''Tests for running pysimfs simulations.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import asyncio
+import json
+import os
+import sys
+import threading
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Detection, Excitation, Fluorophore, Simulation, coordinate_t, timed_value_t
+from pysimfs import ArraySink, CoordinateBuffer, Pulse
+from pysimfs import PhotonCount, RasterScan, ScanSource, SimulatedTime
+from pysimfs.check import DeadlockError, GraphError
+from pysimfs.report import RunReport
+from pysimfs.utils import map_file
+
+#-----------------------------------------------------------------------------#
+
+def diffusion_chain(sim, tmp_path, experiment_time, tag=''):
+    '''Utility: adds a diffusion -> excitation chain connected by a pipe'''
+    sim.add(Diffusion(
+        experiment_time=experiment_time,
+        increment=1e-5,
+        coordinate_output='coords',
+        collision_output=os.devnull
+    ))
+    sim.add(Excitation(
+        input='coords',
+        output=str(tmp_path/f'flux{tag}')
+    ))
+
+@pytest.fixture
+def simulation(tmp_path):
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        yield S
+
+#-----------------------------------------------------------------------------#
+
+def test_run(simulation, tmp_path):
+    '''A piped chain runs to completion and returns one log per component'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    logs = simulation.run()
+    assert len(logs) == 2
+    flux, = simulation.get_results().values()
+    assert len(flux) == int(0.01/1e-5)
+    assert np.all(flux['v'] >= 0)
+
+def test_run_inside_event_loop(simulation, tmp_path):
+    '''The blocking run also works while an event loop is running'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+
+    async def main():
+        return simulation.run()
+
+    assert len(asyncio.run(main())) == 2
+
+def test_run_async_concurrent(tmp_path):
+    '''Several simulations can be awaited concurrently on one loop'''
+    sims = [
+        Simulation(tmpdir=str(tmp_path/f'tmp{i}'), datadir=str(tmp_path/'data'))
+        for i in range(3)
+    ]
+    for i, s in enumerate(sims):
+        diffusion_chain(s, tmp_path, 0.01, tag=i)
+
+    async def main():
+        return await asyncio.gather(*(s.run_async() for s in sims))
+
+    for logs in asyncio.run(main()):
+        assert len(logs) == 2
+    for i, s in enumerate(sims):
+        assert len(s.get_results()[str(tmp_path/f'flux{i}')]) == int(0.01/1e-5)
+        s.clear()
+
+def test_cancel_removes_pipes(simulation, tmp_path):
+    '''Cancelling a run kills the processes and removes the pipes'''
+    diffusion_chain(simulation, tmp_path, 1e4)
+
+    async def main():
+        task = asyncio.ensure_future(simulation.run_async())
+        await asyncio.sleep(0.5)
+        assert simulation.open_pipes
+        pipes = set(simulation.open_pipes)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return pipes
+
+    pipes = asyncio.run(main())
+    assert not simulation.open_pipes
+    assert not any(os.path.exists(p) for p in pipes)
+
+def test_pipes_removed_after_run(simulation, tmp_path):
+    '''Pipes only exist while the simulation runs, so it can run again'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    simulation.run()
+    assert not simulation.open_pipes
+    assert not os.listdir(simulation.tmpdir)
+    simulation.run()
+    assert len(simulation.get_results()[str(tmp_path/'flux')]) == int(0.01/1e-5)
+
+def test_pipe_capacity(tmp_path):
+    '''Capacities are set for all pipes, by pipe name or by dtype'''
+    S = Simulation(
+        tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'),
+        pipe_capacity={'coords': 1<<18, timed_value_t: 1<<17}
+    )
+    S.add(Diffusion(experiment_time=0.01, coordinate_output='coords'))
+    S.add(Excitation(input='coords', output='flux'))
+    S.add(Fluorophore(jablonsky={
+        'exi': {'from': 'S0', 'to': 'S1', 'rate': {'input': 'flux', 'epsilon': 1e5}},
+        'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': os.devnull},
+    }))
+    capacities = {
+        S.pipe_names[e.name]: S.capacity_of(e) for e in S.matched
+    }
+    assert capacities == {'coords': 1<<18, 'flux': 1<<17}
+    S.pipe_capacity = 1<<16
+    assert {S.capacity_of(e) for e in S.matched} == {1<<16}
+    S.clear()
+
+def test_timeout(simulation, tmp_path):
+    '''Runs exceeding the timeout raise a TimeoutError'''
+    diffusion_chain(simulation, tmp_path, 1e4)
+    with pytest.raises(asyncio.TimeoutError):
+        simulation.run(timeout=0.5)
+    assert not simulation.open_pipes
+
+#-----------------------------------------------------------------------------#
+
+def test_results_are_memory_mapped(simulation, tmp_path):
+    '''Results are memory maps by default and arrays on request'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    simulation.run()
+    mapped, = simulation.get_results().values()
+    loaded, = simulation.get_results(mmap=False).values()
+    assert isinstance(mapped, np.memmap)
+    assert not isinstance(loaded, np.memmap)
+    assert np.array_equal(mapped, loaded)
+
+def test_iter_results(simulation, tmp_path):
+    '''Chunks of iter_results add up to the complete output'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    simulation.run()
+    name = str(tmp_path/'flux')
+    chunks = list(simulation.iter_results(name, chunk_size=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 99]
+    assert chunks[0].dtype == timed_value_t
+    assert np.array_equal(np.concatenate(chunks), simulation.get_results()[name])
+    with pytest.raises(KeyError):
+        simulation.iter_results('not_an_output')
+
+def test_empty_result(simulation, tmp_path):
+    '''Empty outputs map to empty arrays'''
+    empty = tmp_path/'empty'
+    empty.touch()
+    assert len(map_file(str(empty), timed_value_t)) == 0
+
+#-----------------------------------------------------------------------------#
+def test_report_processes(simulation, tmp_path):
+    '''Every component reports its exit status and resource usage'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    simulation.run()
+    report = simulation.report
+    assert [p.component for p in report.processes] == \
+        [c.name for c in simulation.components]
+    for p in report.processes:
+        assert p.returncode == 0
+        assert p.wall > 0 and p.user >= 0 and p.sys >= 0
+        assert p.max_rss > 1<<20
+    assert report.bottleneck in report.processes
+    assert not report.pipes
+
+def test_report_pipes(tmp_path):
+    '''Profiled simulations count the records moved through every pipe'''
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'),
+            profile=True) as S:
+        diffusion_chain(S, tmp_path, 0.01)
+        S.run()
+        flux, = S.get_results().values()
+        writer, reader = [c.name for c in S.components]
+    pipe, = S.report.pipes
+    assert (pipe.name, pipe.writer, pipe.reader) == ('coords', writer, reader)
+    assert pipe.bytes == pipe.records*coordinate_t.itemsize
+    assert pipe.records >= len(flux)
+
+def test_report_json(simulation, tmp_path):
+    '''Reports round-trip through JSON'''
+    diffusion_chain(simulation, tmp_path, 0.01)
+    simulation.run()
+    fn = tmp_path/'report.json'
+    simulation.report.to_json(str(fn))
+    report = RunReport.from_dict(json.loads(fn.read_text()))
+    assert report.processes == simulation.report.processes
+    assert report.wall == simulation.report.wall
+    assert report.stopped is None
+
+def test_report_json_stopped(simulation, tmp_path):
+    '''Reports of stopped runs keep their stop condition'''
+    diffusion_chain(simulation, tmp_path, 1e4)
+    simulation.run(timeout=60, stop=SimulatedTime(0.01))
+    d = json.loads(simulation.report.to_json())
+    report = RunReport.from_dict(d)
+    assert report.stopped == repr(simulation.stopped)
+    assert str(report).endswith(f'(stopped by {simulation.stopped})')
+
+def test_cancel_profiled(tmp_path):
+    '''Cancelling a profiled run also stops the relays'''
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'),
+            profile=True) as S:
+        diffusion_chain(S, tmp_path, 1e4)
+        with pytest.raises(asyncio.TimeoutError):
+            S.run(timeout=0.5)
+        assert not S.open_pipes
+
+#-----------------------------------------------------------------------------#
+def test_progress_callback(simulation, tmp_path):
+    '''The progress callback receives samples of simulated time and rates'''
+    simulation.add(Diffusion(
+        experiment_time=0.2, coordinate_output='coords', collision_output=os.devnull
+    ))
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+    samples = []
+    simulation.run(progress=samples.append, interval=0.05)
+    assert samples
+    fractions = [p.fraction for p in samples if p.fraction is not None]
+    assert fractions == sorted(fractions)
+    assert all(0 < f <= 1 for f in fractions)
+    assert samples[-1].experiment_time == 0.2
+    names = {s.name for s in samples[-1].stages}
+    assert names == {c.name for c in simulation.components}
+
+def test_watch(simulation, tmp_path):
+    '''watch yields samples while the run is active and ends with it'''
+    simulation.add(Diffusion(
+        experiment_time=0.2, coordinate_output='coords', collision_output=os.devnull
+    ))
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+
+    async def main():
+        task = asyncio.ensure_future(simulation.run_async())
+        samples = [p async for p in simulation.watch(0.05)]
+        await task
+        return samples
+
+    samples = asyncio.run(main())
+    assert samples
+    records = [p.outputs[0].records for p in samples]
+    assert records == sorted(records)
+    assert simulation.monitor.done
+
+def test_watch_failed_run(simulation, tmp_path):
+    '''watch ends with the error of a run that fails before it starts'''
+    simulation.add(Excitation(input=str(tmp_path/'missing'), output=str(tmp_path/'flux')))
+
+    async def main():
+        task = asyncio.ensure_future(simulation.run_async())
+        with pytest.raises(AssertionError, match='does not exist'):
+            async for _ in simulation.watch(0.05):
+                pass
+        assert task.done()
+        with pytest.raises(AssertionError):
+            await task
+
+    asyncio.run(asyncio.wait_for(main(), 30))
+
+def test_watch_short_run(simulation, tmp_path):
+    '''watch ends with a run that completes within one interval'''
+    diffusion_chain(simulation, tmp_path, 0.001)
+
+    async def main():
+        task = asyncio.ensure_future(simulation.run_async())
+        samples = [p async for p in simulation.watch(10)]
+        return samples, await task
+
+    samples, logs = asyncio.run(asyncio.wait_for(main(), 30))
+    assert samples == [] and len(logs) == 2
+
+def test_progress_callback_error(simulation, tmp_path):
+    '''An exception of the progress callback fails the run'''
+    diffusion_chain(simulation, tmp_path, 1e4)
+
+    def progress(p):
+        raise ValueError('callback failed')
+
+    with pytest.raises(ValueError, match='callback failed'):
+        simulation.run(timeout=30, progress=progress, interval=0.05)
+    assert not simulation.open_pipes
+
+#-----------------------------------------------------------------------------#
+def test_deferred_remap(simulation, tmp_path):
+    '''Matched names are replaced by pipes on remap, also for late matches'''
+    simulation.add(Diffusion(coordinate_output='coords', collision_output=os.devnull))
+    simulation.remap()
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+    diffusion, excitation = simulation.components
+    assert diffusion._params['coordinate_output'] == 'coords'
+    simulation.remap()
+    pipe, = simulation.matched
+    assert diffusion._params['coordinate_output'] == pipe.name
+    assert excitation._params['input'] == pipe.name
+    assert simulation.unmatched_out == {(str(tmp_path/'flux'), timed_value_t)} | \
+        {o for o in simulation.unmatched_out if o.name == os.devnull}
+
+def test_add_copies(simulation):
+    '''Added components are independent of the original'''
+    d = Diffusion(coordinate_output='coords', collision_output=os.devnull)
+    simulation.add(d)
+    simulation.add(Excitation(input='coords', output='flux'))
+    simulation.remap()
+    assert d._params['coordinate_output'] == 'coords'
+    assert d.params['coordinate_output'] == 'coords'
+
+#-----------------------------------------------------------------------------#
+def test_fan_out(simulation, tmp_path):
+    '''Outputs read by several nodes are split by an inserted buffer'''
+    sink = ArraySink('coords', coordinate_t)
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+    simulation.add(Diffusion(
+        experiment_time=0.01, increment=1e-5,
+        coordinate_output='coords', collision_output=os.devnull
+    ))
+    simulation.add(Detection(input='coords', output=str(tmp_path/'efficiency')))
+    simulation.add_sink(sink)
+    buffers = [c for c in simulation.components if isinstance(c, CoordinateBuffer)]
+    assert len(buffers) == 1
+    assert len(buffers[0]._params['outputs']) == 3
+    assert buffers[0].params['outputs'] == buffers[0]._params['outputs']
+    copied = buffers[0].copy()
+    assert len(copied._params['outputs']) == 3
+    assert len(simulation.matched) == 4
+
+    simulation.run()
+    results = simulation.get_results()
+    flux = results[str(tmp_path/'flux')]
+    efficiency = results[str(tmp_path/'efficiency')]
+    assert len(flux) == len(efficiency) == len(sink.data) == int(0.01/1e-5)
+    assert np.array_equal(flux['t'], efficiency['t'])
+    assert np.array_equal(flux['t'], sink.data['t'])
+
+def test_fan_out_readers_first(simulation, tmp_path):
+    '''Readers added before their writer are fanned out on the match'''
+    simulation.add(Excitation(input='coords', output=str(tmp_path/'flux')))
+    simulation.add(Detection(input='coords', output=str(tmp_path/'efficiency')))
+    assert len(simulation.unmatched_in) == 1
+    simulation.add(Diffusion(
+        experiment_time=0.01, increment=1e-5,
+        coordinate_output='coords', collision_output=os.devnull
+    ))
+    assert not simulation.unmatched_in
+    simulation.run()
+    assert all(len(r) == int(0.01/1e-5) for r in simulation.get_results().values())
+
+#-----------------------------------------------------------------------------#
+
+#-----------------------------------------------------------------------------#
+
+def test_check_cycle(simulation):
+    '''Components connected in a cycle are rejected before anything starts'''
+    simulation.add(Pulse(input='a', output='b'))
+    simulation.add(Pulse(input='b', output='a'))
+    problems = simulation.check()
+    assert len(problems) == 1 and problems[0].startswith('Cycle of pipes')
+    with pytest.raises(GraphError):
+        simulation.run()
+    assert not simulation.open_pipes
+
+def test_check_stray_fifo(simulation, tmp_path):
+    '''An output that is a named pipe nobody in the graph reads is rejected'''
+    fifo = str(tmp_path/'fifo')
+    os.mkfifo(fifo)
+    simulation.add(Diffusion(
+        experiment_time=0.01, coordinate_output=fifo, collision_output=os.devnull
+    ))
+    assert simulation.check() == [
+        f'Output {fifo} is a named pipe without reader in the graph.'
+    ]
+
+def test_stall_aborts(tmp_path, monkeypatch):
+    '''A run without progress is aborted with a diagnostic of its pipes'''
+    S = Simulation(
+        tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data'), stall_timeout=1
+    )
+    fifo = str(tmp_path/'fifo')
+    os.mkfifo(fifo)
+    S.add(Excitation(input=fifo, output=str(tmp_path/'flux')))
+    # nobody writes to fifo, which the static check would report
+    monkeypatch.setattr(S, 'check', lambda: [])
+    with pytest.raises(DeadlockError) as e:
+        S.run(timeout=30)
+    assert f'reads {fifo} (waiting to open)' in str(e.value)
+    assert not S.open_pipes
+    S.clear()
+
+#-----------------------------------------------------------------------------#
+def test_stop_simulated_time(simulation, tmp_path):
+    '''A run stops early on the simulated time of an output and keeps whole
+    records'''
+    diffusion_chain(simulation, tmp_path, 1e4)
+    flux = str(tmp_path/'flux')
+    logs = simulation.run(timeout=60, stop=SimulatedTime(0.1, flux))
+    assert len(logs) == 2 and logs[0].error == 'Stopped'
+    assert simulation.stopped.t == 0.1
+    assert simulation.report.stopped is simulation.stopped
+    assert os.path.getsize(flux) % timed_value_t.itemsize == 0
+    t = simulation.get_results()[flux]['t']
+    assert 0.1 <= t[-1] < 1e4 and np.all(np.diff(t) > 0)
+    assert not simulation.open_pipes
+
+def test_stop_photon_count(simulation, tmp_path):
+    '''Sinks count towards stop conditions and are closed normally'''
+    rate = np.array([(2.5e25, 0.0), (2.5e25, 1e-3), (2.5e25, 1e4)], timed_value_t)
+    rate.tofile(tmp_path/'rate')
+    simulation.add(Fluorophore(jablonsky={
+        'exi': {
+            'from': 'S0', 'to': 'S1',
+            'rate': {'input': str(tmp_path/'rate'), 'epsilon': 1e5}
+        },
+        'emi': {'from': 'S1', 'to': 'S0', 'rate': 1e8, 'output': 'photons'},
+    }))
+    sink = ArraySink('photons')
+    simulation.add_sink(sink)
+    with pytest.raises(KeyError):
+        simulation.run(stop=PhotonCount(10, 'nothing'))
+    simulation.run(timeout=60, stop=[
+        lambda progress: progress.elapsed > 30, PhotonCount(10000, 'photons')
+    ])
+    assert isinstance(simulation.stopped, PhotonCount)
+    assert len(sink.data) == sink.records >= 10000
+    assert sink.data[-1] < 1e4
+
+def test_processes_without_threads():
+    '''Processes are served and reaped on the event loop, no thread waits
+    for them'''
+    echo = 'import sys, time; d = sys.stdin.read(); time.sleep(0.2); print(d)'
+    async def run(n):
+        before = threading.active_count()
+        tasks = [
+            asyncio.ensure_future(Simulation.run_simfs_async(
+                sys.executable, ['-c', echo], {'i': i}
+            ))
+            for i in range(n)
+        ]
+        await asyncio.sleep(0.1)
+        assert threading.active_count() == before
+        return await asyncio.gather(*tasks)
+    results = asyncio.run(run(8))
+    assert [params for params, _, _ in results] == [{'i': i} for i in range(8)]
+    for _, err, usage in results:
+        assert err == '' and usage['returncode'] == 0
+        assert usage['wall'] >= 0.2 and usage['user'] > 0 and usage['max_rss'] > 0
+
+def test_stop_after_exit(tmp_path):
+    '''A source that finished before it was stopped reports its own output'''
+    d = Diffusion(
+        experiment_time=0.001, coordinate_output=str(tmp_path/'coords'),
+        collision_output=os.devnull
+    )
+    params, err, usage = asyncio.run(Simulation.run_simfs_async(
+        d.call, d.opts, d.params, stopped=lambda: True
+    ))
+    assert usage['returncode'] == 0 and err != 'Stopped'
+    # the full params written by the process, not the configured ones
+    assert 'seed' not in d.params and 'seed' in params
+
+def test_stop_inprocess_source(simulation):
+    '''In-process sources are cancelled by a custom condition'''
+    scan = RasterScan((-1e-6, 1e-6, 1000), (-1e-6, 1e-6, 1000), dwell=1e-3)
+    simulation.add(ScanSource(scan, output='coords'))
+    simulation.add(Excitation(input='coords', output='flux'))
+    sink = ArraySink('flux', timed_value_t)
+    simulation.add_sink(sink)
+    simulation.run(timeout=60, stop=lambda p: p.simulated and p.simulated > 1.0)
+    assert simulation.stopped is not None
+    assert 1000 <= sink.records < 1000*1000
@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+
+'''Tests for python sinks attached to simulation outputs.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+import time
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Excitation, Simulation
+from pysimfs import coordinate_t, timed_value_t
+from pysimfs import ArraySink, CallbackSink, FileSink, HistogramSink
+
+#-----------------------------------------------------------------------------#
+
+N = int(0.01/1e-5)
+
+@pytest.fixture
+def simulation(tmp_path):
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Diffusion(
+            experiment_time=0.01,
+            increment=1e-5,
+            coordinate_output='coords',
+            collision_output=os.devnull
+        ))
+        yield S
+
+#-----------------------------------------------------------------------------#
+
+def test_array_sink(simulation):
+    '''A sink receives the complete stream through a pipe'''
+    sink = ArraySink('coords', coordinate_t, chunk_size=100)
+    simulation.add_sink(sink)
+    assert len(simulation.matched) == 1
+    simulation.run()
+    assert len(sink.data) == N
+    assert np.all(np.diff(sink.data['t']) > 0)
+    assert sink.records == N
+    assert sink.last == sink.data['t'][-1]
+
+def test_sink_before_producer(tmp_path):
+    '''Sinks can be added before the component producing their input'''
+    sink = ArraySink('flux', timed_value_t)
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add_sink(sink)
+        S.add(Excitation(input='coords', output='flux'))
+        S.add(Diffusion(
+            experiment_time=0.01, increment=1e-5,
+            coordinate_output='coords', collision_output=os.devnull
+        ))
+        assert len(S.matched) == 2
+        S.run()
+    assert len(sink.data) == N
+
+def test_histogram_sink(simulation):
+    '''Histograms accumulate over all chunks'''
+    bins = np.linspace(0, 0.01, 11)
+    sink = HistogramSink('coords', bins, field='t', dtype=coordinate_t, chunk_size=64)
+    simulation.add_sink(sink)
+    simulation.run()
+    assert sink.counts.sum() == N
+    assert np.all(sink.counts[:-1] == 100)
+
+def test_file_sink(simulation, tmp_path):
+    '''File sinks write the stream to disk'''
+    fn = str(tmp_path/'coords.dat')
+    simulation.add_sink(FileSink('coords', fn, coordinate_t))
+    simulation.run()
+    assert len(np.fromfile(fn, coordinate_t)) == N
+
+def test_backpressure(simulation):
+    '''A slow sink throttles the producer instead of losing data'''
+    sizes = []
+    def slow(chunk):
+        sizes.append(len(chunk))
+        time.sleep(0.01)
+    simulation.add_sink(CallbackSink('coords', slow, coordinate_t, chunk_size=50))
+    simulation.run()
+    assert sum(sizes) == N
+    assert len(sizes) == N//50+1
+
+def test_sink_error_stops_run(simulation):
+    '''Errors in a sink abort the simulation'''
+    def fail(chunk):
+        raise ValueError('sink failed')
+    simulation.add_sink(CallbackSink('coords', fail, coordinate_t))
+    with pytest.raises(Exception):
+        simulation.run()
+    assert not simulation.open_pipes
+
+#-----------------------------------------------------------------------------#
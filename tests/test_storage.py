@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+
+'''Tests for compact record files.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, Simulation, coordinate_t, timetag_t
+from pysimfs.storage import TickReader, TickWriter, compact_file, read_compact
+from pysimfs.storage import codecs, shuffle, unshuffle
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def photons():
+    '''Poisson photons at 1e5 counts/s on a 1 ps grid'''
+    rng = np.random.default_rng(0)
+    t = np.cumsum(rng.exponential(1e-5, 250000))
+    return np.round(t/1e-12)*1e-12
+
+#-----------------------------------------------------------------------------#
+
+@pytest.mark.parametrize('codec', sorted(codecs()))
+def test_roundtrip(tmp_path, photons, codec):
+    '''Time tags on the resolution grid are restored exactly'''
+    fn = str(tmp_path/'photons.tick')
+    with TickWriter(fn, timetag_t, resolution=1e-12, chunk_size=100000, codec=codec) as w:
+        for chunk in np.array_split(photons, 7):
+            w.write(chunk)
+    r = TickReader(fn)
+    assert len(r) == len(photons) and len(r.index) == 3
+    assert r.dtype == timetag_t
+    assert np.array_equal(r.read(), photons)
+    assert np.array_equal(r.ticks(0), np.rint(photons[:100000]/1e-12))
+
+def test_compression(tmp_path, photons):
+    '''Photon streams take less than half of their raw size'''
+    raw, fn = str(tmp_path/'raw'), str(tmp_path/'photons.tick')
+    photons.tofile(raw)
+    assert compact_file(raw, fn, timetag_t, resolution=1e-12) == len(photons)
+    assert os.path.getsize(fn) < os.path.getsize(raw)/2
+
+def test_rounding(tmp_path):
+    '''Time stamps are rounded to the resolution'''
+    fn = str(tmp_path/'tags.tick')
+    t = np.array([0.0, 1.2e-9, 2.6e-9, 1.0])
+    with TickWriter(fn, timetag_t, resolution=1e-9) as w:
+        w.write(t)
+    assert np.allclose(read_compact(fn), [0.0, 1e-9, 3e-9, 1.0], rtol=0, atol=1e-18)
+
+def test_structured(tmp_path):
+    '''Other fields of structured records are stored losslessly'''
+    rng = np.random.default_rng(1)
+    coords = np.zeros(50000, coordinate_t)
+    coords['t'] = np.arange(len(coords))*1e-6
+    for f in 'xyz':
+        coords[f] = rng.normal(size=len(coords))
+    fn = str(tmp_path/'coords.tick')
+    with TickWriter(fn, coordinate_t, resolution=1e-9, chunk_size=20000) as w:
+        w.write(coords)
+    r = read_compact(fn)
+    assert r.dtype == coordinate_t
+    for f in 'xyz':
+        assert np.array_equal(r[f], coords[f])
+    assert np.allclose(r['t'], coords['t'], rtol=0, atol=1e-12)
+
+def test_time_range(tmp_path, photons):
+    '''Time ranges only decode the chunks that overlap them'''
+    fn = str(tmp_path/'photons.tick')
+    with TickWriter(fn, timetag_t, chunk_size=10000) as w:
+        w.write(photons)
+    r = TickReader(fn)
+    part = r.read(0.5, 0.75)
+    assert np.array_equal(part, photons[(photons >= 0.5) & (photons < 0.75)])
+    chunks = list(r.iter_chunks(0.5, 0.75))
+    assert len(chunks) < len(r.index)/5
+    assert len(r.read(10.0)) == 0
+
+def test_unsorted_and_empty(tmp_path):
+    '''Unsorted time stamps and empty files are supported'''
+    fn = str(tmp_path/'tags.tick')
+    t = np.array([3.0, 1.0, 2.0, 2.0])
+    with TickWriter(fn, timetag_t, resolution=1e-6) as w:
+        w.write(t)
+    assert np.array_equal(read_compact(fn), t)
+    assert np.array_equal(read_compact(fn, 1.5, 2.5), [2.0, 2.0])
+    with TickWriter(fn, timetag_t) as w:
+        pass
+    assert len(read_compact(fn)) == 0
+
+def test_shuffle():
+    '''Byte shuffling is reversible'''
+    values = np.arange(1000, dtype='u4')*12345
+    assert np.array_equal(unshuffle(shuffle(values), 'u4', 1000), values)
+
+def test_not_compact(tmp_path):
+    '''Other files are rejected'''
+    fn = tmp_path/'raw'
+    np.arange(10.0).tofile(fn)
+    with pytest.raises(ValueError):
+        TickReader(str(fn))
+
+#-----------------------------------------------------------------------------#
+
+def test_store_compact(tmp_path):
+    '''Simulation outputs can be stored in compact files'''
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        S.add(Diffusion(
+            experiment_time=0.01, increment=1e-5,
+            coordinate_output='coords', collision_output=os.devnull
+        ))
+        fn = str(tmp_path/'coords.tick')
+        S.store_compact('coords', fn, resolution=1e-9)
+        with pytest.raises(KeyError):
+            S.store_compact('not_an_output')
+        S.run()
+    coords = read_compact(fn)
+    assert coords.dtype == coordinate_t
+    assert len(coords) == int(0.01/1e-5)
+    assert np.allclose(np.diff(coords['t']), 1e-5)
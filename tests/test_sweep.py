@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+'''Tests for the pysimfs parameter sweep runner.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+import threading
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Diffusion, InProcessCoordinateBuffer, Sweep, grid
+from pysimfs.sweep import ProcessBudget
+
+#-----------------------------------------------------------------------------#
+
+@pytest.fixture
+def diffusion_graph(tmp_path):
+    '''Factory of single diffusion graphs writing to tmp_path'''
+    def factory(experiment_time, seed):
+        return [Diffusion(
+            experiment_time=experiment_time,
+            increment=1e-5,
+            seed=seed,
+            coordinate_output=str(tmp_path/f'coords_{experiment_time}_{seed}'),
+            collision_output=os.devnull
+        )]
+    return factory
+
+#-----------------------------------------------------------------------------#
+
+def test_grid():
+    '''The grid is the cartesian product of all axes'''
+    points = grid(a=[1, 2], b=[3, 4, 5])
+    assert len(points) == 6
+    assert {'a': 2, 'b': 5} in points
+
+def test_sweep_results(diffusion_graph):
+    '''Every grid point yields the results of its own graph'''
+    points = grid(experiment_time=[0.01, 0.02], seed=[1, 2])
+    results = Sweep(diffusion_graph, points, budget=2).run_all()
+    assert [r.point for r in results] == points
+    for r in results:
+        assert r.error is None
+        coords, = r.simulation.get_results().values()
+        assert len(coords) == int(r.point['experiment_time']/1e-5)
+
+def test_factory_list(diffusion_graph):
+    '''Runs can be given as a list of graph factories'''
+    factories = [lambda s=s: diffusion_graph(0.01, s) for s in range(3)]
+    results = list(Sweep(factories))
+    assert sorted(r.index for r in results) == [0, 1, 2]
+
+def test_timeout_and_retry(diffusion_graph):
+    '''Runs exceeding the timeout are retried and reported as failed'''
+    sweep = Sweep(
+        diffusion_graph, [dict(experiment_time=1e4, seed=1)],
+        timeout=0.5, retries=1
+    )
+    r, = sweep.run_all()
+    assert isinstance(r.error, TimeoutError)
+    assert r.attempts == 2
+
+def test_budget_counts_processes(tmp_path, monkeypatch):
+    '''Only components that run as simfs processes take from the budget'''
+    def graph():
+        return [
+            Diffusion(
+                experiment_time=0.01, increment=1e-5,
+                coordinate_output='coords', collision_output=os.devnull
+            ),
+            InProcessCoordinateBuffer(
+                input='coords', outputs=[str(tmp_path/'coords')]
+            ),
+        ]
+    sweep = Sweep([graph], budget=4)
+    acquired = []
+    acquire = sweep.budget.acquire
+    monkeypatch.setattr(
+        sweep.budget, 'acquire', lambda n: acquired.append(n) or acquire(n)
+    )
+    r, = sweep.run_all()
+    assert r.error is None and acquired == [1]
+
+#-----------------------------------------------------------------------------#
+
+def test_budget_limits_concurrency():
+    '''The process budget is never exceeded by concurrent acquisitions'''
+    budget = ProcessBudget(4)
+    peak = []
+
+    def worker(n):
+        n = budget.acquire(n)
+        peak.append(budget.used)
+        budget.release(n)
+
+    threads = [threading.Thread(target=worker, args=(n%3+1,)) for n in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 4
+    assert budget.used == 0
+
+def test_budget_clamps_large_requests():
+    '''Requests larger than the budget run alone'''
+    budget = ProcessBudget(2)
+    assert budget.acquire(10) == 2
+    budget.release(2)
+
+#-----------------------------------------------------------------------------#
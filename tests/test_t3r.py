@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+
+'''Tests for writing and reading T3R files.'''
+
+#-----------------------------------------------------------------------------#
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Mixer, Simulation, T3RWriter, routed_t
+from pysimfs.t3r import T3RFile, decode, read_t3r
+
+#-----------------------------------------------------------------------------#
+
+SYNC_RATE = 10000000
+
+@pytest.fixture
+def simulation(tmp_path):
+    with Simulation(tmpdir=str(tmp_path/'tmp'), datadir=str(tmp_path/'data')) as S:
+        yield S
+
+@pytest.fixture
+def routed(tmp_path):
+    '''Routed time tags over one second on four routes'''
+    rng = np.random.default_rng(0)
+    records = np.empty(100000, routed_t)
+    records['t'] = np.sort(rng.random(len(records)))
+    records['channel'] = rng.integers(0, 4, len(records))
+    records.tofile(tmp_path/'routed')
+    return records
+
+def write_t3r(simulation, tmp_path, **params):
+    '''Utility: runs T3RWriter on the routed fixture file'''
+    fn = str(tmp_path/'photons.t3r')
+    simulation.add(T3RWriter(
+        input=str(tmp_path/'routed'), output_file=fn, SyncRate=SYNC_RATE, **params
+    ))
+    simulation.run()
+    return fn
+
+#-----------------------------------------------------------------------------#
+
+def test_roundtrip(simulation, tmp_path, routed):
+    '''Time tags, routes and arrival times are restored'''
+    f = T3RFile(write_t3r(simulation, tmp_path))
+    assert f.sync_rate == SYNC_RATE and f.ident.startswith('SiMFS')
+    # a second spans many overflows of the 16 bit time tag
+    assert len(f) > len(routed) + SYNC_RATE // (1 << 16) - 1
+
+    photons = f.read()
+    assert len(photons) == len(routed)
+    assert np.array_equal(photons['route'], routed['channel'])
+    # floor of the time in sync periods, up to rounding of the product
+    periods = routed['t'] * SYNC_RATE
+    assert np.all(np.abs(photons['timetag'] - np.floor(periods)) <= 1)
+    assert np.allclose(f.seconds(photons), routed['t'], rtol=0, atol=1.0/SYNC_RATE)
+
+def test_chunks(simulation, tmp_path, routed):
+    '''Block by block decoding carries the overflows across blocks'''
+    f = T3RFile(write_t3r(simulation, tmp_path))
+    chunks = list(f.iter_chunks(chunk_size=999))
+    assert len(chunks) > 1
+    assert np.array_equal(np.concatenate(chunks), f.read())
+
+    timetag, channel, route, sync_rate = read_t3r(f.filename)
+    assert np.array_equal(timetag, f.read()['timetag'])
+    assert np.all(np.diff(timetag.astype('i8')) >= 0)
+
+def test_decode_overflow():
+    '''Overflow records add 65536 to later time tags, markers are dropped'''
+    words = np.array([
+        (1 << 30) | (1 << 28) | (7 << 16) | 5, # photon, route 1, channel 7
+        1 << 27,                               # overflow
+        1 << 27,                               # overflow
+        0x0001,                                # marker
+        (1 << 30) | 3,                         # photon
+    ], '<u4')
+    photons, overflows = decode(words, overflows=1)
+    assert overflows == 3
+    assert photons['timetag'].tolist() == [65536 + 5, 3*65536 + 3]
+    assert photons['channel'].tolist() == [7, 0]
+    assert photons['route'].tolist() == [1, 0]
+
+def test_routed_mixer_feeds_writer(simulation, tmp_path):
+    '''The routed output of a Mixer is matched with the T3RWriter input'''
+    inputs = []
+    for i in range(2):
+        tags = np.sort(np.random.default_rng(i).random(1000)) * 1e-3
+        tags.tofile(tmp_path/f'tags{i}')
+        inputs.append(str(tmp_path/f'tags{i}'))
+    simulation.add(Mixer(inputs=inputs, output='mixed', routed=True))
+    simulation.add(T3RWriter(
+        input='mixed', output_file=str(tmp_path/'mixed.t3r'), SyncRate=SYNC_RATE
+    ))
+    assert not simulation.unmatched_out and len(simulation.matched) == 1
+    simulation.run()
+    photons = T3RFile(str(tmp_path/'mixed.t3r')).read()
+    assert len(photons) == 2000
+    assert np.bincount(photons['route']).tolist() == [1000, 1000]
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+
+'''Tests for pysimfs grid data utilities.'''
+
+#-----------------------------------------------------------------------------#
+
+# stdlib
+import os
+
+# 3rd party
+import numpy as np
+import pytest
+
+# package
+from pysimfs import Precalculate, Simulation, coordinate_t
+from pysimfs.utils import GridData, PrecalculatedGridData
+
+#-----------------------------------------------------------------------------#
+
+SPACE = [(-1e-6, 1e-6, 21), (-1e-6, 1e-6, 11), (-2e-6, 2e-6, 5)]
+
+@pytest.fixture(scope='module')
+def grid_file(tmp_path_factory) -> str:
+    '''Writes a GridData file with values f(x, y, z) = x + 2y + 3z'''
+    fn = str(tmp_path_factory.mktemp('grid')/'grid.dat')
+    header = np.array(SPACE, dtype=GridData.LinSpace_t)
+    x, y, z = np.meshgrid(*(np.linspace(*s) for s in SPACE), indexing='ij')
+    with open(fn, 'wb') as f:
+        f.write(header.tobytes())
+        f.write((x + 2*y + 3*z).tobytes())
+    return fn
+
+@pytest.fixture(scope='module')
+def focus_file(tmp_path_factory) -> str:
+    '''Precalculates a gaussian focus with simfs_pre'''
+    fn = str(tmp_path_factory.mktemp('focus')/'focus.dat')
+    grid = {k: dict(min=s[0], max=s[1], n=s[2]) for k, s in zip('xyz', SPACE)}
+    pre = Precalculate(filename=fn, grid=grid)
+    Simulation.call_simfs(pre.call, **pre._params)
+    return fn
+
+def coordinates(x, y, z):
+    c = np.zeros(len(x), dtype=coordinate_t)
+    c['x'], c['y'], c['z'] = x, y, z
+    return c
+
+#-----------------------------------------------------------------------------#
+
+def test_header(grid_file):
+    '''The header is parsed into linspaces and deltas'''
+    g = GridData(grid_file)
+    assert g.shape.x.n == 21
+    assert g.data.shape == (21, 11, 5)
+    assert np.isclose(g.delta.x, 1e-7)
+    assert np.isclose(g.delta.z, 1e-6)
+    assert isinstance(g.data, np.memmap)
+
+def test_index_matches_delta(grid_file):
+    '''Scalar indices use the same bin width as delta'''
+    g = GridData(grid_file)
+    for i, x in enumerate(g.axes.x):
+        assert g._ix(x) == i
+    assert g._ix(-1) == 0
+    assert g._ix(1) == 20
+
+def test_nearest(grid_file):
+    '''Nearest neighbour lookup returns the closest grid value'''
+    g = GridData(grid_file)
+    c = coordinates([0.04e-6, 0.06e-6, 5e-6], [0, 0, 0], [0, 0, 0])
+    assert np.allclose(g.nearest(c), [0, 0.1e-6, 1e-6])
+
+def test_interpolate_linear_function(grid_file):
+    '''Trilinear interpolation is exact for linear functions inside the grid'''
+    g = GridData(grid_file)
+    rng = np.random.default_rng(0)
+    x, y, z = (rng.uniform(s[0], s[1], 10000) for s in SPACE)
+    c = coordinates(x, y, z)
+    assert np.allclose(g.interpolate(c, chunk_size=999), x + 2*y + 3*z)
+    xyz = np.stack([x, y, z], axis=1)
+    assert np.allclose(g.interpolate(xyz), x + 2*y + 3*z)
+
+def test_interpolate_clamps(grid_file):
+    '''Coordinates outside of the grid take the border values'''
+    g = GridData(grid_file)
+    c = coordinates([5e-6], [-5e-6], [0])
+    assert np.allclose(g.interpolate(c), 1e-6 - 2e-6)
+
+def test_precalculated(focus_file):
+    '''Precalculated foci are read after the normalization header'''
+    g = PrecalculatedGridData(focus_file)
+    assert g.data.shape == (21, 11, 5)
+    assert g.norm[0] == 1.0
+    c = coordinates([0, 1e-7, 1e-5], [0, 0, 0], [0, 0, 0])
+    values = g.interpolate(c)
+    assert np.isclose(values[0], g.data.max())
+    assert values[0] > values[1] > values[2]
+    assert np.allclose(g.nearest(c), values)
+
+#-----------------------------------------------------------------------------#